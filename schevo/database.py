@@ -8,11 +8,15 @@ from schevo.lib import optimize
 
 from schevo import database1
 from schevo import database2
+from schevo.database2 import _BTreeInserter
+from schevo import database3
 from schevo.error import (
-    DatabaseAlreadyExists, DatabaseDoesNotExist, DatabaseFormatMismatch)
+    DatabaseAlreadyExists, DatabaseDoesNotExist, DatabaseFormatMismatch,
+    DatabaseFormatUnsupported)
 from schevo.field import not_fget
 from schevo import icon
 from schevo.label import relabel
+from schevo.lib.progress import Indicator
 from schevo.store.connection import Connection
 from schevo.store.file_storage import FileStorage
 from schevo.trace import log
@@ -25,11 +29,13 @@ format_dbclass = {
     # Format-specific database classes.
     1: database1.Database,
     2: database2.Database,
+    3: database3.Database,
     }
 
 
 format_converter = {
     2: database2.convert_from_format1,
+    3: database3.convert_from_format2,
     }
 
 
@@ -66,16 +72,24 @@ def convert_format(filename, backend_name=None, backend_args={}, format=None):
     backend.close()
 
 
-def copy(src_filename, dest_filename, dest_backend_name, dest_backend_args={}):
+def copy(src_filename, dest_filename, dest_backend_name, dest_backend_args={},
+         commit_interval=1000, progress=False):
     """Copy internal structures verbatim from a source database to a
     new destination database.
 
+    The copy is streamed: changes are committed to the destination every
+    `commit_interval` objects, and the source and destination caches are
+    then allowed to shrink, so memory use does not grow with the size of
+    the database.  BTrees are filled in key order using the destination
+    backend's `BTreeBuilder`, when it has one.
+
     To see progress of the copy operation, turn on tracing as
-    described in `schevo.trace`
+    described in `schevo.trace`, or pass `progress=True`.
 
     - `src_filename`: Filename of the source database.  Schevo must be
       able to open the source database using backend autodetection,
-      and by using default backend arguments.
+      and by using default backend arguments.  It must be in format 2
+      or 3, and the copy is made in the same format.
     - `dest_filename`: Filename of the destination database. This file
       may exist if it is in the format used by the destination
       backend, but must not already contain a Schevo database.
@@ -83,6 +97,10 @@ def copy(src_filename, dest_filename, dest_backend_name, dest_backend_args={}):
       the destination database.
     - `dest_backend_args`: (optional) Arguments to pass to the
       backend.
+    - `commit_interval`: (optional) Number of entities, links, and
+      index entries to copy between commits.
+    - `progress`: (optional) If `True`, show the percentage of entities
+      copied using `schevo.lib.progress.Indicator`.
     """
     src_backend = new_backend(src_filename)
     # Make sure the source backend is in the proper format.
@@ -92,10 +110,9 @@ def copy(src_filename, dest_filename, dest_backend_name, dest_backend_args={}):
         src_backend.close()
         raise DatabaseDoesNotExist(src_filename)
     current_format = src_root['SCHEVO']['format']
-    required_format = 2
-    if current_format != required_format:
+    if current_format not in (2, 3):
         src_backend.close()
-        raise DatabaseFormatMismatch(current_format, required_format)
+        raise DatabaseFormatMismatch(current_format, 2)
     # Make sure the destination backend does not have a database.
     assert log(1, 'Checking destination', src_filename)
     dest_backend = new_backend(
@@ -105,33 +122,56 @@ def copy(src_filename, dest_filename, dest_backend_name, dest_backend_args={}):
         src_backend.close()
         dest_backend.close()
         raise DatabaseAlreadyExists(dest_filename)
+    d_record = getattr(dest_backend, 'EntityRecord', None)
+    if current_format == 3 and d_record is None:
+        src_backend.close()
+        dest_backend.close()
+        raise DatabaseFormatUnsupported(current_format, dest_backend)
     assert log(1, 'Start copying structures.')
     d_btree = dest_backend.BTree
     d_pdict = dest_backend.PDict
     d_plist = dest_backend.PList
-    s_btree = src_backend.BTree
     assert log(2, 'Creating SCHEVO key.')
     src_SCHEVO = src_root['SCHEVO']
     dest_SCHEVO = dest_root['SCHEVO'] = d_pdict()
     assert log(2, 'Copying lightweight structures.')
     if 'label' in src_SCHEVO:
         dest_SCHEVO['label'] = src_SCHEVO['label']
-    dest_SCHEVO['format'] = 2
+    dest_SCHEVO['format'] = current_format
     dest_SCHEVO['version'] = src_SCHEVO['version']
     dest_SCHEVO['schema_source'] = src_SCHEVO['schema_source']
     dest_SCHEVO['extent_name_id'] = d_pdict(
         src_SCHEVO['extent_name_id'].iteritems())
     assert log(2, 'Copying extents.')
     dest_extents = dest_SCHEVO['extents'] = d_pdict()
-    def copy_btree(src):
-        """Used for copying indices structure."""
-        copy = d_btree()
+    BTreeBuilder = getattr(dest_backend, 'BTreeBuilder', _BTreeInserter)
+    copied = [0]
+    def tick():
+        """Commit every `commit_interval` objects."""
+        copied[0] += 1
+        if copied[0] % commit_interval == 0:
+            dest_backend.commit()
+            src_backend.rollback()
+    def copy_btree(src, dest, depth):
+        """Used for copying indices structure; `depth` is the number of
+        levels of branches below `src`.  `dest` is an empty BTree that
+        is already part of the destination database."""
+        builder = BTreeBuilder(dest)
         for key, value in src.iteritems():
-            if isinstance(value, s_btree):
-                value = copy_btree(value)
-            copy[key] = value
-        return copy
-    for extent_id, src_extent in src_SCHEVO['extents'].iteritems():
+            if depth > 0:
+                dest_value = d_btree()
+                builder.add(key, dest_value)
+                copy_btree(value, dest_value, depth - 1)
+            else:
+                builder.add(key, value)
+                tick()
+        builder.finish()
+    src_extents = src_SCHEVO['extents']
+    if progress:
+        total = sum(src_extent['len'] for src_extent in src_extents.values())
+        indicator = Indicator(total or 1)
+    entity_count = 0
+    for extent_id, src_extent in src_extents.iteritems():
         extent_name = src_extent['name']
         assert log(2, 'Creating extent', extent_name)
         dest_extent = dest_extents[extent_id] = d_pdict()
@@ -148,22 +188,38 @@ def copy(src_filename, dest_filename, dest_backend_name, dest_backend_args={}):
         assert log(2, 'Copying', len(src_extent['entities']), 'entities in',
             extent_name)
         dest_entities = dest_extent['entities'] = d_btree()
+        entities_builder = BTreeBuilder(dest_entities)
         for entity_oid, src_entity in src_extent['entities'].iteritems():
             assert log(3, 'Copying', entity_oid)
-            dest_entity = dest_entities[entity_oid] = d_pdict()
-            dest_entity['rev'] = src_entity['rev']
-            dest_entity['fields'] = d_pdict(src_entity['fields'].iteritems())
-            dest_entity['link_count'] = src_entity['link_count']
-            src_links = src_entity['links']
-            dest_links = dest_entity['links'] = d_pdict()
-            for key, value in src_links.iteritems():
+            if current_format == 3:
+                dest_entity = d_record(
+                    src_entity['fields'],
+                    src_entity['related_entities'],
+                    src_entity['rev'],
+                    src_entity['link_count'],
+                    )
+                entities_builder.add(entity_oid, dest_entity)
+            else:
+                dest_entity = d_pdict()
+                entities_builder.add(entity_oid, dest_entity)
+                dest_entity['rev'] = src_entity['rev']
+                dest_entity['fields'] = d_pdict(
+                    src_entity['fields'].iteritems())
+                dest_entity['link_count'] = src_entity['link_count']
+                dest_entity['links'] = d_pdict()
+                dest_entity['related_entities'] = d_pdict(
+                    src_entity['related_entities'].iteritems())
+            dest_links = dest_entity['links']
+            for key, src_link_tree in src_entity['links'].iteritems():
                 links = dest_links[key] = d_btree()
                 # Do not use update() since schevo.store, durus, and zodb
                 # all have slightly different, incompatible, versions.
-                for k, v in src_links[key].iteritems():
-                    links[k] = v
-            dest_entity['related_entities'] = d_pdict(
-                src_entity['related_entities'].iteritems())
+                copy_btree(src_link_tree, links, 0)
+            tick()
+            if progress:
+                entity_count += 1
+                indicator.update(entity_count)
+        entities_builder.finish()
         assert log(2, 'Copying indices for', extent_name)
         dest_extent['index_map'] = d_pdict(
             (k, d_plist(v))
@@ -176,11 +232,18 @@ def copy(src_filename, dest_filename, dest_backend_name, dest_backend_args={}):
             in src_extent['normalized_index_map'].iteritems()
             )
         dest_indices = dest_extent['indices'] = d_btree()
+        indices_builder = BTreeBuilder(dest_indices)
         for index_spec, src_index_data in src_extent['indices'].iteritems():
             unique, src_index_tree = src_index_data
-            dest_indices[index_spec] = (unique, copy_btree(src_index_tree))
+            dest_index_tree = d_btree()
+            indices_builder.add(index_spec, (unique, dest_index_tree))
+            copy_btree(src_index_tree, dest_index_tree, len(index_spec))
+        indices_builder.finish()
         assert log(2, 'Done copying', extent_name, '-- committing to disk')
         dest_backend.commit()
+        src_backend.rollback()
+    if progress:
+        indicator.finish()
     # Finalize.
     assert log(1, 'Close source.')
     src_backend.close()
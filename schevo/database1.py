@@ -30,6 +30,48 @@ class Database(database2.Database):
     data structures.
     """
 
+    def _bulk_create_entities(self, extent_name, rows, validate=True,
+                              commit_interval=None):
+        """Create entities from rows of field values, bypassing
+        transactions; return the number of entities created.
+
+        Format 1 stores links and entity references differently, so each
+        entity is created and indexed in turn with `_create_entity`.  See
+        the format 2 method for a description of the arguments.
+        """
+        if self._executing:
+            raise error.DatabaseExecutingTransaction(
+                'Cannot bulk create entities while executing a transaction.')
+        field_id_name = self._extent_map(extent_name)['field_id_name']
+        created = []
+        try:
+            for fields_by_id, related_entities_by_id in (
+                self._bulk_dumped_rows(extent_name, rows, validate)):
+                fields = dict(
+                    (field_id_name[field_id], value)
+                    for field_id, value in fields_by_id.iteritems()
+                    )
+                related_entities = dict(
+                    (field_id_name[field_id], related_set)
+                    for field_id, related_set
+                    in related_entities_by_id.iteritems()
+                    )
+                created.append(
+                    self._create_entity(extent_name, fields, related_entities))
+                if commit_interval and len(created) % commit_interval == 0:
+                    self._commit()
+        except:
+            # Remove the entities that were committed.
+            self._rollback()
+            entities = self._extent_map(extent_name)['entities']
+            for oid in reversed(created):
+                if oid in entities:
+                    self._delete_entity(extent_name, oid)
+            self._commit()
+            raise
+        self._commit()
+        return len(created)
+
     def _create_entity(self, extent_name, fields, related_entities,
                        oid=None, rev=None):
         """Create a new entity in an extent; return the oid.
@@ -158,8 +200,9 @@ class Database(database2.Database):
             extent_map['next_oid'] = old_next_oid
             raise
 
-    def _delete_entity(self, extent_name, oid):
+    def _delete_entity(self, extent_name, oid, deletes=None):
         entity_map, extent_map = self._entity_extent_map(extent_name, oid)
+        self._uncache_field_values(extent_name, oid, entity_map['rev'])
         extent_id = extent_map['id']
         extent_name_id = self._extent_name_id
         extent_maps_by_id = self._extent_maps_by_id
@@ -170,14 +213,8 @@ class Database(database2.Database):
         # Disallow deletion if other entities refer to this one,
         # unless all references are merely from ourself or an entity
         # that will be deleted.
-        deletes = set()
-        executing = self._executing
-        if executing:
-            tx = executing[-1]
-            deletes.update([(extent_name_id[del_entity_cls.__name__], del_oid)
-                            for del_entity_cls, del_oid in tx._deletes])
-            deletes.update([(extent_name_id[del_entity_cls.__name__], del_oid)
-                            for del_entity_cls, del_oid in tx._known_deletes])
+        if deletes is None:
+            deletes = self._executing_deletes()
         for (other_extent_id, other_field_id), others in links.iteritems():
             for other_oid in others:
                 if (other_extent_id, other_oid) in deletes:
@@ -426,6 +463,7 @@ class Database(database2.Database):
         # necessary.
         entity_classes = self._entity_classes
         entity_map, extent_map = self._entity_extent_map(extent_name, oid)
+        self._uncache_field_values(extent_name, oid, entity_map['rev'])
         field_name_id = extent_map['field_name_id']
         entity_field_ids = extent_map['entity_field_ids']
         extent_name_id = self._extent_name_id
@@ -6,6 +6,9 @@
 import sys
 from schevo.lib import optimize
 
+from heapq import heappop, heappush
+from itertools import groupby
+from operator import itemgetter
 import os
 import random
 
@@ -14,7 +17,7 @@ import louie
 from schevo import base
 from schevo import change
 from schevo.change import CREATE, UPDATE, DELETE
-from schevo.constant import UNASSIGNED
+from schevo.constant import DEFAULT, UNASSIGNED
 from schevo.counter import schema_counter
 from schevo import error
 from schevo.entity import Entity
@@ -22,6 +25,7 @@ from schevo.extent import Extent
 from schevo.field import Entity as EntityField
 from schevo.field import not_fget
 from schevo.lib import module
+from schevo.lib.sort import ExternalSort, merge
 from schevo.mt.dummy import dummy_lock
 from schevo.namespace import NamespaceExtension
 from schevo.placeholder import Placeholder
@@ -29,7 +33,7 @@ import schevo.schema
 from schevo.signal import TransactionExecuted
 from schevo.trace import log
 from schevo.transaction import (
-    CallableWrapper, Combination, Initialize, Populate, Transaction)
+    CallableWrapper, Combination, Initialize, Populate, Transaction, resolve)
 
 
 class Database(base.Database):
@@ -39,10 +43,19 @@ class Database(base.Database):
     data structures.
     """
 
+    # By default, don't cache field values.  Set to True to keep the
+    # restored values of entity fields that are read, until the entity
+    # is updated or deleted, or a transaction is rolled back.
+    cache_field_values = False
+
     # By default, don't dispatch signals.  Set to True to dispatch
     # TransactionExecuted signals.
     dispatch = False
 
+    # Number of entities whose field values may be cached before the
+    # field value cache is emptied.
+    field_cache_size = 10000
+
     # See dummy_lock documentation.
     read_lock = dummy_lock
     write_lock = dummy_lock
@@ -58,9 +71,13 @@ class Database(base.Database):
         self._PDict = backend.PDict
         self._PList = backend.PList
         self._root = backend.get_root()
-        # Shortcuts to coarse-grained commit and rollback.
+        # Shortcut to coarse-grained commit.
         self._commit = backend.commit
-        self._rollback = backend.rollback
+        # Restored field values keyed by (extent name, OID, revision);
+        # see `cache_field_values`.
+        self._field_cache = {}
+        self.field_cache_hits = 0
+        self.field_cache_misses = 0
         # Keep track of schema modules remembered.
         self._remembered = []
         # Initialization.
@@ -227,11 +244,69 @@ class Database(base.Database):
         if os.environ.get('SCHEVO_NOPACK', '').strip() != '1':
             self.backend.pack()
 
+    def start_pack(self, rate=None):
+        """Start packing the database without blocking transactions,
+        and return an object that reports the progress of the pack, or
+        `None` if the database was packed already.
+
+        Backends that support it, such as `schevo.store`, copy the live
+        objects in a background thread while transactions continue to be
+        executed.  The packed file replaces the database file at the end
+        of the first transaction executed after copying is finished, or
+        when the returned object's `finish` method is called.  The
+        returned object also has `get_progress`, `cancel`, and `wait`
+        methods, and a `bytes_reclaimed` attribute that is set once the
+        pack is done.
+
+        Other backends are packed before this method returns.
+
+        - `rate`: (optional) The most bytes per second to read while
+          copying, to limit the effect of packing on other I/O.
+        """
+        if os.environ.get('SCHEVO_NOPACK', '').strip() == '1':
+            return None
+        start_pack = getattr(self.backend, 'start_pack', None)
+        if start_pack is None:
+            self.backend.pack()
+            return None
+        return start_pack(rate=rate)
+
     def populate(self, sample_name=''):
         """Populate the database with sample data."""
         tx = Populate(sample_name)
         self.execute(tx)
 
+    def wait_durable(self):
+        """Wait until the transactions executed so far are written to
+        disk.
+
+        Only needed with backends that can be told not to wait for each
+        commit, such as `schevo.store` with `durability=group`.  Does
+        nothing otherwise.  Callers that serialize transactions with a
+        lock should release it before waiting, so that transactions from
+        other threads can be written to disk in the same group.
+        """
+        wait_durable = getattr(self.backend, 'wait_durable', None)
+        if wait_durable is not None:
+            wait_durable()
+
+    def warm_cache(self, extent_names=None):
+        """Load the internal structures of extents into the backend's
+        object cache, so that later access to them does not read them
+        from storage one object at a time.
+
+        Does nothing if the backend does not support preloading.
+
+        - `extent_names`: (optional) Names of the extents to load.  If
+          `None`, all extents are loaded.
+        """
+        preload = getattr(self.backend, 'preload', None)
+        if preload is None:
+            return
+        if extent_names is None:
+            extent_names = self.extent_names()
+        preload([self._extent_map(name) for name in extent_names])
+
     @property
     def format(self):
         return self._root['SCHEVO']['format']
@@ -280,6 +355,239 @@ class Database(base.Database):
         if executing:
             executing[-1]._inversions.append((method, args, kw))
 
+    def _bulk_create_entities(self, extent_name, rows, validate=True,
+                              commit_interval=None):
+        """Create entities from rows of field values, bypassing
+        transactions; return the number of entities created.
+
+        Instead of inserting each new entity into every index and adding
+        each of its links as it is created, the index entries and links
+        of the new entities are collected and sorted, spilling to
+        temporary files if there are many, and the index and link BTrees
+        are built from the bottom up once all entities have been
+        written.  Key uniqueness is checked while each index is merged
+        with its existing entries.  New indices are built under the
+        extent's 'bulk_indices' key, and replace the extent's indices
+        once all of them are complete.
+
+        - `extent_name`: Name of the extent to create entities in.
+
+        - `rows`: Iterable of rows, each a dictionary of
+          field_name:field_value mappings, or a tuple of field values in
+          the order the extent's stored fields are defined.  Values are
+          given as they would be to a create transaction, and converted
+          the same way.  Fields not given get their default values.
+
+        - `validate`: (optional) `False` to skip validation of the field
+          values.  Entities that are referred to must exist either way.
+
+        - `commit_interval`: (optional) Number of entities, index
+          entries, and links to write between commits, so that memory
+          use stays bounded however many rows there are.  If `None`,
+          everything is committed at once.
+
+        If an error occurs, including a key collision, the entities
+        created and the new indices are removed again.  If the process
+        is interrupted after a commit, entities may be left that are
+        missing from the extent's indices, and the next bulk creation
+        in the extent discards the new indices left behind.
+        """
+        if self._executing:
+            raise error.DatabaseExecutingTransaction(
+                'Cannot bulk create entities while executing a transaction.')
+        extent_map = self._extent_map(extent_name)
+        extent_id = self._extent_name_id[extent_name]
+        extent_maps_by_id = self._extent_maps_by_id
+        entities = extent_map['entities']
+        indices = extent_map['indices']
+        BTree = self._BTree
+        BTreeBuilder = getattr(self.backend, 'BTreeBuilder', _BTreeInserter)
+        new_entity_map = self._new_entity_map
+        commit = self._commit
+        first_oid = oid = extent_map['next_oid']
+        extent_was_empty = not entities
+        if extent_was_empty:
+            entities_builder = BTreeBuilder(entities)
+        else:
+            # New OIDs sort after existing ones, so new entities are
+            # inserted at the right edge of the BTree.
+            entities_builder = _BTreeInserter(entities)
+        field_id_name = extent_map['field_id_name']
+        index_sorts = [(index_spec, ExternalSort())
+                       for index_spec in indices.iterkeys()]
+        link_sort = ExternalSort()
+        written = [0]
+        def tick():
+            """Commit every `commit_interval` objects written."""
+            written[0] += 1
+            if commit_interval and written[0] % commit_interval == 0:
+                extent_map['next_oid'] = oid
+                commit()
+        try:
+            try:
+                # Write entities, collecting their index entries and links.
+                for fields_by_id, related_entities_by_id in (
+                    self._bulk_dumped_rows(extent_name, rows, validate)):
+                    for field_id, related_set in (
+                        related_entities_by_id.iteritems()):
+                        for placeholder in related_set:
+                            other_extent_id = placeholder.extent_id
+                            other_oid = placeholder.oid
+                            if other_extent_id == extent_id:
+                                # The entities BTree may not be usable
+                                # until it is finished.
+                                exists = (
+                                    first_oid <= other_oid < oid
+                                    or (not extent_was_empty
+                                        and other_oid in entities)
+                                    )
+                            else:
+                                exists = other_oid in extent_maps_by_id[
+                                    other_extent_id]['entities']
+                            if not exists:
+                                raise error.EntityDoesNotExist(
+                                    extent_maps_by_id[other_extent_id][
+                                        'name'],
+                                    field_name=field_id_name[field_id])
+                            link_sort.add(
+                                (other_extent_id, other_oid, field_id, oid))
+                    for index_spec, index_sort in index_sorts:
+                        index_sort.add(tuple(
+                            fields_by_id[field_id] for field_id in index_spec
+                            ) + (oid,))
+                    entities_builder.add(oid, new_entity_map(
+                        fields_by_id, related_entities_by_id, 0))
+                    oid += 1
+                    tick()
+                entities_builder.finish()
+                # Merge the new index entries with the existing ones into
+                # new indices, which are reachable while they are built
+                # so that commits can store them.
+                new_indices = extent_map['bulk_indices'] = self._PDict()
+                for index_spec, index_sort in index_sorts:
+                    unique, branch = indices[index_spec]
+                    entries = iter(index_sort)
+                    if branch:
+                        entries = merge(
+                            _index_entries(branch, len(index_spec)), entries)
+                    new_branch = new_indices[index_spec] = BTree()
+                    _build_index(extent_map, index_spec, unique, entries,
+                                 new_branch, BTree, BTreeBuilder, tick)
+                    index_sort.close()
+            except:
+                # Remove the entities and new indices that were committed.
+                self._rollback()
+                if 'bulk_indices' in extent_map:
+                    del extent_map['bulk_indices']
+                if extent_was_empty:
+                    extent_map['entities'] = BTree()
+                else:
+                    for created_oid in xrange(first_oid, oid):
+                        if created_oid in entities:
+                            del entities[created_oid]
+                commit()
+                raise
+            for index_spec, branch in new_indices.iteritems():
+                unique = indices[index_spec][0]
+                indices[index_spec] = (unique, branch)
+            del extent_map['bulk_indices']
+            extent_map['next_oid'] = oid
+            extent_map['len'] += oid - first_oid
+            # Add links from the new entities to the entities they refer
+            # to, which were all found to exist above.
+            other_entity_map = links_builder = None
+            last_entity_key = last_link_key = None
+            link_count = 0
+            for other_extent_id, other_oid, field_id, referrer_oid in (
+                link_sort):
+                entity_key = (other_extent_id, other_oid)
+                link_key = (extent_id, field_id)
+                if entity_key != last_entity_key or link_key != last_link_key:
+                    if links_builder is not None:
+                        links_builder.finish()
+                    if entity_key != last_entity_key:
+                        if other_entity_map is not None:
+                            other_entity_map['link_count'] += link_count
+                        other_entity_map = extent_maps_by_id[
+                            other_extent_id]['entities'][other_oid]
+                        links = other_entity_map['links']
+                        link_count = 0
+                    if link_key in links:
+                        mapping = links[link_key]
+                    else:
+                        mapping = links[link_key] = BTree()
+                    if mapping:
+                        links_builder = _BTreeInserter(mapping)
+                    else:
+                        links_builder = BTreeBuilder(mapping)
+                    last_entity_key = entity_key
+                    last_link_key = link_key
+                links_builder.add(referrer_oid, None)
+                link_count += 1
+                tick()
+            if links_builder is not None:
+                links_builder.finish()
+                other_entity_map['link_count'] += link_count
+            commit()
+        finally:
+            for index_spec, index_sort in index_sorts:
+                index_sort.close()
+            link_sort.close()
+        return oid - first_oid
+
+    def _bulk_dumped_rows(self, extent_name, rows, validate=True):
+        """Generate the field values to store, and the related entity
+        sets, for rows given to `_bulk_create_entities`, as
+        `(fields_by_id, related_entities_by_id)` tuples."""
+        extent = self._extents[extent_name]
+        field_name_id = self._extent_map(extent_name)['field_name_id']
+        # Use one field instance per field to convert, validate, and dump
+        # the values of every row.
+        fields = []
+        for name, FieldClass in extent.field_spec.iteritems():
+            if FieldClass.fget is not None:
+                continue
+            field = FieldClass(extent)
+            default = FieldClass.default[0]
+            if FieldClass.may_store_entities and not callable(default):
+                default = resolve(self, name, default, FieldClass)
+            fields.append((name, field_name_id[name], field, default))
+        field_names = [name for name, field_id, field, default in fields]
+        known_names = frozenset(field_names)
+        for row in rows:
+            if isinstance(row, dict):
+                for name in row:
+                    if name not in known_names:
+                        raise error.FieldDoesNotExist(extent_name, name)
+            else:
+                if len(row) > len(field_names):
+                    raise ValueError(
+                        'Row %r has more values than %s has fields %r.'
+                        % (row, extent_name, field_names))
+                row = dict(zip(field_names, row))
+            fields_by_id = {}
+            related_entities_by_id = {}
+            for name, field_id, field, default in fields:
+                value = row.get(name, DEFAULT)
+                if value is DEFAULT:
+                    value = default
+                    while callable(value) and value is not UNASSIGNED:
+                        value = value()
+                if value is None:
+                    raise ValueError(
+                        '%s value of None is not allowed by %s'
+                        % (name, extent_name))
+                if value is not UNASSIGNED:
+                    value = field.convert(value, self)
+                field._value = value
+                if validate:
+                    field.validate(value)
+                fields_by_id[field_id] = field._dump()
+                if field.may_store_entities:
+                    related_entities_by_id[field_id] = (
+                        field._entities_in_value())
+            yield fields_by_id, related_entities_by_id
+
     def _by_entity_oids(self, extent_name, *index_spec):
         """Return a list of OIDs from an extent sorted by index_spec."""
         extent_map = self._extent_map(extent_name)
@@ -313,6 +621,20 @@ class Database(base.Database):
         _walk_index(branch, ascending, oids)
         return oids
 
+    def _cached_field_values(self, extent_name, oid):
+        """Return the dictionary of restored field values cached for the
+        current revision of an entity, keyed by field name."""
+        rev = self._entity_rev(extent_name, oid)
+        key = (extent_name, oid, rev)
+        cache = self._field_cache
+        try:
+            return cache[key]
+        except KeyError:
+            if len(cache) >= self.field_cache_size:
+                cache.clear()
+            values = cache[key] = {}
+            return values
+
     def _create_entity(self, extent_name, fields, related_entities,
                        oid=None, rev=None):
         """Create a new entity in an extent; return the oid.
@@ -345,7 +667,6 @@ class Database(base.Database):
         links_created = []
         lc_append = links_created.append
         BTree = self._BTree
-        PDict = self._PDict
         try:
             if oid is None:
                 oid = extent_map['next_oid']
@@ -355,7 +676,7 @@ class Database(base.Database):
             if oid in entities:
                 raise error.EntityExists(extent_name, oid)
             # Create fields_by_id dict with field-id:field-value items.
-            fields_by_id = PDict()
+            fields_by_id = {}
             for name, value in fields.iteritems():
                 field_id = field_name_id[name]
                 fields_by_id[field_id] = value
@@ -363,7 +684,7 @@ class Database(base.Database):
             # field-id:related-entities items.
             new_links = []
             nl_append = new_links.append
-            related_entities_by_id = PDict()
+            related_entities_by_id = {}
             for name, related_entity_set in related_entities.iteritems():
                 field_id = field_name_id[name]
                 related_entities_by_id[field_id] = related_entity_set
@@ -412,14 +733,8 @@ class Database(base.Database):
                 other_entity_map['link_count'] += 1
                 lc_append((other_entity_map, links, link_key, oid))
             # Create the actual entity.
-            entity_map = entities[oid] = PDict()
-            entity_map['fields'] = fields_by_id
-            # XXX flesh out links based on who is capable of linking
-            # to this one.
-            entity_map['link_count'] = 0
-            entity_map['links'] = PDict()
-            entity_map['related_entities'] = related_entities_by_id
-            entity_map['rev'] = rev
+            entities[oid] = self._new_entity_map(
+                fields_by_id, related_entities_by_id, rev)
             # Update the extent.
             extent_map['len'] += 1
             # Allow inversion of this operation.
@@ -438,8 +753,97 @@ class Database(base.Database):
             extent_map['next_oid'] = old_next_oid
             raise
 
-    def _delete_entity(self, extent_name, oid):
+    def _delete_entities(self, entities):
+        """Delete the entities given as (extent_name, oid) pairs.
+
+        The entities may refer to each other, but not be referred to by
+        entities that are not being deleted.
+
+        Entities are deleted after the entities that refer to them, so
+        that the inversions of the deletes re-create every entity after
+        the entities it refers to.  When entities refer to each other in
+        a cycle, or to themselves, the fields of the referrers that hold
+        those references are unassigned first.  Otherwise entities are
+        deleted in order of extent name and OID, so that entities and
+        index entries that are near each other are removed together.
+        """
+        extent_name_id = self._extent_name_id
+        extent_maps_by_id = self._extent_maps_by_id
+        keys = sorted((extent_name_id[extent_name], oid)
+                      for extent_name, oid in entities)
+        batch = set(keys)
+        deletes = self._executing_deletes()
+        deletes.update(batch)
+        # For each entity, the (referrer, field_id) pairs of the entities
+        # in the batch that refer to it, and the (referred, field_id)
+        # pairs of the entities in the batch that it refers to.
+        referrers = {}
+        referred = dict((key, []) for key in keys)
+        for key in keys:
+            extent_id, oid = key
+            entity_map = extent_maps_by_id[extent_id]['entities'][oid]
+            key_referrers = referrers[key] = []
+            for (other_extent_id, other_field_id), others in (
+                entity_map['links'].iteritems()):
+                for other_oid in others:
+                    other_key = (other_extent_id, other_oid)
+                    if other_key in batch:
+                        key_referrers.append((other_key, other_field_id))
+                        referred[other_key].append((key, other_field_id))
+        waiting = dict((key, len(referrers[key])) for key in keys)
+        ready = [key for key in keys if not waiting[key]]
+        next_key = iter(keys).next
+        def release(key, field_ids=None):
+            """Forget the references from the entity with the given key
+            to other entities in the batch, or only those held in
+            `field_ids`."""
+            kept = []
+            for other_key, field_id in referred[key]:
+                if field_ids is None or field_id in field_ids:
+                    waiting[other_key] -= 1
+                    if not waiting[other_key]:
+                        heappush(ready, other_key)
+                else:
+                    kept.append((other_key, field_id))
+            referred[key] = kept
+        delete_entity = self._delete_entity
+        while batch:
+            if not ready:
+                # Every entity left is referred to by another one, so
+                # break the references to the first of them.
+                key = next_key()
+                while key not in batch or not waiting[key]:
+                    key = next_key()
+                field_ids_by_referrer = {}
+                for other_key, field_id in referrers[key]:
+                    if other_key in batch:
+                        field_ids_by_referrer.setdefault(
+                            other_key, set()).add(field_id)
+                for other_key, field_ids in sorted(
+                    field_ids_by_referrer.iteritems()):
+                    other_extent_id, other_oid = other_key
+                    other_extent_map = extent_maps_by_id[other_extent_id]
+                    field_id_name = other_extent_map['field_id_name']
+                    self._unassign_entity_fields(
+                        other_extent_map['name'], other_oid,
+                        [field_id_name[field_id] for field_id in field_ids])
+                    release(other_key, field_ids)
+                continue
+            key = heappop(ready)
+            extent_id, oid = key
+            delete_entity(extent_maps_by_id[extent_id]['name'], oid, deletes)
+            batch.discard(key)
+            release(key)
+
+    def _delete_entity(self, extent_name, oid, deletes=None):
+        """Delete an entity.
+
+        - `deletes`: (optional) Set of (extent_id, oid) pairs of
+          entities that may refer to the entity, since they are being
+          deleted too.  If `None`, those of the executing transaction.
+        """
         entity_map, extent_map = self._entity_extent_map(extent_name, oid)
+        self._uncache_field_values(extent_name, oid, entity_map['rev'])
         all_field_ids = set(extent_map['field_id_name'].iterkeys())
         extent_id = extent_map['id']
         extent_name_id = self._extent_name_id
@@ -450,14 +854,8 @@ class Database(base.Database):
         # Disallow deletion if other entities refer to this one,
         # unless all references are merely from ourself or an entity
         # that will be deleted.
-        deletes = set()
-        executing = self._executing
-        if executing:
-            tx = executing[-1]
-            deletes.update([(extent_name_id[del_entity_cls.__name__], del_oid)
-                            for del_entity_cls, del_oid in tx._deletes])
-            deletes.update([(extent_name_id[del_entity_cls.__name__], del_oid)
-                            for del_entity_cls, del_oid in tx._known_deletes])
+        if deletes is None:
+            deletes = self._executing_deletes()
         for (other_extent_id, other_field_id), others in links.iteritems():
             for other_oid in others:
                 if (other_extent_id, other_oid) in deletes:
@@ -602,6 +1000,22 @@ class Database(base.Database):
                 fields[field_name] = value
         return fields
 
+    def _entity_link_oids(self, extent_name, oid):
+        """Generate an (other_extent_name, other_field_name, oids) tuple
+        for each field of other entities that links to an entity, where
+        `oids` iterates over the OIDs of the linking entities.  Unlike
+        `_entity_links`, no entity instances or lists are created."""
+        entity_map = self._entity_map(extent_name, oid)
+        if entity_map['link_count'] == 0:
+            return
+        extent_maps_by_id = self._extent_maps_by_id
+        for key, btree in entity_map['links'].iteritems():
+            other_extent_id, other_field_id = key
+            other_extent_map = extent_maps_by_id[other_extent_id]
+            yield (other_extent_map['name'],
+                   other_extent_map['field_id_name'][other_field_id],
+                   btree.iterkeys())
+
     def _entity_links(self, extent_name, oid, other_extent_name=None,
                      other_field_name=None, return_count=False):
         """Return dictionary of (extent_name, field_name): entity_list
@@ -702,6 +1116,106 @@ class Database(base.Database):
         entity_map = self._entity_map(extent_name, oid)
         return entity_map['rev']
 
+    def _estimate_entity_oids(self, extent_name, field_name, value):
+        """Return an estimate of the number of entities whose value for
+        a field equals `value`, or None if an estimate would require
+        examining each entity in the extent.
+
+        The estimate is exact when entity links or a single-field index
+        can be used.  When the field begins a multi-field index, it is
+        the number of distinct values of the next field for `value`, a
+        lower bound that is found without visiting the branches below.
+        """
+        extent_map = self._extent_map(extent_name)
+        try:
+            field_id = extent_map['field_name_id'][field_name]
+        except KeyError:
+            raise error.FieldDoesNotExist(extent_name, field_name)
+        if isinstance(value, Entity):
+            # Entity links are already counted.
+            entity_map = self._entity_map(value._extent.name, value._oid)
+            key = (extent_map['id'], field_id)
+            return len(entity_map['links'].get(key, {}))
+        index_spec = _shortest_index_spec(extent_map, field_id)
+        if index_spec is None:
+            return None
+        FieldClass = self._entity_classes[extent_name]._field_spec[field_name]
+        value = _dumped_value(FieldClass, value)
+        unique, branch = extent_map['indices'][index_spec]
+        if value not in branch:
+            return 0
+        return len(branch[value])
+
+    def _estimate_entity_oids_range(self, extent_name, field_name, low=None,
+                                    high=None, include_low=True,
+                                    include_high=False, prefix=None):
+        """Return an estimate of the number of OIDs that
+        `_find_entity_oids_range` would return for the same arguments,
+        or None if an estimate would require examining each entity in
+        the extent.
+
+        The estimate assumes that each distinct value of the field is
+        shared by the same number of entities.
+        """
+        extent_map = self._extent_map(extent_name)
+        try:
+            field_id = extent_map['field_name_id'][field_name]
+        except KeyError:
+            raise error.FieldDoesNotExist(extent_name, field_name)
+        index_spec = _shortest_index_spec(extent_map, field_id)
+        if index_spec is None:
+            return None
+        unique, branch = extent_map['indices'][index_spec]
+        extent_len = extent_map['len']
+        if not hasattr(branch, 'rank'):
+            # Positions of values within the index are not known, so
+            # assume that a third of the entities are in range.
+            return extent_len // 3
+        distinct_count = len(branch)
+        if not distinct_count:
+            return 0
+        FieldClass = self._entity_classes[extent_name]._field_spec[field_name]
+        if prefix is not None:
+            prefix = _dumped_value(FieldClass, prefix)
+            start = branch.rank(prefix)
+            stop = branch.rank(_prefix_upper_bound(prefix))
+        else:
+            if low is None:
+                start = branch.rank(UNASSIGNED)
+                if UNASSIGNED in branch:
+                    start += 1
+            else:
+                low = _dumped_value(FieldClass, low)
+                start = branch.rank(low)
+                if not include_low and low in branch:
+                    start += 1
+            if high is None:
+                stop = distinct_count
+            else:
+                high = _dumped_value(FieldClass, high)
+                stop = branch.rank(high)
+                if include_high and high in branch:
+                    stop += 1
+        if stop <= start:
+            return 0
+        # Round up, so that a non-empty range is never estimated empty.
+        return ((stop - start) * extent_len + distinct_count - 1
+                ) // distinct_count
+
+    def _executing_deletes(self):
+        """Return a new set of the (extent_id, oid) pairs of entities
+        that the executing transaction is deleting."""
+        deletes = set()
+        executing = self._executing
+        if executing:
+            extent_name_id = self._extent_name_id
+            tx = executing[-1]
+            deletes.update([(extent_name_id[del_entity_cls.__name__], del_oid)
+                            for del_entity_cls, del_oid in tx._deletes])
+            deletes.update([(extent_name_id[del_entity_cls.__name__], del_oid)
+                            for del_entity_cls, del_oid in tx._known_deletes])
+        return deletes
+
     def _extent_contains_oid(self, extent_name, oid):
         extent_map = self._extent_map(extent_name)
         return oid in extent_map['entities']
@@ -739,14 +1253,7 @@ class Database(base.Database):
                 field_id = field_name_id[field_name]
             except KeyError:
                 raise error.FieldDoesNotExist(extent_name, field_name)
-            # Create a writable field to convert the value and get its
-            # _dump'd representation.
-            FieldClass = field_spec[field_name]
-            class TemporaryField(FieldClass):
-                readonly = False
-            field = TemporaryField(None)
-            field.set(value)
-            value = field._dump()
+            value = _dumped_value(field_spec[field_name], value)
             field_id_value[field_id] = value
         # Get results, using indexes and shortcuts where possible.
         results = []
@@ -771,16 +1278,23 @@ class Database(base.Database):
         # so, use the index to return matches.
         index_spec = None
         if field_ids in normalized_index_map:
+            # The fields given are the leading fields of one or more
+            # indices.  Prefer the shortest, since the fewest branches
+            # remain to be walked below them.
             for spec in normalized_index_map[field_ids]:
-                if len(spec) == len_field_ids:
+                if index_spec is None or len(spec) < len(index_spec):
                     index_spec = spec
-                    break
+            leading = len_field_ids
+        else:
+            # Otherwise use the index whose leading fields cover the
+            # most of the fields given, if any.
+            index_spec, leading = _leading_index_spec(indices, field_id_value)
         if index_spec is not None:
             # We found an index to use.
-            assert log(2, 'Use index spec:', index_spec)
+            assert log(2, 'Use index spec:', index_spec, 'leading', leading)
             unique, branch = indices[index_spec]
             match = True
-            for field_id in index_spec:
+            for field_id in index_spec[:leading]:
                 field_value = field_id_value[field_id]
                 if field_value not in branch:
                     # No matches found.
@@ -788,9 +1302,35 @@ class Database(base.Database):
                     break
                 branch = branch[field_value]
             if match:
-                # Now we're at a leaf that matches all of the
-                # criteria, so return the OIDs in that leaf.
-                results = list(branch.keys())
+                if leading == len(index_spec):
+                    # Now we're at a leaf that matches all of the
+                    # leading fields, so use the OIDs in that leaf.
+                    results = list(branch.keys())
+                else:
+                    # Collect the OIDs in all leaves below this branch.
+                    ascending = (True, ) * (len(index_spec) - leading)
+                    _walk_index(branch, ascending, results)
+                if leading < len_field_ids:
+                    # Check the remaining criteria against the
+                    # entities found in the index.
+                    assert log(2, 'Filter', len(results), 'index results.')
+                    remaining = [
+                        (field_id, value)
+                        for field_id, value in field_id_value.iteritems()
+                        if field_id not in index_spec[:leading]
+                        ]
+                    oids = results
+                    results = []
+                    append = results.append
+                    for oid in oids:
+                        fields = entity_maps[oid]['fields']
+                        match = True
+                        for field_id, value in remaining:
+                            if fields.get(field_id, UNASSIGNED) != value:
+                                match = False
+                                break
+                        if match:
+                            append(oid)
         else:
             # Fields aren't indexed, so use brute force.
             assert log(2, 'Use brute force.')
@@ -807,6 +1347,91 @@ class Database(base.Database):
         assert log(2, 'Result count', len(results))
         return results
 
+    def _find_entity_oids_range(self, extent_name, field_name, low=None,
+                                high=None, include_low=True,
+                                include_high=False, prefix=None):
+        """Return list of OIDs of entities whose value for a field falls
+        within a range, in order of that value.
+
+        - `extent_name`: Name of the extent to search.
+
+        - `field_name`: Name of the field to compare.
+
+        - `low`, `high`: Lower and upper bounds of the range, or None
+          if the range is unbounded in that direction.
+
+        - `include_low`, `include_high`: True if values equal to the
+          corresponding bound are within the range.
+
+        - `prefix`: If not None, only values that start with `prefix`
+          are within the range.
+
+        UNASSIGNED values are never within the range.  If an index
+        begins with the field, only the matching part of that index is
+        visited; otherwise each entity in the extent is examined.
+        """
+        assert log(1, extent_name, field_name, low, high, prefix)
+        extent_map = self._extent_map(extent_name)
+        field_name_id = extent_map['field_name_id']
+        try:
+            field_id = field_name_id[field_name]
+        except KeyError:
+            raise error.FieldDoesNotExist(extent_name, field_name)
+        # Convert the bounds to their _dump'd representations, which
+        # are what indexes and entity field maps store.
+        FieldClass = self._entity_classes[extent_name]._field_spec[field_name]
+        if low is not None:
+            low = _dumped_value(FieldClass, low)
+        if high is not None:
+            high = _dumped_value(FieldClass, high)
+        if prefix is not None:
+            prefix = _dumped_value(FieldClass, prefix)
+        index_spec = _shortest_index_spec(extent_map, field_id)
+        results = []
+        if index_spec is not None:
+            # Walk the first level of an index that begins with the
+            # field, starting at the lowest value that may match.
+            assert log(2, 'Use index spec:', index_spec)
+            unique, branch = extent_map['indices'][index_spec]
+            if low is not None and prefix is not None:
+                items = branch.items_from(max(low, prefix))
+            elif low is not None:
+                items = branch.items_from(low)
+            elif prefix is not None:
+                items = branch.items_from(prefix)
+            else:
+                items = branch.iteritems()
+            inner_ascending = (True, ) * (len(index_spec) - 1)
+            for value, inner_branch in items:
+                position = _range_position(
+                    value, low, high, include_low, include_high, prefix)
+                if position < 0:
+                    continue
+                elif position > 0:
+                    break
+                _walk_index(inner_branch, inner_ascending, results)
+        else:
+            # Field isn't indexed, so use brute force.
+            assert log(2, 'Use brute force.')
+            matches = []
+            append = matches.append
+            for oid, entity_map in extent_map['entities'].iteritems():
+                value = entity_map['fields'].get(field_id, UNASSIGNED)
+                position = _range_position(
+                    value, low, high, include_low, include_high, prefix)
+                if position == 0:
+                    append((value, oid))
+            matches.sort()
+            results = [oid for value, oid in matches]
+        assert log(2, 'Result count', len(results))
+        return results
+
+    def _rollback(self):
+        """Roll back the storage backend, discarding cached field
+        values since revisions are rolled back too."""
+        self._field_cache.clear()
+        self.backend.rollback()
+
     def _relax_index(self, extent_name, *index_spec):
         """Relax constraints on the specified index until a matching
         enforce_index is called, or the currently-executing
@@ -836,6 +1461,63 @@ class Database(base.Database):
         extent_map = self._extent_map(extent_name)
         extent_map['next_oid'] = next_oid
 
+    def _remove_references(self, updates):
+        """Update entities that refer to entities being deleted, without
+        executing an Update transaction for each of them.
+
+        - `updates`: Sequence of ``(entity, unassigns, removes)`` tuples,
+          where `unassigns` and `removes` are sequences of ``(field_name,
+          referred)`` pairs.  References to `referred` are unassigned or
+          removed from the field with the field's `_unassign` or
+          `_remove` method, as a default Update transaction would do.
+
+        Only the changed fields are validated here.  The entities are
+        noted as updated, so the executing transaction validates them as
+        a whole once it is done.
+        """
+        for entity, unassigns, removes in updates:
+            extent_name = entity._extent.name
+            oid = entity._oid
+            field_map = entity.s.field_map(not_fget)
+            changed = {}
+            for field_name, referred in unassigns:
+                field = changed[field_name] = field_map[field_name]
+                field._unassign(referred)
+            for field_name, referred in removes:
+                field = changed[field_name] = field_map[field_name]
+                field._remove(referred)
+            # All fields are given, as format 1 databases require, and
+            # since related entity sets not given would be taken to be
+            # empty.
+            fields = self._entity_fields(extent_name, oid)
+            related_entities = self._entity_related_entities(
+                extent_name, oid)
+            for field_name, field in changed.iteritems():
+                field.validate(field._value)
+                fields[field_name] = field._dump()
+                if field.may_store_entities:
+                    related_entities[field_name] = field._entities_in_value()
+            self._update_entity(extent_name, oid, fields, related_entities)
+
+    def _unassign_entity_fields(self, extent_name, oid, field_names):
+        """Update an entity, setting the named fields to UNASSIGNED.
+        Key indices of the extent are relaxed if that causes a key
+        collision."""
+        fields = self._entity_fields(extent_name, oid)
+        related_entities = self._entity_related_entities(extent_name, oid)
+        for field_name in field_names:
+            fields[field_name] = UNASSIGNED
+            related_entities[field_name] = frozenset()
+        try:
+            self._update_entity(extent_name, oid, fields, related_entities)
+        except error.KeyCollision:
+            # Since it takes more time to relax an index, only do it
+            # when we find a key collision.
+            for index_spec in self._entity_classes[extent_name]._key_spec:
+                self._relax_index(extent_name, *index_spec)
+            # Try the update again.
+            self._update_entity(extent_name, oid, fields, related_entities)
+
     def _update_entity(self, extent_name, oid, fields, related_entities,
                        rev=None):
         """Update an existing entity in an extent.
@@ -855,21 +1537,18 @@ class Database(base.Database):
 
         - `rev`: (optional) Specific revision to update the entity to.
         """
-        # XXX: Could be optimized to update mappings only when
-        # necessary.
         entity_classes = self._entity_classes
         entity_map, extent_map = self._entity_extent_map(extent_name, oid)
+        self._uncache_field_values(extent_name, oid, entity_map['rev'])
         field_name_id = extent_map['field_name_id']
         extent_name_id = self._extent_name_id
         extent_maps_by_id = self._extent_maps_by_id
         indices_added = []
         indices_removed = []
-        new_links = []
         links_created = []
         links_deleted = []
         ia_append = indices_added.append
         ir_append = indices_removed.append
-        nl_append = new_links.append
         lc_append = links_created.append
         ld_append = links_deleted.append
         BTree = self._BTree
@@ -883,88 +1562,94 @@ class Database(base.Database):
             else:
                 old_related_entities = {}
             old_rev = entity_map['rev']
-            # Manage entity references.
-            if updating_related:
-                for name, related_entity_set in related_entities.iteritems():
-                    field_id = field_name_id[name]
-                    for placeholder in related_entity_set:
-                        other_extent_id = placeholder.extent_id
-                        other_oid = placeholder.oid
-                        nl_append((field_id, other_extent_id, other_oid))
             # Get fields, and set UNASSIGNED for any fields that are
             # new since the last time the entity was stored.
             fields_by_id = entity_map['fields']
             all_field_ids = set(extent_map['field_id_name'])
             new_field_ids = all_field_ids - set(fields_by_id)
-            fields_by_id.update(dict(
-                (field_id, UNASSIGNED) for field_id in new_field_ids))
+            if new_field_ids:
+                fields_by_id.update(dict(
+                    (field_id, UNASSIGNED) for field_id in new_field_ids))
             # Create ephemeral fields for creating new mappings.
             new_fields_by_id = dict(fields_by_id)
             for name, value in fields.iteritems():
                 new_fields_by_id[field_name_id[name]] = value
+            # Find the indices whose values change.  The others are left
+            # alone, so that their BTree nodes are not written again.
+            changed_indices = []
+            for index_spec in extent_map['indices'].iterkeys():
+                field_values = tuple(fields_by_id[field_id]
+                                     for field_id in index_spec)
+                new_field_values = tuple(new_fields_by_id[field_id]
+                                         for field_id in index_spec)
+                if new_field_values != field_values:
+                    # Find out if the index has been relaxed.
+                    relaxed_specs = self._relaxed[extent_name]
+                    if index_spec in relaxed_specs:
+                        txns, relaxed = relaxed_specs[index_spec]
+                    else:
+                        relaxed = None
+                    changed_indices.append(
+                        (index_spec, relaxed, field_values, new_field_values))
+            # Find the fields whose related entity sets change, and the
+            # sets before and after.
+            changed_related = []
             if updating_related:
+                related_entities_by_id = entity_map['related_entities']
                 new_related_entities_by_id = dict(
                     (field_name_id[name], related_entities[name])
                     for name in related_entities
                     )
+                referrer_field_ids = set(new_related_entities_by_id)
+                # If a field once existed, but no longer does, there will
+                # still be a related entity set for it in related_entities.
+                # Only process the fields that still exist.
+                referrer_field_ids.update(
+                    field_id for field_id in related_entities_by_id
+                    if field_id in all_field_ids)
+                for referrer_field_id in referrer_field_ids:
+                    related_set = related_entities_by_id.get(
+                        referrer_field_id, frozenset())
+                    new_related_set = new_related_entities_by_id.get(
+                        referrer_field_id, frozenset())
+                    if new_related_set != related_set:
+                        changed_related.append(
+                            (referrer_field_id, related_set, new_related_set))
             # Remove existing index mappings.
-            indices = extent_map['indices']
-            for index_spec in indices.iterkeys():
-                field_values = tuple(fields_by_id[field_id]
-                                     for field_id in index_spec)
-                # Find out if the index has been relaxed.
-                relaxed_specs = self._relaxed[extent_name]
-                if index_spec in relaxed_specs:
-                    txns, relaxed = relaxed_specs[index_spec]
-                else:
-                    relaxed = None
+            for (index_spec, relaxed, field_values,
+                 new_field_values) in changed_indices:
                 _index_remove(extent_map, index_spec, oid, field_values)
                 ir_append((extent_map, index_spec, relaxed, oid, field_values))
-            if updating_related:
-                # Delete links from this entity to other entities.
-                related_entities_by_id = entity_map['related_entities']
-                referrer_extent_id = extent_name_id[extent_name]
-                new_field_ids = frozenset(new_fields_by_id)
-                for (referrer_field_id,
-                     related_set) in related_entities_by_id.iteritems():
-                    # If a field once existed, but no longer does, there will
-                    # still be a related entity set for it in related_entities.
-                    # Only process the fields that still exist.
-                    if referrer_field_id in all_field_ids:
-                        # Remove only the links that no longer exist.
-                        new_related_entities = new_related_entities_by_id.get(
-                            referrer_field_id, set())
-                        for other_value in related_set - new_related_entities:
-                            # Remove the link to the other entity.
-                            other_extent_id = other_value.extent_id
-                            other_oid = other_value.oid
-                            link_key = (referrer_extent_id, referrer_field_id)
-                            other_extent_map = extent_maps_by_id[
-                                other_extent_id]
-                            other_entity_map = other_extent_map['entities'][
-                                other_oid]
-                            links = other_entity_map['links']
-                            other_links = links[link_key]
-                            del other_links[oid]
-                            other_entity_map['link_count'] -= 1
-                            ld_append((other_entity_map, links, link_key, oid))
+            # Delete links from this entity to other entities.
+            referrer_extent_id = extent_name_id[extent_name]
+            for (referrer_field_id, related_set,
+                 new_related_set) in changed_related:
+                # Remove only the links that no longer exist.
+                for other_value in related_set - new_related_set:
+                    # Remove the link to the other entity.
+                    other_extent_id = other_value.extent_id
+                    other_oid = other_value.oid
+                    link_key = (referrer_extent_id, referrer_field_id)
+                    other_extent_map = extent_maps_by_id[other_extent_id]
+                    other_entity_map = other_extent_map['entities'][other_oid]
+                    links = other_entity_map['links']
+                    other_links = links[link_key]
+                    del other_links[oid]
+                    other_entity_map['link_count'] -= 1
+                    ld_append((other_entity_map, links, link_key, oid))
             # Create new index mappings.
-            for index_spec in indices.iterkeys():
-                field_values = tuple(new_fields_by_id[field_id]
-                                     for field_id in index_spec)
-                # Find out if the index has been relaxed.
-                relaxed_specs = self._relaxed[extent_name]
-                if index_spec in relaxed_specs:
-                    txns, relaxed = relaxed_specs[index_spec]
-                else:
-                    relaxed = None
-                _index_add(extent_map, index_spec, relaxed, oid, field_values,
-                           BTree)
-                ia_append((extent_map, index_spec, oid, field_values))
-            if updating_related:
-                # Update links from this entity to another entity.
-                referrer_extent_id = extent_name_id[extent_name]
-                for referrer_field_id, other_extent_id, other_oid in new_links:
+            for (index_spec, relaxed, field_values,
+                 new_field_values) in changed_indices:
+                _index_add(extent_map, index_spec, relaxed, oid,
+                           new_field_values, BTree)
+                ia_append((extent_map, index_spec, oid, new_field_values))
+            # Add links from this entity to other entities.
+            for (referrer_field_id, related_set,
+                 new_related_set) in changed_related:
+                # Add only the links that did not exist before.
+                for placeholder in new_related_set - related_set:
+                    other_extent_id = placeholder.extent_id
+                    other_oid = placeholder.oid
                     other_extent_map = extent_maps_by_id[other_extent_id]
                     try:
                         other_entity_map = other_extent_map['entities'][
@@ -972,7 +1657,6 @@ class Database(base.Database):
                     except KeyError:
                         field_id_name = extent_map['field_id_name']
                         field_name = field_id_name[referrer_field_id]
-                        other_extent_map = extent_maps_by_id[other_extent_id]
                         other_extent_name = other_extent_map['name']
                         raise error.EntityDoesNotExist(
                             other_extent_name, field_name=field_name)
@@ -985,15 +1669,25 @@ class Database(base.Database):
                         mapping = links[link_key]
                     if oid not in mapping:
                         # Only add the link if it's not already there.
-                        links[link_key][oid] = None
+                        mapping[oid] = None
                         other_entity_map['link_count'] += 1
                         lc_append((other_entity_map, links, link_key, oid))
             # Update actual fields and related entities.
-            for name, value in fields.iteritems():
-                fields_by_id[field_name_id[name]] = value
+            if fields:
+                fields_by_id.update(dict(
+                    (field_name_id[name], value)
+                    for name, value in fields.iteritems()
+                    ))
             if updating_related:
-                for name, value in related_entities.iteritems():
-                    related_entities_by_id[field_name_id[name]] = value
+                changed_related_by_id = dict(
+                    (referrer_field_id, new_related_entities_by_id[
+                        referrer_field_id])
+                    for referrer_field_id, related_set, new_related_set
+                    in changed_related
+                    if referrer_field_id in new_related_entities_by_id
+                    )
+                if changed_related_by_id:
+                    related_entities_by_id.update(changed_related_by_id)
             # Update revision.
             if rev is None:
                 entity_map['rev'] += 1
@@ -1205,6 +1899,25 @@ class Database(base.Database):
         tx = Initialize()
         self.execute(tx)
 
+    def _new_entity_map(self, fields_by_id, related_entities_by_id, rev):
+        """Return the structure that stores a new entity, with no links.
+
+        - `fields_by_id`: Dictionary of field_id:field_value mappings.
+        - `related_entities_by_id`: Dictionary of
+          field_id:related_entity_set mappings.
+        - `rev`: Revision of the entity.
+        """
+        PDict = self._PDict
+        entity_map = PDict()
+        entity_map['fields'] = PDict(fields_by_id)
+        # XXX flesh out links based on who is capable of linking
+        # to this one.
+        entity_map['link_count'] = 0
+        entity_map['links'] = PDict()
+        entity_map['related_entities'] = PDict(related_entities_by_id)
+        entity_map['rev'] = rev
+        return entity_map
+
     def _on_open(self):
         """Allow schema to run code after the database is opened."""
         if hasattr(self, '_schema_module'):
@@ -1263,6 +1976,8 @@ class Database(base.Database):
           database evolution.
         """
         self._sync_count += 1
+        # Cached field values may belong to the old schema.
+        self._field_cache.clear()
         sync_schema_changes = True
         locked = False
         try:
@@ -1509,6 +2224,11 @@ class Database(base.Database):
             index_spec = EntityClass._index_spec
             self._update_extent_key_spec(extent_name, key_spec, index_spec)
 
+    def _uncache_field_values(self, extent_name, oid, rev):
+        """Discard the field values cached for an entity at the given
+        revision."""
+        self._field_cache.pop((extent_name, oid, rev), None)
+
     def _unique_extent_id(self):
         """Return an unused random extent ID."""
         extent_name_id = self._extent_name_id
@@ -1540,6 +2260,7 @@ class Database(base.Database):
         index_spec_ids = [_field_ids(extent_map, field_names)
                           for field_names in index_spec]
         BTree = self._BTree
+        BTreeBuilder = getattr(self.backend, 'BTreeBuilder', _BTreeInserter)
         PList = self._PList
         # Convert key indices that have been changed to non-unique
         # incides.
@@ -1553,23 +2274,13 @@ class Database(base.Database):
                 # Create a new unique index and populate it.
                 _create_index(
                     extent_map, i_spec, True, BTree, PList)
-                for oid in entities:
-                    fields_by_id = entities[oid]['fields']
-                    field_values = tuple(fields_by_id.get(field_id, UNASSIGNED)
-                                         for field_id in i_spec)
-                    _index_add(extent_map, i_spec, None, oid, field_values,
-                               BTree)
+                _populate_index(extent_map, i_spec, BTree, BTreeBuilder)
         # Create new non-unique indices for those that don't exist.
         for i_spec in index_spec_ids:
             if i_spec not in indices:
                 # Create a new non-unique index and populate it.
                 _create_index(extent_map, i_spec, False, BTree, PList)
-                for oid in entities:
-                    fields_by_id = entities[oid]['fields']
-                    field_values = tuple(fields_by_id.get(field_id, UNASSIGNED)
-                                         for field_id in i_spec)
-                    _index_add(extent_map, i_spec, None, oid, field_values,
-                               BTree)
+                _populate_index(extent_map, i_spec, BTree, BTreeBuilder)
         # Remove key indices that no longer exist.
         to_remove = set(indices) - set(key_spec_ids + index_spec_ids)
         for i_spec in to_remove:
@@ -1619,6 +2330,7 @@ class Database(base.Database):
 
         NOT INDENDED FOR GENERAL USE.
         """
+        self._field_cache.clear()
         BTree = self._BTree
         for extent_name in self.extent_names():
             extent_map = self._extent_map(extent_name)
@@ -1629,12 +2341,75 @@ class Database(base.Database):
             for index_spec, (unique, index_tree) in list(indices.items()):
                 indices[index_spec] = (unique, BTree())
         self._commit()
+        self.cache_field_values = Database.cache_field_values
         self.dispatch = Database.dispatch
+        self.field_cache_hits = 0
+        self.field_cache_misses = 0
         self.label = Database.label
         self._initialize()
         self._on_open()
 
 
+class _BTreeInserter(object):
+    """Fills a BTree one item at a time, for backends that have no
+    `BTreeBuilder`, and BTrees that are not empty."""
+
+    def __init__(self, btree):
+        self.add = btree.__setitem__
+
+    def finish(self):
+        pass
+
+
+def _btree_from_sorted(BTree, items):
+    """Return a new `BTree` holding the (key, value) `items`, given in
+    increasing key order.  It is built from the bottom up with
+    `BTree.from_sorted` if the backend's BTree class has it."""
+    from_sorted = getattr(BTree, 'from_sorted', None)
+    if from_sorted is not None:
+        return from_sorted(items)
+    btree = BTree()
+    for key, value in items:
+        btree[key] = value
+    return btree
+
+
+def _build_index(extent_map, index_spec, unique, entries, branch, BTree,
+                 BTreeBuilder, tick=None):
+    """Fill the empty index `branch` of the specified index from the
+    bottom up with `entries`, tuples of field values followed by an OID in
+    sorted order.  Raise KeyCollision if the index is unique and two
+    entries have the same field values.
+
+    Each branch is added to the one above it before it is filled, so if
+    `branch` is reachable from the root, a commit made by `tick`, which
+    is called after each entry if given, stores the nodes completed so
+    far.
+    """
+    leaf_level = len(index_spec)
+    def fill(branch, entries, level):
+        builder = BTreeBuilder(branch)
+        if level == leaf_level:
+            for count, entry in enumerate(entries):
+                if unique and count:
+                    raise error.KeyCollision(
+                        extent_map['name'],
+                        _field_names(extent_map, index_spec),
+                        entry[:-1],
+                        )
+                # Inject the OID into the leaf.
+                builder.add(entry[-1], True)
+                if tick is not None:
+                    tick()
+        else:
+            for field_value, group in groupby(entries, itemgetter(level)):
+                next_branch = BTree()
+                builder.add(field_value, next_branch)
+                fill(next_branch, group, level + 1)
+        builder.finish()
+    fill(branch, entries, 0)
+
+
 def _create_index(extent_map, index_spec, unique, BTree, PList):
     """Create a new index in the extent with the given spec and
     uniqueness flag."""
@@ -1692,6 +2467,17 @@ def _delete_index(extent_map, index_spec):
                 del normalized_index_map[normalized_spec]
 
 
+def _dumped_value(FieldClass, value):
+    """Return `value` as stored in the database for a field of class
+    `FieldClass`."""
+    # Field.set only enforces readonly when asked to, so the field
+    # class can be used directly without defining a writable subclass
+    # on each call.
+    field = FieldClass(None)
+    field.set(value)
+    return field._dump()
+
+
 def _field_ids(extent_map, field_names):
     """Convert a (field-name, ...) tuple to a (field-id, ...)
     tuple for the given extent map."""
@@ -1754,6 +2540,19 @@ def _index_clean_branch(branch, field_values):
             del branch[branch_value]
 
 
+def _index_entries(branch, depth):
+    """Generate the entries of an index branch whose leaves are `depth`
+    levels down, as tuples of field values followed by an OID, in
+    order."""
+    if depth == 0:
+        for oid in branch.iterkeys():
+            yield (oid,)
+    else:
+        for field_value, next_branch in branch.iteritems():
+            for entry in _index_entries(next_branch, depth - 1):
+                yield (field_value,) + entry
+
+
 def _index_remove(extent_map, index_spec, oid, field_values):
     """Remove an entry from the specified index, of entity oid having
     the given values in order of the index spec."""
@@ -1792,6 +2591,28 @@ def _index_validate(extent_map, index_spec, oid, field_values, BTree):
             )
 
 
+def _leading_index_spec(indices, field_ids):
+    """Return an (index_spec, count) tuple for the index whose leading
+    fields cover the most of `field_ids`, where `count` is the number
+    of leading fields covered.  Shorter indices are preferred when
+    several cover the same number.  Returns (None, 0) if no index
+    begins with any of `field_ids`."""
+    best_spec = None
+    best_count = 0
+    for index_spec in indices:
+        count = 0
+        for field_id in index_spec:
+            if field_id not in field_ids:
+                break
+            count += 1
+        if count > best_count or (
+            count and count == best_count
+            and len(index_spec) < len(best_spec)):
+            best_spec = index_spec
+            best_count = count
+    return best_spec, best_count
+
+
 def _normalized_index_specs(index_specs):
     """Return normalized index specs based on index_specs."""
     return [tuple(sorted(spec)) for spec in index_specs]
@@ -1802,6 +2623,66 @@ def _partial_index_specs(index_spec):
     return [tuple(index_spec[:x+1]) for x in xrange(len(index_spec))]
 
 
+def _populate_index(extent_map, index_spec, BTree, BTreeBuilder):
+    """Fill the new, empty index with the given spec from the entities of
+    the extent, building it from the bottom up.  The entries are sorted
+    with an ExternalSort, so that memory use is bounded however many
+    entities the extent has."""
+    indices = extent_map['indices']
+    entries = ExternalSort()
+    try:
+        for oid, entity in extent_map['entities'].iteritems():
+            fields_by_id = entity['fields']
+            entries.add(tuple(fields_by_id.get(field_id, UNASSIGNED)
+                              for field_id in index_spec) + (oid,))
+        unique, branch = indices[index_spec]
+        _build_index(extent_map, index_spec, unique, iter(entries), branch,
+                     BTree, BTreeBuilder)
+    finally:
+        entries.close()
+
+
+def _prefix_upper_bound(prefix):
+    """Return a value that sorts after every value that starts with
+    `prefix`, and is of the same type, so that it can be compared with
+    keys of that type."""
+    if isinstance(prefix, str):
+        return prefix + '\xff'
+    return prefix + unichr(0xffff)
+
+
+def _range_position(value, low, high, include_low, include_high, prefix):
+    """Return -1 if `value` sorts before the given range, 1 if it sorts
+    after it, or 0 if it is within it.  See
+    `Database._find_entity_oids_range` for a description of the
+    range arguments."""
+    if value is UNASSIGNED:
+        return -1
+    if low is not None and (value < low or (value == low and not include_low)):
+        return -1
+    if prefix is not None:
+        if value < prefix:
+            return -1
+        elif not value.startswith(prefix):
+            return 1
+    if high is not None and (
+        value > high or (value == high and not include_high)):
+        return 1
+    return 0
+
+
+def _shortest_index_spec(extent_map, field_id):
+    """Return the spec of the shortest index that begins with the given
+    field, or None if no index does."""
+    index_map = extent_map['index_map']
+    index_spec = None
+    if (field_id, ) in index_map:
+        for spec in index_map[(field_id, )]:
+            if index_spec is None or len(spec) < len(index_spec):
+                index_spec = spec
+    return index_spec
+
+
 def _walk_index(branch, ascending_seq, result_list):
     """Recursively walk a branch of an index, appending OIDs found to
     result_list.
@@ -1857,6 +2738,7 @@ def convert_from_format1(backend):
       database.
     """
     root = backend.get_root()
+    BTree = backend.BTree
     schevo = root['SCHEVO']
     extent_name_id = schevo['extent_name_id']
     extents = schevo['extents']
@@ -1882,29 +2764,42 @@ def convert_from_format1(backend):
                 related_entities[field_id] = frozenset(related_entity_set)
         # For each index...
         indices = extent['indices']
-        for index_spec, (unique, index_tree) in indices.iteritems():
+        for index_spec, (unique, index_tree) in indices.items():
             # Convert all (extent_id, oid) tuples to Placeholder instances in
             # extent indices.
-            _convert_index_from_format1(
-                entity_field_ids, index_spec, index_tree)
+            new_index_tree = _convert_index_from_format1(
+                entity_field_ids, index_spec, index_tree, BTree)
+            if new_index_tree is not index_tree:
+                indices[index_spec] = (unique, new_index_tree)
     # Bump format from 1 to 2.
     schevo['format'] = 2
 
 
-def _convert_index_from_format1(entity_field_ids, index_spec, index_tree):
+def _convert_index_from_format1(entity_field_ids, index_spec, index_tree,
+                                BTree):
+    """Return `index_tree` with its entity keys converted to Placeholder
+    instances.  Branches keyed by an entity field are replaced by new
+    ones, built from the bottom up; others are converted in place."""
     current_field_id, next_index_spec = index_spec[0], index_spec[1:]
     is_entity_field = current_field_id in entity_field_ids
+    items = []
     for key, child_tree in index_tree.items():
-        if is_entity_field and isinstance(key, tuple):
-            # Convert entity tuple to Placeholder.
-            p = Placeholder.new(*key)
-            # Replace old key with new key.
-            del index_tree[key]
-            index_tree[p] = child_tree
         # Recurse into child structures if not at a leaf.
         if len(next_index_spec) > 0:
-            _convert_index_from_format1(
-                entity_field_ids, next_index_spec, child_tree)
+            new_child_tree = _convert_index_from_format1(
+                entity_field_ids, next_index_spec, child_tree, BTree)
+            if new_child_tree is not child_tree and not is_entity_field:
+                index_tree[key] = new_child_tree
+            child_tree = new_child_tree
+        if is_entity_field and isinstance(key, tuple):
+            # Convert entity tuple to Placeholder.
+            key = Placeholder.new(*key)
+        items.append((key, child_tree))
+    if not is_entity_field:
+        return index_tree
+    # Placeholders do not sort like the tuples they replace.
+    items.sort()
+    return _btree_from_sorted(BTree, items)
 
 
 optimize.bind_all(sys.modules[__name__])  # Last line of module.
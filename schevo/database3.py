@@ -0,0 +1,90 @@
+"""Schevo database, format 3."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+from schevo import database2
+from schevo import error
+
+
+class Database(database2.Database):
+    """Schevo database, format 3.
+
+    Based on the format 2 database class, with overrides to store each
+    entity as a single compact record instead of four persistent
+    dictionaries.  The record holds the entity's revision, link count,
+    field values and related entity sets; the dictionary of links to the
+    entity is only created when the first link is added.
+
+    Requires a storage backend that provides an `EntityRecord` class, as
+    `schevo.store` does.
+
+    See doc/SchevoInternalDatabaseStructures.txt for detailed information on
+    data structures.
+    """
+
+    def __init__(self, backend):
+        """Create a database.
+
+        - `backend`: The storage backend instance to use.
+        """
+        EntityRecord = getattr(backend, 'EntityRecord', None)
+        if EntityRecord is None:
+            raise error.DatabaseFormatUnsupported(3, backend)
+        self._EntityRecord = EntityRecord
+        database2.Database.__init__(self, backend)
+
+    def _create_schevo_structures(self):
+        """Create or update Schevo structures in the database."""
+        root = self._root
+        PDict = self._PDict
+        if 'SCHEVO' not in root:
+            schevo = root['SCHEVO'] = PDict()
+            schevo['format'] = 3
+            schevo['version'] = 0
+            schevo['extent_name_id'] = PDict()
+            schevo['extents'] = PDict()
+            schevo['schema_source'] = None
+
+    def _new_entity_map(self, fields_by_id, related_entities_by_id, rev):
+        """Return the record that stores a new entity, with no links."""
+        return self._EntityRecord(fields_by_id, related_entities_by_id, rev)
+
+
+def convert_from_format2(backend):
+    """Convert a database from format 2 to format 3.
+
+    - `backend`: Open backend connection to the database to convert.
+      Assumes that the database has already been verified to be a format 2
+      database.
+    """
+    EntityRecord = getattr(backend, 'EntityRecord', None)
+    if EntityRecord is None:
+        raise error.DatabaseFormatUnsupported(3, backend)
+    root = backend.get_root()
+    schevo = root['SCHEVO']
+    extents = schevo['extents']
+    # For each extent in the database...
+    for extent in extents.itervalues():
+        entities = extent['entities']
+        # Replace each entity's dictionaries with a single record, keeping
+        # its links only if it has any.
+        for entity_oid, entity in entities.items():
+            record = EntityRecord(
+                entity['fields'],
+                entity['related_entities'],
+                entity['rev'],
+                entity['link_count'],
+                )
+            links = entity['links']
+            if len(links) > 0:
+                record['links'] = links
+            entities[entity_oid] = record
+    # Bump format from 2 to 3.
+    schevo['format'] = 3
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -175,15 +175,27 @@ class EntityMeta(type):
                     db = self._db
                     extent_name = self._extent.name
                     oid = self._oid
-                    try:
-                        value = db._entity_field(extent_name, oid, field_name)
-                    except EntityDoesNotExist:
-                        raise
-                    except KeyError:  # XXX This needs to be more specific.
-                        value = UNASSIGNED
-                    field._value = value
-                    field._restore(db)
-                    value = field.get_immutable()
+                    if db.cache_field_values:
+                        cached = db._cached_field_values(extent_name, oid)
+                    else:
+                        cached = None
+                    if cached is not None and field_name in cached:
+                        db.field_cache_hits += 1
+                        value = cached[field_name]
+                    else:
+                        try:
+                            value = db._entity_field(
+                                extent_name, oid, field_name)
+                        except EntityDoesNotExist:
+                            raise
+                        except KeyError:  # XXX This needs to be more specific.
+                            value = UNASSIGNED
+                        field._value = value
+                        field._restore(db)
+                        value = field.get_immutable()
+                        if cached is not None:
+                            db.field_cache_misses += 1
+                            cached[field_name] = value
                     # Transform value if a value transform function was
                     # defined.
                     transforms = self._value_transforms
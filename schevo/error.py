@@ -57,6 +57,20 @@ class DatabaseFormatMismatch(RuntimeError):
         self.required_format = required_format
 
 
+class DatabaseFormatUnsupported(RuntimeError):
+    """The storage backend cannot store databases in the requested
+    format."""
+
+    def __init__(self, format, backend):
+        message = (
+            'Format %i is not supported by the %s backend.'
+            % (format, backend.__class__.__name__)
+            )
+        RuntimeError.__init__(self, message)
+        self.format = format
+        self.backend = backend
+
+
 class DatabaseMismatch(RuntimeError):
     """A value from one database was used incorrectly in another."""
 
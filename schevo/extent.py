@@ -42,7 +42,10 @@ class Extent(base.Extent):
         # Private variables.
         self._by = db._by_entity_oids
         self._enforce = db._enforce_index
+        self._estimate = db._estimate_entity_oids
+        self._estimate_range = db._estimate_entity_oids_range
         self._find = db._find_entity_oids
+        self._find_range = db._find_entity_oids_range
         self._label = EntityClass._label
         self._plural = EntityClass._plural
         self._relax = db._relax_index
@@ -103,6 +106,26 @@ class Extent(base.Extent):
         code += ',\n    ]'
         return code
 
+    def bulk_create(self, rows, validate=True, commit_interval=None):
+        """Create entities from `rows` without executing a transaction
+        for each one, and return the number of entities created.
+
+        Each row is a dictionary of field values keyed by field name, or
+        a tuple of values in the order the extent's stored fields are
+        defined.  Fields not given get their default values.  The new
+        entities are added to the extent's indices once all of them are
+        written, by sorting their index entries; key collisions are found
+        then.  Give `validate=False` to skip validation of field values.
+
+        Must not be called while a transaction is being executed, and
+        does not run the extent's create transaction.  Changes are
+        committed every `commit_interval` entities, index entries and
+        links if given, otherwise only at the end.  If an error occurs,
+        the entities created are removed again.
+        """
+        return self.db._bulk_create_entities(
+            self.name, rows, validate, commit_interval)
+
     def by(self, *index_spec):
         """Return an iterator of entities sorted by index_spec."""
         Entity = self.EntityClass
@@ -131,6 +154,21 @@ class Extent(base.Extent):
         transaction."""
         self._enforce(self.name, *index_spec)
 
+    def estimate_count(self, field_name, value):
+        """Return an estimate of the number of entities whose value for
+        `field_name` equals `value`, or None if the estimate would
+        require examining each entity in the extent."""
+        return self._estimate(self.name, field_name, value)
+
+    def estimate_range_count(self, field_name, low=None, high=None,
+                             include_low=True, include_high=False,
+                             prefix=None):
+        """Return an estimate of the number of OIDs `find_range_oids`
+        would return for the same arguments, or None if the estimate
+        would require examining each entity in the extent."""
+        return self._estimate_range(self.name, field_name, low, high,
+                                    include_low, include_high, prefix)
+
     def find(self, **criteria):
         """Return list of entities matching given field value(s)."""
         Entity = self.EntityClass
@@ -142,6 +180,37 @@ class Extent(base.Extent):
         # XXX: Needs unit test.
         return self._find(self.name, **criteria)
 
+    def find_prefix(self, field_name, prefix):
+        """Return list of entities whose value for `field_name` starts
+        with `prefix`, in order of that value."""
+        Entity = self.EntityClass
+        return ResultsList(
+            Entity(oid) for oid in self._find_range(
+                self.name, field_name, prefix=prefix))
+
+    def find_range(self, field_name, low=None, high=None,
+                   include_low=True, include_high=False):
+        """Return list of entities whose value for `field_name` is
+        between `low` and `high`, in order of that value.
+
+        A bound of None leaves the range open in that direction.  By
+        default values equal to `low` are included and values equal to
+        `high` are not.  Entities with an UNASSIGNED value are never
+        included.
+        """
+        Entity = self.EntityClass
+        return ResultsList(
+            Entity(oid) for oid in self._find_range(
+                self.name, field_name, low, high, include_low, include_high))
+
+    def find_range_oids(self, field_name, low=None, high=None,
+                        include_low=True, include_high=False, prefix=None):
+        """Return list of OIDs of entities whose value for `field_name`
+        is within a range, in order of that value.  See `find_range` and
+        `find_prefix`."""
+        return self._find_range(self.name, field_name, low, high,
+                                include_low, include_high, prefix)
+
     def findone(self, **criteria):
         """Return single entity matching given field value(s)."""
         results = self._find(self.name, **criteria)
@@ -117,6 +117,10 @@ class Field(base.Field):
 
     doc: Documentation for the field.
 
+    dump_is_ordered: True if the values returned by `_dump` sort in the
+    same order as the field's values, so that an index on the field can
+    be used to find values within a range.
+
     error_message: A custom error message to include with exceptions,
     or None if the default message should be used.
 
@@ -185,6 +189,7 @@ class Field(base.Field):
     data_type = None
     default = (UNASSIGNED, )
     doc = ''
+    dump_is_ordered = False
     error_message = None
     expensive = False
     fget = None
@@ -634,6 +639,7 @@ class String(Field):
     """
 
     data_type = unicode
+    dump_is_ordered = True
     monospace = False
     multiline = None
 
@@ -685,6 +691,7 @@ class Bytes(Field):
     """Binary large object field class."""
 
     data_type = str
+    dump_is_ordered = True
 
     def convert(self, value, db=None):
         """Convert the value to a string."""
@@ -723,6 +730,7 @@ class Integer(Field):
     """Integer field class."""
 
     data_type = int
+    dump_is_ordered = True
 
     def convert(self, value, db=None):
         """Convert the value to an integer."""
@@ -745,6 +753,7 @@ class Float(Field):
     """Float field class."""
 
     data_type = float
+    dump_is_ordered = True
 
     def convert(self, value, db=None):
         """Convert the value to a floating point number."""
@@ -776,6 +785,7 @@ class Money(Field):
     """
 
     data_type = float
+    dump_is_ordered = True
     fract_digits = 2
 
     def __str__(self):
@@ -829,6 +839,7 @@ class Date(Field):
     """
 
     data_type = datetime.date
+    dump_is_ordered = True
 
     def convert(self, value, db=None):
         """Convert the value to a datetime.datetime object."""
@@ -902,6 +913,7 @@ class Datetime(Field):
     """
 
     data_type = datetime.datetime
+    dump_is_ordered = True
     format = '%Y-%m-%dT%H:%M:%S'
 
     def convert(self, value, db=None):
@@ -1000,6 +1012,7 @@ class Boolean(Field):
     """
 
     data_type = bool
+    dump_is_ordered = True
     false_label = unicode(False)
     true_label = unicode(True)
     unassigned_label = None
@@ -205,7 +205,9 @@ class FieldDefinition(object):
             # No __slots__ defined in order to give
             # flexibility to other users of this field, like
             # transactions and queries.
-            pass
+            # Made for this field only, so derived classes are not
+            # cached on it.
+            _single_use = True
         NoSlotsField.__name__ = self.FieldClass.__name__
         NewClass = NoSlotsField
         NewClass._name = name
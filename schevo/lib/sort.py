@@ -0,0 +1,130 @@
+"""Sorting of more items than fit in memory."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+from cPickle import dump, load, HIGHEST_PROTOCOL
+from heapq import heapify, heappop, heapreplace
+from tempfile import TemporaryFile
+
+
+def merge(*iterables):
+    """Return an iterator of the items of the sorted `iterables`, in
+    sorted order."""
+    heap = []
+    for number, iterable in enumerate(iterables):
+        iterator = iter(iterable)
+        for item in iterator:
+            heap.append((item, number, iterator))
+            break
+    heapify(heap)
+    while heap:
+        item, number, iterator = heap[0]
+        yield item
+        for item in iterator:
+            heapreplace(heap, (item, number, iterator))
+            break
+        else:
+            heappop(heap)
+
+
+class ExternalSort(object):
+    """Sorts items that are added one at a time.
+
+    Items are kept in memory until `buffer_size` of them have been added.
+    They are then sorted and written to a temporary file, and the buffer
+    is emptied.  Iterating over the sort merges the files, so only one
+    chunk of each file is in memory at a time.  When there are
+    `max_files` files, they are merged into one, so that not too many
+    files are open at once.  Items must be picklable.
+
+    Call `close` when done, to remove the temporary files.
+    """
+
+    # Number of items pickled together in a temporary file.
+    chunk_size = 1000
+
+    # Number of temporary files that are merged into one.
+    max_files = 50
+
+    def __init__(self, buffer_size=250000):
+        """Create an empty sort.
+
+        - `buffer_size`: (optional) Number of items to keep in memory
+          before writing them to a temporary file.
+        """
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._files = []
+        self._len = 0
+
+    def __iter__(self):
+        """Return an iterator of the items added, in sorted order."""
+        buffer = self._buffer
+        buffer.sort()
+        if not self._files:
+            return iter(buffer)
+        return merge(buffer, *[self._read(f) for f in self._files])
+
+    def __len__(self):
+        return self._len
+
+    def add(self, item):
+        """Add an item to be sorted."""
+        buffer = self._buffer
+        buffer.append(item)
+        self._len += 1
+        if len(buffer) >= self.buffer_size:
+            self._spill()
+
+    def close(self):
+        """Remove the temporary files and forget the items added."""
+        for f in self._files:
+            f.close()
+        self._files = []
+        self._buffer = []
+        self._len = 0
+
+    def _read(self, f):
+        """Generate the items stored in temporary file `f`."""
+        f.seek(0)
+        while True:
+            try:
+                chunk = load(f)
+            except EOFError:
+                break
+            for item in chunk:
+                yield item
+
+    def _spill(self):
+        """Write the sorted buffer to a new temporary file."""
+        buffer = self._buffer
+        buffer.sort()
+        self._files.append(self._write(buffer))
+        self._buffer = []
+        files = self._files
+        if len(files) >= self.max_files:
+            self._files = [self._write(merge(*[self._read(f) for f in files]))]
+            for f in files:
+                f.close()
+
+    def _write(self, items):
+        """Return a new temporary file containing the sorted `items`."""
+        f = TemporaryFile()
+        chunk_size = self.chunk_size
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                dump(chunk, f, HIGHEST_PROTOCOL)
+                chunk = []
+        if chunk:
+            dump(chunk, f, HIGHEST_PROTOCOL)
+        f.flush()
+        return f
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
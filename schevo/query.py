@@ -51,6 +51,11 @@ class Query(base.Query):
         """Return a human language representation of the query."""
         return repr(self)
 
+    def explain(self):
+        """Return a description of how the results of the query will
+        be found."""
+        return u'evaluate: %s' % self
+
 
 class Simple(Query):
     """Simple query that wraps a callable and a unicode
@@ -133,15 +138,7 @@ class Exact(Param):
         # Next, update field_spec and fields based on extent.
         for name, FieldClass in extent.field_spec.iteritems():
             if name not in field_map:
-                # Subclass all fields so they won't be constrained by
-                # having __slots__ defined.  Convert fget fields to
-                # non-fget, so we can query against them.
-                class NoSlotsField(FieldClass):
-                    fget = None
-                    readonly = False
-                    required = False
-                NoSlotsField.__name__ = FieldClass.__name__
-                FieldClass = NoSlotsField
+                FieldClass = _query_field_class(FieldClass)
                 field_spec[name] = FieldClass
                 field = field_map[name] = FieldClass(self)
                 field._name = name
@@ -216,6 +213,28 @@ o_ge = MatchOperator('ge', u'>=', operator.ge)
 o_gt = MatchOperator('gt', u'>', operator.gt)
 o_ne = MatchOperator('ne', u'!=', operator.ne)
 
+def _query_field_class(FieldClass):
+    """Return the subclass of `FieldClass` used for query fields.
+
+    The subclass is not constrained by having __slots__ defined, and
+    is not calculated, readonly, or required, so it can be queried
+    against.  It is created once per field class and reused, except for
+    classes made for a single field by `FieldDefinition.field`."""
+    QueryFieldClass = FieldClass.__dict__.get('_query_field_class')
+    if QueryFieldClass is None:
+        class NoSlotsField(FieldClass):
+            fget = None
+            readonly = False
+            required = False
+        NoSlotsField.__name__ = FieldClass.__name__
+        # Query field classes are their own query field class.
+        NoSlotsField._query_field_class = NoSlotsField
+        if not FieldClass.__dict__.get('_single_use', False):
+            FieldClass._query_field_class = NoSlotsField
+        QueryFieldClass = NoSlotsField
+    return QueryFieldClass
+
+
 def _contains(a, b):
     if a is UNASSIGNED:
         return False
@@ -230,6 +249,23 @@ def _startswith(a, b):
         return a.startswith(b)
 o_startswith = MatchOperator('startswith', u'starts with', _startswith)
 
+# For operators that can be answered using an index, the name of the
+# `Extent.find_range_oids` argument that receives the value being
+# matched, and any other keyword arguments to pass.
+_range_keywords = {
+    o_le: ('high', dict(include_high=True)),
+    o_lt: ('high', dict(include_high=False)),
+    o_ge: ('low', dict(include_low=True)),
+    o_gt: ('low', dict(include_low=False)),
+    o_startswith: ('prefix', {}),
+    }
+
+# Relative cost of checking whether one entity matches a query,
+# compared to reading one OID from an index.  An index step is only
+# planned after the first if it is estimated to be cheaper than
+# filtering the candidates found so far.
+_FILTER_COST = 4
+
 o_aliases = {
     '==': o_eq,
     '<=': o_le,
@@ -276,16 +312,7 @@ class Match(Query):
         self.field_name = field_name
         if not FieldClass:
             FieldClass = getattr(on.f, field_name)
-        # Subclass all fields so they won't be constrained by having
-        # __slots__ defined.  Convert fget fields to non-fget, so we
-        # can query against them.
-        class NoSlotsField(FieldClass):
-            fget = None
-            readonly = False
-            required = False
-        NoSlotsField.__name__ = FieldClass.__name__
-        FieldClass = NoSlotsField
-        self.FieldClass = FieldClass
+        self.FieldClass = _query_field_class(FieldClass)
         self.operator = operator
         self.value = value
 
@@ -295,50 +322,176 @@ class Match(Query):
             on = on()
         operator = self.operator
         field_name = self.field_name
+        if operator is o_any:
+            return results(on)
+        value = self._value()
+        if isinstance(on, base.Extent):
+            if operator is o_unassigned:
+                kw = {field_name: UNASSIGNED}
+                return results(on.find(**kw))
+            elif operator is o_eq:
+                kw = {field_name: value}
+                return results(on.find(**kw))
+            elif self._uses_range(value):
+                EntityClass = on.EntityClass
+                return results(
+                    [EntityClass(oid) for oid in self._range_oids(value)])
+        predicate = self._predicate(value)
+        if predicate is not None:
+            return results(obj for obj in on if predicate(obj))
+
+    def _estimate(self):
+        """Return an estimate of the number of entities that match,
+        or None if `on` is not an extent or the estimate would require
+        examining each entity in it."""
+        extent = self.on
+        if not isinstance(extent, base.Extent):
+            return None
+        operator = self.operator
+        field_name = self.field_name
+        if extent.field_spec[field_name].fget is not None:
+            return None
+        if operator is o_any:
+            return len(extent)
+        value = self._value()
+        if operator is o_unassigned:
+            return extent.estimate_count(field_name, UNASSIGNED)
+        elif operator is o_eq:
+            return extent.estimate_count(field_name, value)
+        elif self._uses_range(value):
+            return extent.estimate_range_count(
+                field_name, **self._range_kw(value))
+        else:
+            return None
+
+    def _filter_oids(self, oids):
+        """Return list of the OIDs in `oids` of entities that match.
+        `on` must be an extent."""
+        EntityClass = self.on.EntityClass
+        predicate = self._predicate(self._value())
+        if predicate is None:
+            return []
+        return [oid for oid in oids if predicate(EntityClass(oid))]
+
+    def _oids(self):
+        """Return list of OIDs of entities that match.  `on` must be an
+        extent."""
+        extent = self.on
+        operator = self.operator
+        field_name = self.field_name
+        if operator is o_any:
+            return extent.find_oids()
+        value = self._value()
+        if operator is o_unassigned:
+            kw = {field_name: UNASSIGNED}
+            return extent.find_oids(**kw)
+        elif operator is o_eq:
+            kw = {field_name: value}
+            return extent.find_oids(**kw)
+        elif self._uses_range(value):
+            return self._range_oids(value)
+        predicate = self._predicate(value)
+        if predicate is None:
+            return []
+        return [entity._oid for entity in extent if predicate(entity)]
+
+    def _predicate(self, value):
+        """Return a function that returns True if the object passed to
+        it matches `value`, or None if the operator cannot be applied
+        to individual objects."""
+        operator = self.operator
+        field_name = self.field_name
+        if operator is o_any:
+            def predicate(obj):
+                return True
+        elif operator is o_in:
+            def predicate(obj):
+                return getattr(obj, field_name) in value
+        elif operator is o_assigned:
+            def predicate(obj):
+                return getattr(obj, field_name) is not UNASSIGNED
+        elif operator is o_unassigned:
+            def predicate(obj):
+                return getattr(obj, field_name) is UNASSIGNED
+        elif operator.operator:
+            oper = operator.operator
+            def predicate(obj):
+                try:
+                    return oper(getattr(obj, field_name), value)
+                except TypeError:
+                    # Cannot compare e.g. UNASSIGNED with datetime;
+                    # assume no match.
+                    return False
+        else:
+            predicate = None
+        return predicate
+
+    def _range_kw(self, value):
+        """Return keyword arguments to `Extent.find_range_oids` for
+        finding `value` using the operator."""
+        bound_name, kw = _range_keywords[self.operator]
+        kw = dict(kw)
+        kw[bound_name] = value
+        return kw
+
+    def _range_oids(self, value):
+        """Return list of OIDs of entities in the extent that match
+        `value`, using an index on the field where one exists."""
+        extent = self.on
+        operator = self.operator
+        field_name = self.field_name
+        oids = extent.find_range_oids(field_name, **self._range_kw(value))
+        if operator is o_le or operator is o_lt:
+            # A range never includes UNASSIGNED, but the plain comparison
+            # used for other sources may treat it as less than `value`.
+            try:
+                include_unassigned = operator.operator(UNASSIGNED, value)
+            except TypeError:
+                include_unassigned = False
+            if include_unassigned:
+                kw = {field_name: UNASSIGNED}
+                oids.extend(extent.find_oids(**kw))
+        # Keep the same order as iterating over the extent.
+        oids.sort()
+        return oids
+
+    def _uses_range(self, value):
+        """Return True if matching `value` can be done with
+        `Extent.find_range_oids`."""
+        if (isinstance(self.on, base.Extent)
+            and self.operator in _range_keywords
+            and value is not None
+            and value is not UNASSIGNED):
+            FieldClass = self.on.field_spec[self.field_name]
+            return FieldClass.fget is None and FieldClass.dump_is_ordered
+        return False
+
+    def _value(self):
+        """Return the value to match, converted to the form that field
+        values are compared with."""
+        operator = self.operator
         value = self.value
         if operator is o_in:
             if isinstance(value, base.Query):
                 value = value()
-            value = frozenset(value)
-            return results(
-                obj for obj in on if getattr(obj, field_name) in value)
-        else:
-            if operator is o_any:
-                return results(on)
-            elif operator is o_assigned:
-                return results(
-                    obj for obj in on
-                    if getattr(obj, field_name) is not UNASSIGNED)
-            elif operator is o_unassigned:
-                if isinstance(on, base.Extent):
-                    kw = {field_name: UNASSIGNED}
-                    return results(on.find(**kw))
-                else:
-                    return results(
-                        obj for obj in on
-                        if getattr(obj, field_name) is UNASSIGNED)
-            if value is not None:
-                field = self.FieldClass(self, field_name)
-                field.set(value)
-                value = field.get()
-            if isinstance(on, base.Extent) and operator is o_eq:
-                kw = {field_name: value}
-                return results(on.find(**kw))
-            elif operator.operator:
-                oper = operator.operator
-                def generator():
-                    for obj in on:
-                        a = getattr(obj, field_name)
-                        b = value
-                        try:
-                            result = oper(a, b)
-                        except TypeError:
-                            # Cannot compare e.g. UNASSIGNED with
-                            # datetime; assume no match.
-                            continue
-                        if result:
-                            yield obj
-                return results(generator())
+            return frozenset(value)
+        elif operator in (o_any, o_assigned, o_unassigned):
+            return value
+        if value is not None:
+            field = self.FieldClass(self, self.field_name)
+            field.set(value)
+            value = field.get()
+        return value
+
+    def explain(self):
+        on = self.on
+        if isinstance(on, base.Extent) and self.operator is not o_any:
+            estimate = self._estimate()
+            if estimate is not None:
+                return u'index (about %i): %s' % (estimate, self)
+            else:
+                return u'scan: %s' % self
+        return Query.explain(self)
 
     def _get_operator(self):
         return self._operator
@@ -387,7 +540,7 @@ class Match(Query):
             label(field),
             label(self.operator),
             )
-        if operator is not o_any:
+        if operator not in (o_any, o_assigned, o_unassigned):
             value = self.value
             if isinstance(value, Query):
                 s += u' %s' % value
@@ -408,17 +561,124 @@ class Intersection(Query):
 
     def _results(self):
         assert log(1, 'called Intersection')
-        resultset = None
-        for query in self.queries:
-            assert log(2, 'resultset is', resultset)
-            assert log(2, 'intersecting with', query)
-            s = set(query())
-            if resultset is None:
-                resultset = s
+        plan = self._plan()
+        if plan is None:
+            resultset = None
+            for query in self.queries:
+                assert log(2, 'resultset is', resultset)
+                assert log(2, 'intersecting with', query)
+                s = set(query())
+                if resultset is None:
+                    resultset = s
+                else:
+                    resultset = resultset.intersection(s)
+            assert log(2, 'resultset is finally', resultset)
+            return results(frozenset(resultset))
+        # Find the intersection as a set of OIDs, following the plan.
+        extent = self.queries[0].on
+        oids = None
+        for step, query, estimate in plan:
+            assert log(2, step, query, estimate)
+            if step == 'skip':
+                continue
+            elif step == 'all':
+                oids = set(extent.find_oids())
+            elif step == 'filter':
+                oids = set(query._filter_oids(oids))
+            elif oids is None:
+                oids = set(query._oids())
             else:
-                resultset = resultset.intersection(s)
-        assert log(2, 'resultset is finally', resultset)
-        return results(frozenset(resultset))
+                oids.intersection_update(query._oids())
+            assert log(2, 'oid count is', len(oids))
+            if not oids:
+                break
+        EntityClass = extent.EntityClass
+        return results(frozenset(EntityClass(oid) for oid in oids))
+
+    def _plan(self):
+        """Return a list of (step, query, estimate) tuples describing
+        how to find the intersection, or None if the queries are not
+        all `Match` queries on the same extent.
+
+        Steps are taken in order, narrowing down a set of OIDs:
+
+        - ``skip``: The query matches any entity, so it is ignored.
+
+        - ``all``: Start with every entity in the extent.
+
+        - ``index``: Find the entities that match the query without
+          examining each entity in the extent, then keep only those
+          found by all previous steps.  ``estimate`` is the estimated
+          number of matches.
+
+        - ``scan``: Find the entities that match the query by
+          examining each entity in the extent.
+
+        - ``filter``: Keep only the entities found so far that match
+          the query.
+        """
+        queries = self.queries
+        if not queries:
+            return None
+        extent = queries[0].on
+        for query in queries:
+            if not isinstance(query, Match) or query.on is not extent:
+                return None
+        if not isinstance(extent, base.Extent):
+            return None
+        plan = []
+        indexed = []
+        unindexed = []
+        for query in queries:
+            if query.operator is o_any:
+                plan.append(('skip', query, None))
+                continue
+            estimate = query._estimate()
+            if estimate is None:
+                unindexed.append(query)
+            else:
+                indexed.append((estimate, query))
+        # Most selective first.
+        indexed.sort(key=lambda item: item[0])
+        candidates = None
+        for estimate, query in indexed:
+            if candidates is None:
+                plan.append(('index', query, estimate))
+                candidates = estimate
+            elif estimate < candidates * _FILTER_COST:
+                plan.append(('index', query, estimate))
+                candidates = min(candidates, estimate)
+            else:
+                plan.append(('filter', query, estimate))
+        for query in unindexed:
+            if candidates is None:
+                plan.append(('scan', query, None))
+                candidates = len(extent)
+            else:
+                plan.append(('filter', query, None))
+        if candidates is None:
+            plan.append(('all', None, len(extent)))
+        return plan
+
+    def explain(self):
+        plan = self._plan()
+        if plan is None:
+            lines = [u'intersect:']
+            for query in self.queries:
+                for line in query.explain().splitlines():
+                    lines.append(u'  ' + line)
+        else:
+            extent = self.queries[0].on
+            lines = [u'intersect %s:' % plural(extent)]
+            for step, query, estimate in plan:
+                if step == 'all':
+                    lines.append(u'  all (%i): %s' % (estimate, plural(extent)))
+                elif estimate is None:
+                    lines.append(u'  %s: %s' % (step, query))
+                else:
+                    lines.append(
+                        u'  %s (about %i): %s' % (step, estimate, query))
+        return u'\n'.join(lines)
 
     def __unicode__(self):
         if not self.queries:
@@ -471,12 +731,8 @@ class ByExample(Intersection):
         for name, FieldClass in extent.field_spec.iteritems():
             # Make sure calculated fields are -not- calculated in the
             # match query.
-            class NoSlotsField(FieldClass):
-                fget = None
-                readonly = False
-                required = False
-            NoSlotsField.__name__ = FieldClass.__name__
-            match = Match(extent, name, 'any', FieldClass=NoSlotsField)
+            FieldClass = _query_field_class(FieldClass)
+            match = Match(extent, name, 'any', FieldClass=FieldClass)
             if name in kw:
                 match.value = kw[name]
                 match.operator = '=='
@@ -499,6 +755,13 @@ class Union(Query):
             resultset.update(query())
         return results(frozenset(resultset))
 
+    def explain(self):
+        lines = [u'union:']
+        for query in self.queries:
+            for line in query.explain().splitlines():
+                lines.append(u'  ' + line)
+        return u'\n'.join(lines)
+
     def __unicode__(self):
         return u'the union of (%s)' % (
             u', '.join(unicode(query) for query in self.queries)
@@ -7,6 +7,7 @@ import sys
 from schevo.lib import optimize
 
 import schevo.database
+from schevo.store.btree import CountedBTree, counted_copy
 
 
 def repairs_needed(db, db_filename):
@@ -16,6 +17,7 @@ def repairs_needed(db, db_filename):
     for repair_type in [
         EntityFieldIdsRepair,
         OrphanLinkStructuresRepair,
+        CountedBTreeRepair,
         ]:
         repair = repair_type(db, db_filename)
         if repair.is_needed:
@@ -47,9 +49,9 @@ class EntityFieldIdsRepair(object):
                     entity_field_ids = set(extent_map['entity_field_ids'])
                     entity_field_ids -= extraneous_field_ids
                     extent_map['entity_field_ids'] = tuple(entity_field_ids)
-                    # For format 2, also iterate over each entity in the
-                    # extent and remove extraneous related_entities sets.
-                    if db.format == 2:
+                    # For formats 2 and 3, also iterate over each entity in
+                    # the extent and remove extraneous related_entities sets.
+                    if db.format >= 2:
                         for entity_map in extent_map['entities'].itervalues():
                             related_entities = entity_map['related_entities']
                             for field_id in extraneous_field_ids:
@@ -124,4 +126,75 @@ class OrphanLinkStructuresRepair(object):
             db.close()
 
 
+class CountedBTreeRepair(object):
+
+    description = ('Convert schevo.store BTrees to counted BTrees, '
+                   'for fast len(). (No data loss)')
+    is_needed_certainty = True
+
+    def __init__(self, db, db_filename):
+        self.db = db
+        self.db_filename = db_filename
+        self._determine_if_needed()
+
+    def perform(self):
+        # Database starts out closed.
+        db_filename = self.db_filename
+        db = schevo.database.open(db_filename)
+        try:
+            try:
+                for extent_map in db._extent_maps_by_id.itervalues():
+                    entities = extent_map['entities']
+                    for entity_map in entities.itervalues():
+                        links = entity_map['links']
+                        for key, btree in links.items():
+                            if not isinstance(btree, CountedBTree):
+                                links[key] = counted_copy(btree)
+                    if not isinstance(entities, CountedBTree):
+                        extent_map['entities'] = counted_copy(entities)
+                    indices = extent_map['indices']
+                    for index_spec, (unique, branch) in indices.items():
+                        indices[index_spec] = (
+                            unique,
+                            _counted_index(branch, len(index_spec)),
+                            )
+                    # Commit one extent at a time to bound memory use.
+                    db._commit()
+            except:
+                db._rollback()
+                raise
+        finally:
+            db.close()
+
+    def _determine_if_needed(self):
+        db = self.db
+        self.is_needed = False
+        # Only the schevo.store backend provides counted BTrees, and only
+        # format 2 keeps BTrees in the places converted by perform().
+        if db.format != 2 or db.backend.BTree is not CountedBTree:
+            return
+        for extent_map in db._extent_maps_by_id.itervalues():
+            if not isinstance(extent_map['entities'], CountedBTree):
+                self.is_needed = True
+                return
+            for unique, branch in extent_map['indices'].itervalues():
+                if not isinstance(branch, CountedBTree):
+                    self.is_needed = True
+                    return
+
+
+def _counted_index(branch, depth):
+    """Return `branch` of an index, with `depth` levels of branches below
+    it, with all of its BTrees converted to counted BTrees."""
+    if depth > 0:
+        for key, child in branch.items():
+            counted_child = _counted_index(child, depth - 1)
+            if counted_child is not child:
+                branch[key] = counted_child
+    if isinstance(branch, CountedBTree):
+        return branch
+    else:
+        return counted_copy(branch)
+
+
 optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -11,8 +11,10 @@ from schevo.script import (
     db_create,
     db_evolve,
     db_inject,
+    db_load,
     db_pack,
     db_repair,
+    db_stats,
     db_update,
     )
 
@@ -30,8 +32,10 @@ class Database(CommandSet):
             'create': db_create.start,
             'evolve': db_evolve.start,
             'inject': db_inject.start,
+            'load': db_load.start,
             'pack': db_pack.start,
             'repair': db_repair.start,
+            'stats': db_stats.start,
             'update': db_update.start,
             }
 
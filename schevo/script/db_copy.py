@@ -18,11 +18,21 @@ SRCFILE: The database file to copy the internal structures from.
 DESTFILE: The empty file to copy internal structures to.
 
 Backend options given apply to DESTFILE. The backend for SRCFILE is
-determined automatically."""
+determined automatically.
+
+The copy is committed to DESTFILE in steps, so that memory use stays
+bounded however large SRCFILE is; use --commit-interval to set how many
+objects are copied in each step."""
 
 
 def _parser():
     p = opt.parser(usage)
+    p.add_option('-i', '--commit-interval', dest='commit_interval',
+                 help='Commit after copying every N objects.',
+                 metavar='N',
+                 type='int',
+                 default=1000,
+                 )
     return p
 
 
@@ -45,6 +55,8 @@ class Copy(Command):
             dest_filename=dest_filename,
             dest_backend_name=options.backend_name,
             dest_backend_args=options.backend_args,
+            commit_interval=options.commit_interval,
+            progress=True,
             )
         print 'Copy complete.'
 
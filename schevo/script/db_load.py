@@ -0,0 +1,115 @@
+"""Load entities into a database from a CSV file."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import csv
+import os
+import time
+
+import schevo.database
+from schevo.constant import UNASSIGNED
+
+from schevo.script.command import Command
+from schevo.script import opt
+
+usage = """\
+schevo db load [options] DBFILE EXTENT CSVFILE
+
+DBFILE: The database file to load entities into.
+
+EXTENT: The name of the extent to create the entities in.
+
+CSVFILE: The CSV file to read.  Its first row gives the names of the
+fields in each column.  Each of the other rows is an entity, with field
+values given the way they are shown in user interfaces, e.g. Extent-OID
+for entity fields.  Empty values are UNASSIGNED, and fields that are not
+given get their default values.
+
+The entities are created in bulk, without executing a transaction for
+each one, and are added to the extent's indices at the end.  The load is
+committed in steps; use --commit-interval to set how many entities,
+index entries, and links are written in each step.  If any entity cannot
+be created, for instance because of a key collision, none of them are."""
+
+
+def _parser():
+    p = opt.parser(usage)
+    p.add_option('-i', '--commit-interval', dest='commit_interval',
+                 help='Commit after writing every N objects.',
+                 metavar='N',
+                 type='int',
+                 default=10000,
+                 )
+    p.add_option('-e', '--encoding', dest='encoding',
+                 help='Read CSVFILE using ENCODING.',
+                 metavar='ENCODING',
+                 default='utf-8',
+                 )
+    p.add_option('-n', '--no-validate', dest='validate',
+                 help='Do not validate field values.',
+                 action='store_false',
+                 default=True,
+                 )
+    return p
+
+
+def csv_rows(f, encoding):
+    """Generate a dictionary of field values for each row of CSV file `f`
+    after the first, keyed by the field names in the first row."""
+    reader = csv.reader(f)
+    field_names = [name.decode(encoding) for name in reader.next()]
+    for values in reader:
+        row = {}
+        for name, value in zip(field_names, values):
+            if value == '':
+                row[name] = UNASSIGNED
+            else:
+                row[name] = value.decode(encoding)
+        yield row
+
+
+class Load(Command):
+
+    name = 'Load'
+    description = 'Load entities into a database from a CSV file.'
+
+    def main(self, arg0, args):
+        print
+        print
+        parser = _parser()
+        options, args = parser.parse_args(list(args))
+        if len(args) != 3:
+            parser.error('Please specify DBFILE, EXTENT, and CSVFILE.')
+        db_filename, extent_name, csv_filename = args
+        if not os.path.isfile(db_filename):
+            parser.error('DBFILE must be an existing database.')
+        if not os.path.isfile(csv_filename):
+            parser.error('CSVFILE must be an existing file.')
+        db = schevo.database.open(
+            filename=db_filename,
+            backend_name=options.backend_name,
+            backend_args=options.backend_args,
+            )
+        try:
+            if extent_name not in db.extent_names():
+                parser.error('EXTENT must be the name of an extent in DBFILE.')
+            extent = db.extent(extent_name)
+            print 'Loading %r into %s...' % (csv_filename, extent_name)
+            start = time.time()
+            f = open(csv_filename, 'rb')
+            try:
+                count = extent.bulk_create(
+                    csv_rows(f, options.encoding),
+                    validate=options.validate,
+                    commit_interval=options.commit_interval,
+                    )
+            finally:
+                f.close()
+        finally:
+            db.close()
+        print '%i entities loaded in %.1f seconds.' % (
+            count, time.time() - start)
+
+
+start = Load
@@ -12,14 +12,24 @@ from schevo.script import opt
 from schevo.script.path import package_path
 
 usage = """\
-schevo db pack DBFILE
+schevo db pack [options] DBFILE
 
 DBFILE: The database file to pack.
+
+Progress is reported while the live objects are copied.  To pack a
+database that is in use by a running application, call its
+`start_pack` method instead, which does not block transactions.
 """
 
 
 def _parser():
     p = opt.parser(usage)
+    p.add_option('-r', '--rate', dest='rate',
+                 help='Read at most BYTES per second while packing.',
+                 metavar='BYTES',
+                 type='int',
+                 default=None,
+                 )
     return p
 
 
@@ -46,10 +56,16 @@ class Pack(Command):
             )
         # Pack the database.
         print 'Packing the database...'
-        db.pack()
+        pack = db.start_pack(rate=options.rate)
+        if pack is not None:
+            while not pack.wait(1.0):
+                print '%3d%% copied' % (pack.get_progress() * 100)
+            pack.finish()
         # Done.
         db.close()
         print 'Database pack complete.'
+        if pack is not None:
+            print '%d bytes reclaimed.' % pack.bytes_reclaimed
 
 
 start = Pack
@@ -0,0 +1,103 @@
+"""Database statistics command."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import os
+
+import schevo.database
+
+from schevo.script.command import Command
+from schevo.script import opt
+
+usage = """\
+schevo db stats DBFILE
+
+DBFILE: The database file to report on.
+
+For each class of object stored in the database, reports the number of
+objects, their size before compression and as stored, the bytes saved by
+compression, and the CPU time spent per object to decompress them.  The
+objects are also compressed again as the `compression` backend argument
+says, and their size and the CPU time spent per object are reported, so
+that settings can be compared without changing the database:
+
+  schevo db stats -A compression=zlib:1 DBFILE
+"""
+
+
+def _parser():
+    p = opt.parser(usage)
+    return p
+
+
+class Stats(Command):
+
+    name = 'Database Statistics'
+    description = 'Report on the objects stored in a database.'
+
+    def main(self, arg0, args):
+        print
+        print
+        parser = _parser()
+        options, args = parser.parse_args(list(args))
+        if len(args) != 1:
+            parser.error('Please specify DBFILE.')
+        db_filename = args[0]
+        # Open the database.
+        if not os.path.isfile(db_filename):
+            parser.error('DBFILE must be an existing database.')
+        db = schevo.database.open(
+            filename=db_filename,
+            backend_name=options.backend_name,
+            backend_args=options.backend_args,
+            )
+        compression_stats = getattr(db.backend, 'compression_stats', None)
+        if compression_stats is None:
+            db.close()
+            parser.error('The backend of DBFILE does not report statistics.')
+        print 'Reading every object in the database...'
+        stats = compression_stats()
+        db.close()
+        # Report, largest classes first.
+        print
+        print '%-44s %8s %9s %9s %6s %9s | %-7s %9s %6s %8s' % (
+            'class', 'objects', 'raw KB', 'stored KB', 'saved', 'decomp us',
+            'codec', 'codec KB', 'saved', 'comp us')
+        total_count = total_raw = total_stored = total_compressed = 0
+        for class_name, class_stats in sorted(
+            stats.iteritems(), key=lambda item: -item[1].raw_bytes):
+            raw_bytes = class_stats.raw_bytes
+            print ('%-44s %8d %9.1f %9.1f %5.1f%% %9.1f | '
+                   '%-7s %9.1f %5.1f%% %8.1f' % (
+                class_name[-44:],
+                class_stats.count,
+                raw_bytes / 1024.0,
+                class_stats.stored_bytes / 1024.0,
+                _percent(class_stats.get_saved_bytes(), raw_bytes),
+                class_stats.decompress_time * 1e6 / class_stats.count,
+                class_stats.codec,
+                class_stats.compressed_bytes / 1024.0,
+                _percent(raw_bytes - class_stats.compressed_bytes,
+                         raw_bytes),
+                class_stats.compress_time * 1e6 / class_stats.count,
+                ))
+            total_count += class_stats.count
+            total_raw += raw_bytes
+            total_stored += class_stats.stored_bytes
+            total_compressed += class_stats.compressed_bytes
+        print '%-44s %8d %9.1f %9.1f %5.1f%% %9s | %-7s %9.1f %5.1f%%' % (
+            'total', total_count, total_raw / 1024.0, total_stored / 1024.0,
+            _percent(total_raw - total_stored, total_raw), '', '',
+            total_compressed / 1024.0,
+            _percent(total_raw - total_compressed, total_raw))
+
+
+def _percent(part, whole):
+    if whole:
+        return 100.0 * part / whole
+    else:
+        return 0.0
+
+
+start = Stats
@@ -13,11 +13,13 @@ from schevo.store.backend_test_classes import (
     TestMethods_CreatesSchema,
     TestMethods_EvolvesSchemata,
     )
-from schevo.store.btree import BTree
+from schevo.store.btree import BTreeBuilder, CountedBTree
+from schevo.store.compression import CompressionPolicy
+from schevo.store.entity_record import EntityRecord
 from schevo.store.persistent_dict import PersistentDict
 from schevo.store.persistent_list import PersistentList
 from schevo.store.file_storage import FileStorage
-from schevo.store.connection import Connection
+from schevo.store.connection import Connection, get_compression_stats
 
 
 class SchevoStoreBackend(object):
@@ -28,11 +30,52 @@ class SchevoStoreBackend(object):
         Set the size of the in-memory object cache to SIZE, which is an
         integer specifying the maximum number of objects to keep in the
         cache.
+
+    cache_bytes=BYTES
+        Also keep the memory used by the objects in the cache under about
+        BYTES, as estimated from the size of the record of each object.
+        Objects of very different sizes, such as index nodes and field
+        dictionaries, are then accounted for by their size, not their
+        number.
+
+    offset_index=1
+        Keep the file offsets of objects in an index file alongside the
+        database file, so that they are not all loaded into memory when
+        the database is opened.
+
+    mmap_reads=1
+        Read objects from a memory map of the database file instead of
+        seeking and reading the file for each one.
+
+    durability=MODE
+        Set when commits are written to disk.  With `sync`, the default,
+        each commit waits until it is written to disk.  With `group`,
+        commits return once written to the operating system, and are
+        written to disk in groups; use wait_durable() to wait for that.
+        With `os`, writing to disk is left to the operating system until
+        the database is packed or closed.
+
+    group_commit_delay=SECONDS
+        With durability=group, the longest time a commit waits before it
+        is written to disk.  Defaults to 0.01.
+
+    group_commit_size=COUNT
+        With durability=group, the number of waiting commits that are
+        written to disk without further delay.  Defaults to 100.
+
+    compression=CODEC
+        Set how objects are compressed when written.  With `zlib`, the
+        default, they are compressed with zlib at level 6; with `zlib:N`,
+        at level N, from 1 (fastest) to 9 (smallest); with `none`, they
+        are not compressed.  Objects already written are read whatever
+        this is set to.
     """
 
     __test__ = False
 
-    BTree = BTree
+    BTree = CountedBTree
+    BTreeBuilder = BTreeBuilder
+    EntityRecord = EntityRecord
     PDict = PersistentDict
     PList = PersistentList
 
@@ -40,7 +83,10 @@ class SchevoStoreBackend(object):
     TestMethods_CreatesSchema = TestMethods_CreatesSchema
     TestMethods_EvolvesSchemata = TestMethods_EvolvesSchemata
 
-    def __init__(self, filename, fp=None, cache_size=100000):
+    def __init__(self, filename, fp=None, cache_size=100000,
+                 offset_index=False, mmap_reads=False, durability='sync',
+                 group_commit_delay=0.01, group_commit_size=100,
+                 compression='zlib', cache_bytes=None):
         """Create a new `SchevoStoreBackend` instance.
 
         - `filename`: Name of file to open with this backend. If
@@ -50,10 +96,32 @@ class SchevoStoreBackend(object):
           actual file in the filesystem.
         - `cache_size`: Maximum number of objects to keep in the
           in-memory object cache.
+        - `offset_index`: If `True`, keep the file offsets of objects
+          in an index file named by appending `.index` to `filename`.
+        - `mmap_reads`: If `True`, read objects from a memory map of
+          the file.
+        - `durability`: `'sync'`, `'group'`, or `'os'`.  See
+          `backend_args_help`.
+        - `group_commit_delay`: Longest time in seconds that a commit
+          waits to be written to disk with `'group'` durability.
+        - `group_commit_size`: Number of waiting commits that are
+          written to disk without further delay with `'group'`
+          durability.
+        - `compression`: `'zlib'`, `'zlib:N'`, or `'none'`.  See
+          `backend_args_help`.
+        - `cache_bytes`: (optional) Estimated memory use in bytes to keep
+          the in-memory object cache under.
         """
         self._filename = filename
         self._fp = fp
         self._cache_size = cache_size
+        self._offset_index = offset_index
+        self._mmap_reads = mmap_reads
+        self._durability = durability
+        self._group_commit_delay = group_commit_delay
+        self._group_commit_size = group_commit_size
+        self._compression = compression
+        self._cache_bytes = cache_bytes
         self._is_open = False
         self.open()
 
@@ -65,8 +133,14 @@ class SchevoStoreBackend(object):
         if s is not None:
             for arg in (p.strip() for p in s.split(',')):
                 name, value = (p2.strip() for p2 in arg.split('='))
-                if name == 'cache_size':
+                if name in ('cache_size', 'cache_bytes', 'group_commit_size'):
                     kw[name] = int(value)
+                elif name in ('offset_index', 'mmap_reads'):
+                    kw[name] = bool(int(value))
+                elif name in ('durability', 'compression'):
+                    kw[name] = value
+                elif name == 'group_commit_delay':
+                    kw[name] = float(value)
                 else:
                     raise KeyError(
                         '%s is not a valid name for backend args' % name)
@@ -118,16 +192,54 @@ class SchevoStoreBackend(object):
         """Open the underlying storage based on initial arguments."""
         if not self._is_open:
             try:
-                self.storage = FileStorage(self._filename, fp=self._fp)
+                self.storage = FileStorage(
+                    self._filename, fp=self._fp,
+                    offset_index=self._offset_index,
+                    mmap_reads=self._mmap_reads,
+                    durability=self._durability,
+                    group_commit_delay=self._group_commit_delay,
+                    group_commit_size=self._group_commit_size)
             except RuntimeError:
                 raise DatabaseFileLocked()
-            self.conn = Connection(self.storage, cache_size=self._cache_size)
+            self.conn = Connection(
+                self.storage, cache_size=self._cache_size,
+                compression=CompressionPolicy(self._compression),
+                cache_bytes=self._cache_bytes)
             self._is_open = True
 
     def pack(self):
         """Pack the underlying storage."""
         self.conn.pack()
 
+    def start_pack(self, rate=None):
+        """Start packing the underlying storage in a background thread,
+        reading at most `rate` bytes per second, and return the
+        `BackgroundPack`.  The packed file replaces the storage file at
+        the end of the first commit after copying is finished."""
+        return self.conn.start_pack(rate=rate)
+
+    def compression_stats(self):
+        """Return a dictionary of `CompressionStats` instances, keyed by
+        the name of each class of persistent object in the storage."""
+        return get_compression_stats(self.conn)
+
+    def wait_durable(self):
+        """Wait until the transactions committed so far are written to
+        disk."""
+        self.storage.wait_durable()
+
+    def preload(self, objects, batch_size=1000):
+        """Load the given persistent objects, and all objects reachable
+        from them, into the object cache.
+
+        - `objects`: Persistent objects from this backend.
+        - `batch_size`: Number of objects to read from storage at once.
+        """
+        get_crawler = self.conn.get_crawler
+        for obj in objects:
+            for obj in get_crawler(obj._p_oid, batch_size):
+                pass
+
     def rollback(self):
         """Abort the current transaction."""
         self.conn.abort()
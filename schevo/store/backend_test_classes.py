@@ -99,7 +99,9 @@ class TestMethods_CreatesDatabase(object):
             backend_args=dict(fp=fp),
             format=format,
             )
-        # Turn it back into a fpv attribute.
+        # Turn it back into a fpv attribute.  The hacked close() above
+        # kept the buffer, but StringIO refuses to read a closed file.
+        fp.closed = False
         setattr(test_object, 'fpv' + suffix, fp.getvalue())
 
     @staticmethod
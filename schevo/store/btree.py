@@ -6,6 +6,7 @@ $Id$
 import sys
 from schevo.lib import optimize
 
+from bisect import bisect_left
 from schevo.store.persistent import GHOST
 from schevo.store.persistent import Persistent
 
@@ -98,10 +99,13 @@ class BNode(Persistent):
         return len(self.items) == 2 * self.minimum_degree - 1
 
     def get_position(self, key):
-        for position, item in enumerate(self.items):
-            if item[0] >= key:
-                return position
-        return len(self.items)
+        """(key:anything) -> int
+        Return the position of the first item with a key that is not less
+        than the given key.
+        """
+        # (key,) sorts before every (key, value) item with an equal key, so
+        # the items can be searched directly, using only key comparisons.
+        return bisect_left(self.items, (key,))
 
     def search(self, key):
         """(key:anything) -> None | (key:anything, value:anything)
@@ -116,7 +120,8 @@ class BNode(Persistent):
             return self.nodes[position].search(key)
 
     def insert_item(self, item):
-        """(item:(key:anything, value:anything))
+        """(item:(key:anything, value:anything)) -> bool
+        Return True if the key was not already present.
         """
         assert not self.is_full()
         key = item[0]
@@ -124,16 +129,22 @@ class BNode(Persistent):
         if position < len(self.items) and self.items[position][0] == key:
             self.items[position] = item
             self._p_note_change()
+            return False
         elif self.is_leaf():
             self.items.insert(position, item)
             self._p_note_change()
+            return True
         else:
             child = self.nodes[position]
             if child.is_full():
                 self.split_child(position, child)
+                if key == self.items[position][0]:
+                    # The key was the median of the child.
+                    self.items[position] = item
+                    return False
                 if key > self.items[position][0]:
                     position += 1
-            self.nodes[position].insert_item(item)
+            return self.nodes[position].insert_item(item)
 
     def split_child(self, position, child):
         """(position:int, child:BNode)
@@ -211,15 +222,20 @@ class BNode(Persistent):
                     upper_sibling.delete(extreme[0])
                     self.items[p] = extreme
                 else:
-                    # Case 2c.
-                    extreme = upper_sibling.get_min_item()
-                    upper_sibling.delete(extreme[0])
-                    node.items = node.items + [extreme] + upper_sibling.items
+                    # Case 2c: Merge the key and upper_sibling into node.
+                    node.items = (node.items + [self.items[p]] +
+                                  upper_sibling.items)
                     if not node.is_leaf():
                         node.nodes = node.nodes + upper_sibling.nodes
                     node._p_note_change()
                     del self.items[p]
                     del self.nodes[p + 1]
+                    if not self.items:
+                        # This can happen when self is the root node.
+                        self.items = node.items
+                        self.nodes = node.nodes
+                        node = self
+                    node.delete(key)
                 self._p_note_change()
             else:
                 if not is_big(node):
@@ -259,13 +275,13 @@ class BNode(Persistent):
                         del self.nodes[p+1]
                     self._p_note_change()
                     node._p_note_change()
+                    if not self.items:
+                        # This can happen when self is the root node.
+                        self.items = node.items
+                        self.nodes = node.nodes
+                        node = self
                 assert is_big(node)
                 node.delete(key)
-            if not self.items:
-                # This can happen when self is the root node.
-                self.items = self.nodes[0].items
-                self.nodes = self.nodes[0].nodes
-                self._p_note_change()
 
     def get_count(self):
         result = len(self.items)
@@ -290,6 +306,260 @@ for bnode_class in [BNode] + BNode.__subclasses__():
     bnode_class.nodes_is = (None, [bnode_class])
 del bnode_class
 
+class CountedBNode(BNode):
+    """
+    A BNode that records the number of items below each of its children,
+    so that the size of a tree and the position of a key can be found
+    without visiting every node.
+
+    Instance attributes:
+      items: list
+      nodes: [CountedBNode]
+      counts: [int]
+        counts[i] is the number of items in the subtree at nodes[i].
+        This is None when the node is a leaf.
+    """
+
+    __slots__ = ['counts']
+
+    def __init__(self):
+        BNode.__init__(self)
+        self.counts = None
+
+    def __getstate__(self):
+        return dict(items=self.items, nodes=self.nodes, counts=self.counts)
+
+    def __setstate__(self, state):
+        self.items, self.nodes, self.counts = (
+            state['items'], state['nodes'], state['counts'])
+
+    def _p_set_status_ghost(self):
+        del self.items
+        del self.nodes
+        del self.counts
+        self._p_status = GHOST
+
+    def insert_item(self, item):
+        """(item:(key:anything, value:anything)) -> bool
+        Return True if the key was not already present.
+        """
+        if self.is_leaf():
+            return BNode.insert_item(self, item)
+        assert not self.is_full()
+        key = item[0]
+        position = self.get_position(key)
+        if position < len(self.items) and self.items[position][0] == key:
+            self.items[position] = item
+            self._p_note_change()
+            return False
+        child = self.nodes[position]
+        if child.is_full():
+            self.split_child(position, child)
+            if key == self.items[position][0]:
+                self.items[position] = item
+                return False
+            if key > self.items[position][0]:
+                position += 1
+        added = self.nodes[position].insert_item(item)
+        if added:
+            self.counts[position] += 1
+            self._p_note_change()
+        return added
+
+    def split_child(self, position, child):
+        """(position:int, child:CountedBNode)
+        """
+        BNode.split_child(self, position, child)
+        bigger = self.nodes[position + 1]
+        if not child.is_leaf():
+            middle = len(child.nodes)
+            bigger.counts = child.counts[middle:]
+            child.counts = child.counts[:middle]
+        self.counts[position] = child.get_count()
+        self.counts.insert(position + 1, bigger.get_count())
+
+    def delete(self, key):
+        """(key:anything)
+        Delete the item with this key.
+        This follows BNode.delete(), keeping the counts up to date.
+        """
+        def is_big(node):
+            # Precondition for recursively calling node.delete(key).
+            return node and len(node.items) >= node.minimum_degree
+        p = self.get_position(key)
+        matches = p < len(self.items) and self.items[p][0] == key
+        if self.is_leaf():
+            if matches:
+                # Case 1.
+                del self.items[p]
+                self._p_note_change()
+            else:
+                raise KeyError(key)
+        else:
+            counts = self.counts
+            node = self.nodes[p]
+            lower_sibling = p > 0 and self.nodes[p - 1]
+            upper_sibling = p < len(self.nodes) - 1 and self.nodes[p + 1]
+            if matches:
+                # Case 2.
+                if is_big(node):
+                    # Case 2a.
+                    extreme = node.get_max_item()
+                    node.delete(extreme[0])
+                    self.items[p] = extreme
+                    counts[p] -= 1
+                elif is_big(upper_sibling):
+                    # Case 2b.
+                    extreme = upper_sibling.get_min_item()
+                    upper_sibling.delete(extreme[0])
+                    self.items[p] = extreme
+                    counts[p + 1] -= 1
+                else:
+                    # Case 2c: Merge the key and upper_sibling into node.
+                    node.items = (node.items + [self.items[p]] +
+                                  upper_sibling.items)
+                    if not node.is_leaf():
+                        node.nodes = node.nodes + upper_sibling.nodes
+                        node.counts = node.counts + upper_sibling.counts
+                    node._p_note_change()
+                    del self.items[p]
+                    del self.nodes[p + 1]
+                    counts[p] += counts[p + 1] + 1
+                    del counts[p + 1]
+                    if not self.items:
+                        # This can happen when self is the root node.
+                        self.items = node.items
+                        self.nodes = node.nodes
+                        self.counts = node.counts
+                        self.delete(key)
+                    else:
+                        node.delete(key)
+                        counts[p] -= 1
+                self._p_note_change()
+            else:
+                if not is_big(node):
+                    if is_big(lower_sibling):
+                        # Case 3a1: Shift an item from lower_sibling.
+                        node.items.insert(0, self.items[p - 1])
+                        self.items[p - 1] = lower_sibling.items[-1]
+                        del lower_sibling.items[-1]
+                        shifted = 1
+                        if not node.is_leaf():
+                            node.nodes.insert(0, lower_sibling.nodes[-1])
+                            del lower_sibling.nodes[-1]
+                            shifted += lower_sibling.counts[-1]
+                            node.counts.insert(0, lower_sibling.counts[-1])
+                            del lower_sibling.counts[-1]
+                        counts[p - 1] -= shifted
+                        counts[p] += shifted
+                        lower_sibling._p_note_change()
+                    elif is_big(upper_sibling):
+                        # Case 3a2: Shift an item from upper_sibling.
+                        node.items.append(self.items[p])
+                        self.items[p] = upper_sibling.items[0]
+                        del upper_sibling.items[0]
+                        shifted = 1
+                        if not node.is_leaf():
+                            node.nodes.append(upper_sibling.nodes[0])
+                            del upper_sibling.nodes[0]
+                            shifted += upper_sibling.counts[0]
+                            node.counts.append(upper_sibling.counts[0])
+                            del upper_sibling.counts[0]
+                        counts[p + 1] -= shifted
+                        counts[p] += shifted
+                        upper_sibling._p_note_change()
+                    elif lower_sibling:
+                        # Case 3b1: Merge with lower_sibling
+                        node.items = (lower_sibling.items + [self.items[p-1]] +
+                                      node.items)
+                        if not node.is_leaf():
+                            node.nodes = lower_sibling.nodes + node.nodes
+                            node.counts = lower_sibling.counts + node.counts
+                        del self.items[p-1]
+                        del self.nodes[p-1]
+                        counts[p] += counts[p-1] + 1
+                        del counts[p-1]
+                        p -= 1
+                    else:
+                        # Case 3b2: Merge with upper_sibling
+                        node.items = (node.items + [self.items[p]] +
+                                      upper_sibling.items)
+                        if not node.is_leaf():
+                            node.nodes = node.nodes + upper_sibling.nodes
+                            node.counts = node.counts + upper_sibling.counts
+                        del self.items[p]
+                        del self.nodes[p+1]
+                        counts[p] += counts[p+1] + 1
+                        del counts[p+1]
+                    self._p_note_change()
+                    node._p_note_change()
+                    if not self.items:
+                        # This can happen when self is the root node.
+                        self.items = node.items
+                        self.nodes = node.nodes
+                        self.counts = node.counts
+                        self.delete(key)
+                        return
+                assert is_big(node)
+                node.delete(key)
+                counts[p] -= 1
+                self._p_note_change()
+
+    def get_count(self):
+        return len(self.items) + sum(self.counts or ())
+
+    def get_item_at(self, index):
+        """(index:int) -> (key:anything, value:anything)
+        Return the item at the given position, which must be in range.
+        """
+        node = self
+        while not node.is_leaf():
+            for position, count in enumerate(node.counts):
+                if index < count:
+                    node = node.nodes[position]
+                    break
+                index -= count
+                if index == 0:
+                    return node.items[position]
+                index -= 1
+            else:
+                raise IndexError(index)
+        return node.items[index]
+
+    def get_rank(self, key):
+        """(key:anything) -> int
+        Return the number of items with keys less than the given key.
+        """
+        node = self
+        rank = 0
+        while True:
+            position = node.get_position(key)
+            rank += position
+            if node.is_leaf():
+                return rank
+            rank += sum(node.counts[:position])
+            if position < len(node.items) and node.items[position][0] == key:
+                return rank + node.counts[position]
+            node = node.nodes[position]
+
+
+class CountedBNode2  (CountedBNode): __slots__ = []; minimum_degree = 2
+class CountedBNode4  (CountedBNode): __slots__ = []; minimum_degree = 4
+class CountedBNode8  (CountedBNode): __slots__ = []; minimum_degree = 8
+class CountedBNode16 (CountedBNode): __slots__ = []; minimum_degree = 16
+class CountedBNode32 (CountedBNode): __slots__ = []; minimum_degree = 32
+class CountedBNode64 (CountedBNode): __slots__ = []; minimum_degree = 64
+class CountedBNode128(CountedBNode): __slots__ = []; minimum_degree = 128
+class CountedBNode256(CountedBNode): __slots__ = []; minimum_degree = 256
+class CountedBNode512(CountedBNode): __slots__ = []; minimum_degree = 512
+
+# Set narrow specifications of CountedBNode instance attributes.
+for bnode_class in [CountedBNode] + CountedBNode.__subclasses__():
+    bnode_class.items_is = [tuple]
+    bnode_class.nodes_is = (None, [bnode_class])
+    bnode_class.counts_is = (None, [int])
+del bnode_class
+
 
 class BTree(Persistent):
     """
@@ -305,6 +575,27 @@ class BTree(Persistent):
         self.root = node_constructor()
         self._p_note_change()
 
+    @classmethod
+    def from_sorted(cls, items, node_constructor=None, fill_factor=1.0):
+        """(items:iterable, node_constructor:class=None,
+            fill_factor:float=1.0) -> BTree
+        Return a new BTree holding the (key, value) items, which must be
+        given in increasing key order.  The tree is built from the bottom
+        up in one pass, with each node holding fill_factor of the items
+        it can hold, instead of about half of them as when items are
+        added one at a time.  A fill_factor below 1.0 leaves room for
+        later additions without splitting nodes.
+        """
+        if node_constructor is None:
+            btree = cls()
+        else:
+            btree = cls(node_constructor)
+        builder = BTreeBuilder(btree, fill_factor)
+        for key, value in items:
+            builder.add(key, value)
+        builder.finish()
+        return btree
+
     def __getstate__(self):
         return dict(root=self.root)
 
@@ -460,4 +751,246 @@ class BTree(Persistent):
                 yield item
 
 
+class CountedBTree(BTree):
+    """
+    A BTree built of CountedBNodes.  The number of items is available
+    without loading the whole tree, and items can be addressed by position.
+
+    Instance attributes:
+      root: CountedBNode
+    """
+    root_is = CountedBNode
+
+    __slots__ = []
+
+    def __init__(self, node_constructor=CountedBNode16):
+        assert issubclass(node_constructor, CountedBNode)
+        BTree.__init__(self, node_constructor)
+
+    def add(self, key, value=True):
+        """(key:anything, value:anything=True)
+        Make self[key] == val.
+        """
+        if self.root.is_full():
+            # replace and split.
+            node = self.root.__class__()
+            node.nodes = [self.root]
+            node.counts = [self.root.get_count()]
+            node._p_note_change()
+            node.split_child(0, node.nodes[0])
+            self.root = node
+            self._p_note_change()
+        self.root.insert_item((key, value))
+
+    def item_at(self, index):
+        """(index:int) -> (key:anything, value:anything)
+        Return the item at the given position in key order.
+        Negative positions count back from the end.
+        """
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError(index)
+        return self.root.get_item_at(index)
+
+    def rank(self, key):
+        """(key:anything) -> int
+        Return the number of items with keys less than the given key.
+        """
+        return self.root.get_rank(key)
+
+
+class BTreeBuilder(object):
+    """
+    Fills an empty BTree with items given in increasing key order.  Each
+    node is filled from left to right, and completed nodes are never
+    visited again, instead of every item being inserted from the root.
+
+    The nodes being filled form the right edge of the tree, and are always
+    reachable from the BTree, so a commit made while building stores the
+    nodes completed so far and lets them leave the cache.  The BTree is
+    not usable until finish() has been called.
+
+    Instance attributes:
+      btree : BTree
+      node_class : class
+        The class of the nodes of btree.
+      counted : bool
+        True if node_class is a CountedBNode.
+      node_size : int
+        The number of items in each completed node, except the last one
+        at each level.
+      levels : [BNode]
+        The node being filled at each level, leaves first.  Each of them is
+        the last child of the next.
+      last_key : anything
+        The key of the item added last.
+      empty : bool
+        True until the first item is added.
+    """
+
+    def __init__(self, btree, fill_factor=1.0):
+        """(btree:BTree, fill_factor:float=1.0)
+        Each completed node holds fill_factor of the items a node can
+        hold, but never fewer than the minimum.
+        """
+        assert not btree, 'BTree is not empty'
+        if not 0 < fill_factor <= 1:
+            raise ValueError('fill_factor must be above 0 and at most 1.')
+        self.btree = btree
+        self.node_class = btree.root.__class__
+        self.counted = issubclass(self.node_class, CountedBNode)
+        minimum_degree = self.node_class.minimum_degree
+        self.node_size = max(minimum_degree - 1, int(
+            (2 * minimum_degree - 1) * fill_factor + 0.5))
+        self.levels = [btree.root]
+        self.last_key = None
+        self.empty = True
+
+    def add(self, key, value=True):
+        """(key:anything, value:anything=True)
+        Add an item.  The key must be greater than the key of the item
+        added before it.
+        """
+        if self.empty:
+            self.empty = False
+        elif not key > self.last_key:
+            raise ValueError('Keys are not in increasing order.')
+        self.last_key = key
+        leaf = self.levels[0]
+        if len(leaf.items) < self.node_size:
+            leaf.items.append((key, value))
+            leaf._p_note_change()
+        else:
+            # The leaf is complete, and the item separates it from the next.
+            self.levels[0] = self.node_class()
+            self._push(1, (key, value), self.levels[0])
+
+    def _new_internal_node(self, child):
+        node = self.node_class()
+        node.nodes = [child]
+        if self.counted:
+            node.counts = [0]
+        return node
+
+    def _push(self, level, item, child):
+        """(level:int, item:(key, value), child:BNode)
+        The last child of the node being filled at level is complete.  Add
+        item after it, followed by child, the next node being filled at the
+        level below.
+        """
+        if level == len(self.levels):
+            # Grow a new root above the old one.
+            root = self._new_internal_node(self.btree.root)
+            self.levels.append(root)
+            self.btree.root = root
+            self.btree._p_note_change()
+        node = self.levels[level]
+        if self.counted:
+            node.counts[-1] = node.nodes[-1].get_count()
+        if len(node.items) < self.node_size:
+            node.items.append(item)
+            node.nodes.append(child)
+            if self.counted:
+                node.counts.append(0)
+            node._p_note_change()
+        else:
+            node._p_note_change()
+            self.levels[level] = self._new_internal_node(child)
+            self._push(level + 1, item, self.levels[level])
+
+    def _fill_last_child(self, node):
+        """(node:BNode) -> BNode
+        Make sure that the last child of node has at least the minimum
+        number of items, by moving items from the child before it.  Return
+        the new last child.
+        """
+        child = node.nodes[-1]
+        minimum = node.minimum_degree - 1
+        if len(child.items) >= minimum or len(node.nodes) < 2:
+            return child
+        left = node.nodes[-2]
+        items = left.items + [node.items[-1]] + child.items
+        if child.is_leaf():
+            nodes = counts = None
+        else:
+            nodes = left.nodes + child.nodes
+            if self.counted:
+                counts = left.counts + child.counts
+        if len(items) <= 2 * minimum + 1:
+            # Merge child into left.
+            left.items = items
+            left.nodes = nodes
+            if self.counted:
+                left.counts = counts
+            del node.items[-1]
+            del node.nodes[-1]
+            if self.counted:
+                del node.counts[-1]
+            child = left
+        else:
+            middle = len(items) // 2
+            left.items = items[:middle]
+            node.items[-1] = items[middle]
+            child.items = items[middle + 1:]
+            if nodes is not None:
+                left.nodes = nodes[:middle + 1]
+                child.nodes = nodes[middle + 1:]
+                if self.counted:
+                    left.counts = counts[:middle + 1]
+                    child.counts = counts[middle + 1:]
+            child._p_note_change()
+        left._p_note_change()
+        node._p_note_change()
+        if self.counted and child is not left:
+            node.counts[-2] = left.get_count()
+        return child
+
+    def finish(self):
+        """Complete the BTree, after the last item has been added.
+        """
+        levels = self.levels
+        for level in xrange(len(levels) - 1, 0, -1):
+            levels[level - 1] = self._fill_last_child(levels[level])
+        if self.counted:
+            for level in xrange(1, len(levels)):
+                node = levels[level]
+                node.counts[-1] = node.nodes[-1].get_count()
+                node._p_note_change()
+        root = levels[-1]
+        while not root.is_leaf() and not root.items:
+            root = root.nodes[0]
+        if root is not self.btree.root:
+            self.btree.root = root
+            self.btree._p_note_change()
+        self.levels = None
+
+
+_counted_bnode_classes = dict(
+    (bnode_class.minimum_degree, bnode_class)
+    for bnode_class in CountedBNode.__subclasses__())
+
+def _counted_copy(node):
+    """(node:BNode) -> CountedBNode
+    Return a new CountedBNode tree with the same items as `node`.
+    """
+    copy = _counted_bnode_classes[node.minimum_degree]()
+    copy.items = list(node.items)
+    if not node.is_leaf():
+        copy.nodes = [_counted_copy(child) for child in node.nodes]
+        copy.counts = [child.get_count() for child in copy.nodes]
+    return copy
+
+def counted_copy(btree):
+    """(btree:BTree) -> CountedBTree
+    Return a new CountedBTree with the same items, and the same node
+    degree, as `btree`.  The nodes are copied directly instead of adding
+    each item again.  Values are shared, not copied.
+    """
+    copy = CountedBTree(_counted_bnode_classes[btree.root.minimum_degree])
+    copy.root = _counted_copy(btree.root)
+    return copy
+
+
 optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -0,0 +1,260 @@
+"""
+Compression of the state pickles of persistent objects.
+
+In each record, the state pickle follows the class pickle.  It is stored
+in one of these forms, told apart by its first byte:
+
+  1) '\\x80': an uncompressed pickle
+  2) 'x': a zlib stream
+  3) 'D': the oid of a CompressionDictionary (8 bytes), followed by a zlib
+     stream that continues one that started with the contents of the
+     dictionary.  This works like a zlib preset dictionary: pickles of the
+     same class share most of their bytes with the dictionary, so small
+     objects compress much better than they do on their own.
+
+A CompressionPolicy chooses the form for each persistent class.  Records
+are read the same way whatever the policy, so the policy can be changed at
+any time.
+
+A record compressed with a dictionary refers to it like any other
+persistent reference, so packing keeps the dictionary as long as some
+record needs it.  The contents of a CompressionDictionary must never be
+changed once it is stored.  To keep using a dictionary after reopening,
+keep a reference to it, for example in the root:
+
+    samples = [...]  # state pickles of BNode instances
+    dictionary = CompressionDictionary(train_dictionary(samples))
+    connection.get_root()['bnode_dictionary'] = dictionary
+    connection.compression.set(BNode, DictionaryCompression(dictionary))
+"""
+
+import sys
+from schevo.lib import optimize
+
+from schevo.store.persistent import PersistentData
+from zlib import compress, compressobj, decompressobj
+from zlib import Z_SYNC_FLUSH
+
+# Deflate can only refer back 32KB, and the last part of a dictionary is
+# the most useful.
+MAX_DICTIONARY_SIZE = 32768
+
+
+class CompressionDictionary(PersistentData):
+    """
+    The preset contents of the zlib streams of DictionaryCompression.
+
+    Instance attributes:
+      data : str
+    """
+
+    __slots__ = []
+
+    def __init__(self, data):
+        if len(data) > MAX_DICTIONARY_SIZE:
+            raise ValueError('Dictionary is longer than %s bytes.' %
+                             MAX_DICTIONARY_SIZE)
+        self.data = data
+        self._p_note_change()
+
+
+class Codec(object):
+    """
+    Compresses state pickles.
+
+    Class attributes:
+      name : str
+        A short description, as used in get_codec().
+      dictionary : CompressionDictionary | None
+        The persistent object that compressed states refer to.
+    """
+
+    name = None
+    dictionary = None
+
+    def compress(self, data):
+        """(data:str) -> str
+        """
+        raise NotImplementedError
+
+
+class NoCompression(Codec):
+
+    name = 'none'
+
+    def compress(self, data):
+        return data
+
+
+class ZlibCompression(Codec):
+
+    def __init__(self, level=6):
+        """(level:int=6)
+        """
+        self.level = level
+        self.name = 'zlib:%s' % level
+
+    def compress(self, data):
+        return compress(data, self.level)
+
+
+class DictionaryCompression(Codec):
+
+    def __init__(self, dictionary, level=6):
+        """(dictionary:CompressionDictionary, level:int=6)
+        """
+        self.dictionary = dictionary
+        self.level = level
+        self.name = 'zdict:%s' % level
+        self.compressor = None
+
+    def compress(self, data):
+        assert self.dictionary._p_oid is not None
+        if self.compressor is None:
+            compressor = compressobj(self.level)
+            compressor.compress(self.dictionary.data)
+            compressor.flush(Z_SYNC_FLUSH)
+            self.compressor = compressor
+        compressor = self.compressor.copy()
+        return ''.join(['D', self.dictionary._p_oid,
+                        compressor.compress(data), compressor.flush()])
+
+
+def get_codec(name):
+    """(name:str) -> Codec
+    Return the codec described by name, which is 'none', 'zlib', or
+    'zlib:' followed by a compression level.
+    """
+    if name == 'none':
+        return NoCompression()
+    if name == 'zlib':
+        return ZlibCompression()
+    if name.startswith('zlib:'):
+        level = int(name[5:])
+        if 0 <= level <= 9:
+            return ZlibCompression(level)
+    raise ValueError('Unknown compression %r.' % name)
+
+def get_primed_decompressor(data):
+    """(data:str) -> decompressobj
+    Return a decompressor that has already produced data, to be copied
+    for each state compressed by DictionaryCompression with data as its
+    dictionary.
+    """
+    compressor = compressobj(0)
+    decompressor = decompressobj()
+    decompressor.decompress(
+        compressor.compress(data) + compressor.flush(Z_SYNC_FLUSH))
+    return decompressor
+
+def train_dictionary(samples, size=16384):
+    """(samples:sequence(str), size:int=16384) -> str
+    Return dictionary contents for compressing strings like the samples.
+    The most frequent samples are placed last, where deflate finds them
+    most cheaply.
+    """
+    size = min(size, MAX_DICTIONARY_SIZE)
+    counts = {}
+    for position, sample in enumerate(samples):
+        count, first = counts.get(sample, (0, position))
+        counts[sample] = (count + 1, first)
+    ordered = sorted(counts, key=counts.get)
+    chunks = []
+    length = 0
+    for sample in reversed(ordered):
+        if length >= size:
+            break
+        chunks.append(sample)
+        length += len(sample)
+    chunks.reverse()
+    return ''.join(chunks)[-size:]
+
+
+class CompressionStats(object):
+    """
+    Totals for the records of one class, as found by
+    schevo.store.connection.get_compression_stats().
+
+    Instance attributes:
+      codec : str
+        The name of the codec the compression policy gives the class.
+      count : int
+        The number of records.
+      raw_bytes : int
+        The size of the state pickles before compression.
+      stored_bytes : int
+        The size of the state pickles as stored.
+      compressed_bytes : int
+        The size of the state pickles when compressed with codec.
+      compress_time : float
+        The seconds taken to compress the state pickles with codec.
+      decompress_time : float
+        The seconds taken to decompress the stored state pickles.
+    """
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.count = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.compressed_bytes = 0
+        self.compress_time = 0.0
+        self.decompress_time = 0.0
+
+    def get_saved_bytes(self):
+        """() -> int"""
+        return self.raw_bytes - self.stored_bytes
+
+
+class CompressionPolicy(object):
+    """
+    Chooses the codec for the state of each persistent class.
+
+    Instance attributes:
+      default : Codec
+        The codec for classes that have not been given one.
+      codecs : { class : Codec }
+        The codecs given to classes.  Subclasses use the codec of their
+        nearest base class that has one.
+    """
+
+    def __init__(self, default='zlib'):
+        """(default:Codec|str='zlib')
+        """
+        if isinstance(default, basestring):
+            default = get_codec(default)
+        self.default = default
+        self.codecs = {}
+        self._resolved = {}
+
+    def set(self, klass, codec):
+        """(klass:class, codec:Codec|str)
+        Use codec for the state of instances of klass and its subclasses.
+        """
+        if isinstance(codec, basestring):
+            codec = get_codec(codec)
+        if (codec.dictionary is not None and
+            issubclass(klass, CompressionDictionary)):
+            raise ValueError('Dictionaries cannot be compressed with '
+                             'dictionaries.')
+        self.codecs[klass] = codec
+        self._resolved.clear()
+
+    def get_codec(self, klass):
+        """(klass:class) -> Codec
+        """
+        codec = self._resolved.get(klass)
+        if codec is None:
+            codec = self.default
+            for base in klass.__mro__:
+                if base in self.codecs:
+                    codec = self.codecs[base]
+                    break
+            if (codec.dictionary is not None and
+                issubclass(klass, CompressionDictionary)):
+                codec = ZlibCompression()
+            self._resolved[klass] = codec
+        return codec
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -5,17 +5,20 @@ $Id$
 import sys
 from schevo.lib import optimize
 
-from cPickle import loads
-from heapq import heappush, heappop
+from cPickle import loads, Unpickler
+from cStringIO import StringIO
+from collections import deque
 from schevo.store.error import ConflictError, ReadConflictError, DurusKeyError
+from schevo.store.compression import CompressionStats
 from schevo.store.logger import log
 from schevo.store.persistent import ConnectionBase
 from schevo.store.persistent_dict import PersistentDict
 from schevo.store.serialize import ObjectReader, ObjectWriter
-from schevo.store.serialize import split_oids, unpack_record, pack_record
+from schevo.store.serialize import new_compression_policy
+from schevo.store.serialize import unpack_record, pack_record
+from schevo.store.serialize import unpack_record_data, unpack_record_refs
 from schevo.store.storage import Storage
 from schevo.store.utils import p64
-from itertools import islice, chain
 from os import getpid
 from time import time
 from weakref import ref, KeyedRef
@@ -31,6 +34,8 @@ class Connection(ConnectionBase):
       storage: Storage
       cache: Cache
       reader: ObjectReader
+      compression: CompressionPolicy
+        Chooses how the state of each class of object is compressed.
       changed: {oid:str : Persistent}
       invalid_oids: set([str])
          Set of oids of objects known to have obsolete state.
@@ -40,14 +45,23 @@ class Connection(ConnectionBase):
         in the cache.
     """
 
-    def __init__(self, storage, cache_size=100000):
-        """(storage:Storage, cache_size:int=100000)
+    def __init__(self, storage, cache_size=100000, compression=None,
+                 cache_bytes=None):
+        """(storage:Storage, cache_size:int=100000,
+            compression:CompressionPolicy=None, cache_bytes:int=None)
         Make a connection to `storage`.
         Set the target number of non-ghosted persistent objects to keep in
         the cache at `cache_size`.
+        If `compression` is None, compress the state of every object with
+        zlib.
+        If `cache_bytes` is given, also keep the estimated memory used by
+        the objects in the cache under that many bytes.
         """
         assert isinstance(storage, Storage)
         self.storage = storage
+        if compression is None:
+            compression = new_compression_policy()
+        self.compression = compression
         self.reader = ObjectReader(self)
         self.changed = {}
         self.invalid_oids = set()
@@ -62,7 +76,7 @@ class Connection(ConnectionBase):
             self.storage.end(self._handle_invalidations)
             self.transaction_serial += 1
         self.new_oid = storage.new_oid # needed by serialize
-        self.cache = Cache(cache_size)
+        self.cache = Cache(cache_size, max_bytes=cache_bytes)
 
     def get_storage(self):
         """() -> Storage"""
@@ -86,6 +100,30 @@ class Connection(ConnectionBase):
         """
         self.cache.set_size(size)
 
+    def get_cache_bytes(self):
+        """() -> int | None
+        Return the target estimated memory use of the cache, in bytes.
+        """
+        return self.cache.max_bytes
+
+    def set_cache_bytes(self, max_bytes):
+        """(max_bytes:int | None)
+        Set the target estimated memory use of the cache, in bytes, or
+        remove it if max_bytes is None.
+        """
+        self.cache.set_max_bytes(max_bytes)
+
+    def get_cache_stats(self):
+        """() -> {str : int | float}
+        Return the number of objects in the cache ('count'), their estimated
+        memory use ('bytes'), the number of first accesses to objects in
+        each transaction ('accesses'), the number of objects whose state was
+        loaded from storage ('faults'), the fraction of accesses that did
+        not need to load ('hit_ratio'), and the number of objects ghosted to
+        make room ('evictions').
+        """
+        return self.cache.get_stats()
+
     def get_transaction_serial(self):
         """() -> int
         Return the number of calls to commit() or abort() on this instance.
@@ -98,21 +136,28 @@ class Connection(ConnectionBase):
         """
         return self.get(ROOT_OID)
 
-    def get_stored_pickle(self, oid):
-        """(oid:str) -> str
-        Retrieve the pickle from storage.  Will raise ReadConflictError if
-        pickle the pickle is invalid.
+    def get_stored_record(self, oid):
+        """(oid:str) -> str | buffer
+        Retrieve the record from storage, without copying it if the storage
+        allows.  Will raise ReadConflictError if the record is invalid.
         """
         if oid in self.invalid_oids:
             # someone is still trying to read after getting a conflict
             raise ReadConflictError([oid])
         try:
-            record = self.storage.load(oid)
+            record = self.storage.load_buffer(oid)
         except ReadConflictError:
             invalid_oids = self.storage.sync()
             self._handle_invalidations(invalid_oids, read_oid=oid)
-            record = self.storage.load(oid)
-        oid2, data, refdata = unpack_record(record)
+            record = self.storage.load_buffer(oid)
+        return record
+
+    def get_stored_pickle(self, oid):
+        """(oid:str) -> str
+        Retrieve the pickle from storage.  Will raise ReadConflictError if
+        pickle the pickle is invalid.
+        """
+        oid2, data, refdata = unpack_record(self.get_stored_record(oid))
         assert oid == oid2
         return data
 
@@ -154,24 +199,24 @@ class Connection(ConnectionBase):
             if obj is None:
                 klass = loads(data)
                 obj = self.cache.get_instance(oid, klass, self)
+            if obj._p_is_ghost():
                 state = self.reader.get_state(data, load=True)
                 obj.__setstate__(state)
                 obj._p_set_status_saved()
-            elif obj._p_is_ghost():
-                state = self.reader.get_state(data, load=True)
-                obj.__setstate__(state)
-                obj._p_set_status_saved()
-            return obj, split_oids(refdata)
+                self.cache.note_load(oid, len(object_record))
+                self.note_access(obj)
+            return obj, unpack_record_refs(object_record)
         queue = [start_oid]
-        seen = set()
-        while queue:
-            batch = queue[:batch_size]
-            queue = queue[batch_size:]
-            seen.update(batch)
+        seen = set(queue)
+        position = 0
+        while position < len(queue):
+            batch = queue[position:position + batch_size]
+            position += len(batch)
             for record in self.storage.bulk_load(batch):
                 obj, refs = get_object_and_refs(record)
                 for ref in refs:
                     if ref not in seen:
+                        seen.add(ref)
                         queue.append(ref)
                 yield obj
 
@@ -187,20 +232,23 @@ class Connection(ConnectionBase):
         oid = obj._p_oid
         setstate = obj.__setstate__
         try:
-            pickle = self.get_stored_pickle(oid)
+            record = self.get_stored_record(oid)
         except DurusKeyError:
             # We have a ghost but cannot find the state for it.  This can
             # happen if the object was removed from the storage as a result
             # of packing.
             raise ReadConflictError([oid])
+        record_oid, pickle = unpack_record_data(record)
+        assert oid == record_oid
         state = self.reader.get_state(pickle)
         setstate(state)
+        self.cache.note_load(oid, len(record))
 
     def note_access(self, obj):
         assert obj._p_connection is self
         assert obj._p_oid is not None
         obj._p_serial = self.transaction_serial
-        self.cache.recent_objects.add(obj)
+        self.cache.note_access(obj)
 
     def note_change(self, obj):
         """(obj:Persistent)
@@ -230,6 +278,7 @@ class Connection(ConnectionBase):
             obj = self.cache.get(oid)
             if obj is not None:
                 obj._p_set_status_ghost()
+                self.cache.forget_size(oid)
         self.invalid_oids.clear()
 
     def abort(self):
@@ -238,6 +287,7 @@ class Connection(ConnectionBase):
         """
         for oid, obj in self.changed.iteritems():
             obj._p_set_status_ghost()
+            self.cache.forget_size(oid)
         self.changed.clear()
         self._sync()
         self.shrink_cache()
@@ -257,9 +307,9 @@ class Connection(ConnectionBase):
                 raise ConflictError(list(self.invalid_oids))
             self.storage.begin()
             new_objects = {}
-            for oid, changed_object in self.changed.iteritems():
-                writer = ObjectWriter(self)
-                try:
+            writer = ObjectWriter(self)
+            try:
+                for oid, changed_object in self.changed.iteritems():
                     for obj in writer.gen_new_objects(changed_object):
                         oid = obj._p_oid
                         if oid in new_objects:
@@ -268,10 +318,14 @@ class Connection(ConnectionBase):
                             new_objects[oid] = obj
                             self.cache[oid] = obj
                         data, refs = writer.get_state(obj)
-                        self.storage.store(oid, pack_record(oid, data, refs))
+                        record = pack_record(oid, data, refs)
+                        self.storage.store(oid, record)
                         obj._p_set_status_saved()
-                finally:
-                    writer.close()
+                        self.cache.note_size(oid, len(record))
+                        if obj._p_serial != self.transaction_serial:
+                            self.note_access(obj)
+            finally:
+                writer.close()
             try:
                 self.storage.end(self._handle_invalidations)
             except ConflictError, exc:
@@ -311,6 +365,13 @@ class Connection(ConnectionBase):
         self.abort()
         self.storage.pack()
 
+    def start_pack(self, rate=None):
+        """(rate:int=None) -> BackgroundPack
+        Start packing the storage in a background thread.  See
+        FileStorage.start_pack().
+        """
+        return self.storage.start_pack(rate=rate)
+
 
 class ObjectDictionary (object):
 
@@ -344,21 +405,68 @@ class ObjectDictionary (object):
     def __len__(self):
         return len(self.mapping) - len(self.dead)
 
-    def __iter__(self):
+    def purge(self):
+        """Forget the keys of values that no longer exist."""
         while self.dead:
             self.mapping.pop(self.dead.pop(), None)
+
+    def __iter__(self):
+        self.purge()
         for key in self.mapping:
             if key not in self.dead:
                 yield key
 
 
 class Cache(object):
+    """
+    Keeps track of the Persistent instances of a Connection, and keeps the
+    recently accessed ones from being ghosted or garbage-collected.
+
+    The objects are kept under a target number, and optionally under a
+    target estimate of the memory they use.  The estimate for each object
+    whose state is loaded is OBJECT_BYTES plus RECORD_FACTOR times the size
+    of its record, which is about right for the objects that Schevo
+    stores.
+
+    Replacement is least-recently-used, at the granularity of transactions.
+    Each first access to an object in a transaction appends an entry to a
+    queue, which therefore stays in order of access.  An entry is stale if
+    its object has been accessed again since, and it is dropped when it
+    reaches the front of the queue.  Making room takes entries from the
+    front, so the work done after each transaction is proportional to the
+    number of objects accessed, not to the size of the cache.
+
+    Instance attributes:
+      objects : ObjectDictionary
+        Weak references to every instance, keyed by oid.
+      size : int
+        The target number of instances.
+      max_bytes : int | None
+        The target estimated memory use of the instances.
+      queue : deque([(serial:int, obj:Persistent)])
+        The accesses, oldest first, with the transaction serial of each.
+      sizes : {oid:str : int}
+        The estimated memory use of each instance whose state is loaded.
+      bytes : int
+        The total of sizes.
+      accesses, faults, evictions : int
+        The number of calls to note_access() and note_load(), and the
+        number of objects ghosted by shrink().
+    """
 
-    def __init__(self, size):
+    OBJECT_BYTES = 300
+    RECORD_FACTOR = 3
+
+    def __init__(self, size, max_bytes=None):
         self.objects = ObjectDictionary()
-        self.recent_objects = set()
+        self.queue = deque()
+        self.sizes = {}
+        self.bytes = 0
+        self.accesses = 0
+        self.faults = 0
+        self.evictions = 0
         self.set_size(size)
-        self.finger = 0
+        self.set_max_bytes(max_bytes)
 
     def get_size(self):
         """Return the target size of the cache."""
@@ -373,6 +481,23 @@ class Cache(object):
             raise ValueError, 'cache target size must be > 0'
         self.size = size
 
+    def set_max_bytes(self, max_bytes):
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError, 'cache target bytes must be > 0'
+        self.max_bytes = max_bytes
+
+    def get_stats(self):
+        """() -> {str : int | float}
+        See Connection.get_cache_stats().
+        """
+        if self.accesses:
+            hit_ratio = max(0.0, 1.0 - float(self.faults) / self.accesses)
+        else:
+            hit_ratio = 1.0
+        return dict(count=len(self.objects), bytes=self.bytes,
+                    accesses=self.accesses, faults=self.faults,
+                    hit_ratio=hit_ratio, evictions=self.evictions)
+
     def get_instance(self, oid, klass, connection):
         """
         This returns the existing object with the given oid, or else it makes
@@ -405,55 +530,98 @@ class Cache(object):
     def __delitem__(self, key):
         obj = self.objects.get(key)
         if obj is not None:
-            self.recent_objects.discard(obj)
             assert obj._p_oid is None
             del self.objects[key]
+            self.forget_size(key)
 
-    def _build_heap(self, transaction_serial):
-        """(transaction_serial:int) -> [(serial, oid)]
+    def note_access(self, obj):
+        """(obj:Persistent)
+        Note the first access to obj in the transaction given by its
+        _p_serial.
         """
-        all = self.objects
-        heap_size_target = (len(all) - self.size) * 2
-        start = self.finger % len(all)
-        heap = []
-        for oid in islice(chain(all, all), start, start + len(all)):
-            self.finger += 1
-            obj = all.get(oid)
-            if obj is None:
-                continue # The ref is dead.
-            if obj._p_serial == transaction_serial:
-                continue # obj is current.  Leave it alone.
-            heappush(heap, (obj._p_serial, oid))
-            if len(heap) >= heap_size_target:
-                break
-        self.finger = self.finger % len(all)
-        return heap
+        self.accesses += 1
+        self.queue.append((obj._p_serial, obj))
+
+    def note_load(self, oid, record_size):
+        """(oid:str, record_size:int)
+        Note that the state of an object was loaded from a record of
+        record_size bytes.
+        """
+        self.faults += 1
+        self.note_size(oid, record_size)
+
+    def note_size(self, oid, record_size):
+        """(oid:str, record_size:int)
+        Note that the state of an object corresponds to a record of
+        record_size bytes.
+        """
+        size = self.OBJECT_BYTES + self.RECORD_FACTOR * record_size
+        self.bytes += size - self.sizes.get(oid, 0)
+        self.sizes[oid] = size
+
+    def forget_size(self, oid):
+        """(oid:str)
+        Note that the state of an object is no longer loaded.
+        """
+        self.bytes -= self.sizes.pop(oid, 0)
+
+    def _compact_queue(self):
+        """Drop the stale entries of the queue."""
+        self.queue = deque([(serial, obj) for serial, obj in self.queue
+                            if obj._p_serial == serial and
+                            obj._p_oid is not None])
 
     def shrink(self, connection):
         """(connection:Connection)
-        Try to reduce the size of self.objects.
+        Try to reduce the size of self.objects, by ghosting up to twice the
+        excess number of the objects that were accessed least recently.
+        If max_bytes is set, also ghost the objects accessed least recently
+        until the estimated memory use is under max_bytes.  Objects accessed
+        in the current transaction are left alone.
         """
-        current = len(self.objects)
-        if current <= self.size:
+        objects = self.objects
+        for oid in objects.dead:
+            self.forget_size(oid)
+        objects.purge()
+        current = len(objects)
+        queue = self.queue
+        if len(queue) > 2 * max(current, self.size):
+            # Most entries are stale, as objects are accessed again and
+            # again without the cache filling up.
+            self._compact_queue()
+            queue = self.queue
+        max_bytes = self.max_bytes
+        if current <= self.size and (max_bytes is None or
+                                     self.bytes <= max_bytes):
             # No excess.
-            log(10, '[%s] cache size %s recent %s',
-                getpid(), current, len(self.recent_objects))
+            log(10, '[%s] cache size %s bytes %s queue %s',
+                getpid(), current, self.bytes, len(queue))
             return
         start_time = time()
-        heap = self._build_heap(connection.get_transaction_serial())
+        transaction_serial = connection.get_transaction_serial()
+        limit = (current - self.size) * 2
         num_ghosted = 0
-        while heap and len(self.objects) > self.size:
-            serial, oid = heappop(heap)
-            obj = self.objects.get(oid)
-            if obj is None:
-                continue
+        popleft = queue.popleft
+        while queue:
+            if not ((limit > 0 and len(objects) > self.size) or
+                    (max_bytes is not None and self.bytes > max_bytes)):
+                break
+            serial, obj = queue[0]
+            if serial == transaction_serial:
+                break # The rest are current.  Leave them alone.
+            popleft()
+            if obj._p_serial != serial or obj._p_oid is None:
+                continue # Accessed again later, or removed.
+            limit -= 1
             if obj._p_is_saved():
                 obj._p_set_status_ghost()
                 num_ghosted += 1
-            self.recent_objects.discard(obj)
-        log(10, '[%s] shrink %fs removed %s ghosted %s size %s recent %s',
-            getpid(), time() - start_time, current - len(self.objects),
-            num_ghosted, len(self.objects), len(self.recent_objects))
+            if obj._p_is_ghost():
+                self.forget_size(obj._p_oid)
+        self.evictions += num_ghosted
+        log(10, '[%s] shrink %fs removed %s ghosted %s size %s bytes %s '
+            'queue %s', getpid(), time() - start_time, current - len(objects),
+            num_ghosted, len(objects), self.bytes, len(queue))
 
 
 def touch_every_reference(connection, *words):
@@ -471,6 +639,41 @@ def touch_every_reference(connection, *words):
             if word in data or word in state:
                 get(oid)._p_note_change()
 
+def get_compression_stats(connection):
+    """(connection:Connection) -> {class_name:str : CompressionStats}
+    Read every record in the storage.  For each class, total the size of
+    the state pickles before compression and as stored, and the time taken
+    to decompress them.  Also total the size of the state pickles, and the
+    time taken, when they are compressed again with the codec that the
+    compression policy of the connection gives the class.
+    """
+    reader = ObjectReader(connection)
+    get_codec = connection.compression.get_codec
+    stats = {}
+    for oid, record in connection.get_storage().gen_oid_record():
+        record_oid, data, refs = unpack_record(record)
+        s = StringIO(data)
+        klass = Unpickler(s).load()
+        stored_bytes = len(data) - s.tell()
+        codec = get_codec(klass)
+        start = time()
+        state = reader.get_state_pickle(data)
+        decompress_time = time() - start
+        start = time()
+        compressed_bytes = len(codec.compress(state))
+        compress_time = time() - start
+        class_name = '%s.%s' % (klass.__module__, klass.__name__)
+        class_stats = stats.get(class_name)
+        if class_stats is None:
+            class_stats = stats[class_name] = CompressionStats(codec.name)
+        class_stats.count += 1
+        class_stats.raw_bytes += len(state)
+        class_stats.stored_bytes += stored_bytes
+        class_stats.compressed_bytes += compressed_bytes
+        class_stats.compress_time += compress_time
+        class_stats.decompress_time += decompress_time
+    return stats
+
 def gen_every_instance(connection, *classes):
     """(connection:Connection, *classes:(class)) -> sequence [Persistent]
     Generate all Persistent instances that are instances of any of the
@@ -0,0 +1,233 @@
+"""
+Compact persistent records of entities, for Schevo database format 3.
+
+In format 2, each entity is stored as four persistent dictionaries.  An
+EntityRecord stores the same information in a single record, and is used
+like the dictionary it replaces, with the keys 'rev', 'link_count',
+'fields', 'related_entities' and 'links'.
+"""
+
+import sys
+from schevo.lib import optimize
+
+from itertools import izip
+from UserDict import DictMixin
+from schevo.store.persistent import GHOST
+from schevo.store.persistent import Persistent
+from schevo.store.persistent_dict import PersistentDict
+
+
+# Tuples of keys, so that records with the same keys share one tuple.
+_shared_keys = {}
+
+
+def shared_keys(keys):
+    """(keys:tuple) -> tuple
+    Return a tuple equal to keys, which is the same for all equal keys.
+    """
+    return _shared_keys.setdefault(keys, keys)
+
+
+def pack_items(mapping):
+    """(mapping) -> ((key, ...), (value, ...))
+    Return the keys of mapping in order, as a shared tuple, and a tuple of
+    the values in the same order.
+    """
+    keys = sorted(mapping)
+    return (shared_keys(tuple(keys)),
+            tuple([mapping[key] for key in keys]))
+
+
+class EntityRecord(Persistent):
+    """
+    Instance attributes:
+      rev : int
+      link_count : int
+      fields : ((field_id:int, ...), (value:anything, ...))
+        The ids of the fields in order, and their stored values in the
+        same order.  Records with the same fields share the tuple of ids,
+        so that only the values take memory for each record.
+      related_entities : ((field_id:int, ...), (frozenset(Placeholder), ...))
+        The same, for the sets of entities each field refers to.
+      links : PersistentDict | None
+        { (extent_id, field_id) : BTree }, or None until the first link
+        to the entity is added.
+    """
+
+    __slots__ = ['rev', 'link_count', 'fields', 'related_entities', 'links',
+                 '__weakref__']
+
+    def __init__(self, fields={}, related_entities={}, rev=0, link_count=0):
+        """(fields:{field_id:int : anything}={},
+            related_entities:{field_id:int : frozenset(Placeholder)}={},
+            rev:int=0, link_count:int=0)
+        """
+        self.rev = rev
+        self.link_count = link_count
+        self.fields = pack_items(fields)
+        self.related_entities = pack_items(related_entities)
+        self.links = None
+        self._p_note_change()
+
+    def __getstate__(self):
+        return (self.rev, self.link_count, self.fields,
+                self.related_entities, self.links)
+
+    def __setstate__(self, state):
+        (self.rev, self.link_count, fields, related_entities,
+         self.links) = state
+        self.fields = (shared_keys(fields[0]), fields[1])
+        self.related_entities = (shared_keys(related_entities[0]),
+                                 related_entities[1])
+
+    __delattr__ = object.__delattr__
+
+    __setattr__ = object.__setattr__
+
+    def _p_set_status_ghost(self):
+        del self.rev
+        del self.link_count
+        del self.fields
+        del self.related_entities
+        del self.links
+        self._p_status = GHOST
+
+    def __getitem__(self, key):
+        if key == 'fields' or key == 'related_entities':
+            return PackedItems(self, key)
+        elif key == 'rev':
+            return self.rev
+        elif key == 'link_count':
+            return self.link_count
+        elif key == 'links':
+            links = self.links
+            if links is None:
+                return LazyLinks(self)
+            return links
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        # Note the change first, since that loads the state of a ghost.
+        self._p_note_change()
+        if key == 'fields' or key == 'related_entities':
+            setattr(self, key, pack_items(value))
+        elif key == 'rev' or key == 'link_count' or key == 'links':
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in ('fields', 'link_count', 'links', 'related_entities',
+                       'rev')
+
+    def keys(self):
+        return ['fields', 'link_count', 'links', 'related_entities', 'rev']
+
+
+class PackedItems(DictMixin):
+    """
+    The dictionary stored as a pair of tuples of keys and values in an
+    attribute of an EntityRecord.  Changes replace the pair.
+
+    Instance attributes:
+      record : EntityRecord
+      name : str
+        The name of the attribute.
+    """
+
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __getitem__(self, key):
+        keys, values = getattr(self.record, self.name)
+        try:
+            return values[keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        keys, values = getattr(self.record, self.name)
+        try:
+            return values[keys.index(key)]
+        except ValueError:
+            return default
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def __delitem__(self, key):
+        data = dict(self.iteritems())
+        del data[key]
+        self.record[self.name] = data
+
+    def update(self, other=(), **kwargs):
+        data = dict(self.iteritems())
+        data.update(other, **kwargs)
+        self.record[self.name] = data
+
+    def __contains__(self, key):
+        return key in getattr(self.record, self.name)[0]
+
+    def __iter__(self):
+        return iter(getattr(self.record, self.name)[0])
+
+    def __len__(self):
+        return len(getattr(self.record, self.name)[0])
+
+    def keys(self):
+        return list(getattr(self.record, self.name)[0])
+
+    def iteritems(self):
+        keys, values = getattr(self.record, self.name)
+        return izip(keys, values)
+
+
+class LazyLinks(DictMixin):
+    """
+    The links of an EntityRecord that has none yet.  The first link added
+    creates the PersistentDict of links.
+
+    Instance attributes:
+      record : EntityRecord
+    """
+
+    def __init__(self, record):
+        self.record = record
+
+    def __getitem__(self, key):
+        links = self.record.links
+        if links is None:
+            raise KeyError(key)
+        return links[key]
+
+    def __setitem__(self, key, value):
+        links = self.record.links
+        if links is None:
+            links = self.record['links'] = PersistentDict()
+        links[key] = value
+
+    def __delitem__(self, key):
+        links = self.record.links
+        if links is None:
+            raise KeyError(key)
+        del links[key]
+
+    def __contains__(self, key):
+        links = self.record.links
+        return links is not None and key in links
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        links = self.record.links
+        if links is None:
+            return []
+        return links.keys()
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
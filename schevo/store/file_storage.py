@@ -7,11 +7,16 @@ import sys
 from schevo.lib import optimize
 
 from cPickle import dumps, loads
+from mmap import mmap, ACCESS_READ
 from schevo.store.connection import ROOT_OID
-from schevo.store.serialize import split_oids, unpack_record
+from schevo.store.offset_index import OffsetIndex, new_offset_index
+from schevo.store.reachability import OidBitmap, OidStack
+from schevo.store.serialize import unpack_record_refs
 from schevo.store.storage import Storage
 from schevo.store.utils import p32, u32, p64, u64
 from tempfile import NamedTemporaryFile
+from threading import Condition, Lock, Thread
+from time import sleep, time
 from zlib import compress, decompress
 import os
 
@@ -46,6 +51,12 @@ else:
     def fsync(fd):
         pass
 
+# Appended to the name of a storage file to name its offset index file.
+OFFSET_INDEX_SUFFIX = '.index'
+
+# Values for the durability argument of FileStorage.
+DURABILITY_MODES = ('sync', 'group', 'os')
+
 
 class FileStorage(Storage):
     """
@@ -53,21 +64,75 @@ class FileStorage(Storage):
       fp : file
       index : { oid:string : offset:int }
         Gives the offset of the current version of each oid.
+      offset_index : bool
+        If true, index is an OffsetIndex kept in a file alongside the
+        storage file, instead of a dictionary built when the storage is
+        opened.
+      mmap_reads : bool
+        If true, records are read from a read-only memory map of the file
+        instead of being read from fp.
+      durability : str
+        One of DURABILITY_MODES.  With 'sync', each commit calls fsync()
+        before it returns.  With 'group', a GroupCommitter calls fsync() for
+        the commits made since its last call, and wait_durable() waits for
+        it.  With 'os', fsync() is only called when the storage is packed
+        or closed.
       pending_records : { oid:str : record:str }
         Object records are accumulated here during a commit.
       pack_extra : [oid:str] | None
         oids of objects that have been committed after the pack began.  It is
         None if a pack is not in progress.
+      background_pack : BackgroundPack | None
+        The pack started by start_pack(), until it replaces the file or is
+        cancelled.
     """
 
     _PACK_INCREMENT = 20 # number of records to pack before yielding
 
-    def __init__(self, filename=None, readonly=False, repair=False, fp=None):
-        """(filename:str=None, readonly:bool=False, repair:bool=False)
+    # bulk_load() reads records whose offsets are within _BULK_READ_GAP
+    # bytes of each other with one read, spanning at most _BULK_READ_SIZE
+    # bytes plus _BULK_READ_TAIL bytes for the last record in the span.
+    _BULK_READ_GAP = 4096
+    _BULK_READ_SIZE = 1 << 20
+    _BULK_READ_TAIL = 4096
+
+    # _write_transaction() writes records in one call, unless they add up
+    # to more than this many bytes.
+    _WRITE_BUFFER_SIZE = 1 << 23
+
+    def __init__(self, filename=None, readonly=False, repair=False, fp=None,
+                 offset_index=False, mmap_reads=False, durability='sync',
+                 group_commit_delay=0.01, group_commit_size=100):
+        """(filename:str=None, readonly:bool=False, repair:bool=False,
+            offset_index:bool=False, mmap_reads:bool=False,
+            durability:str='sync', group_commit_delay:float=0.01,
+            group_commit_size:int=100)
         If filename is empty (or None), a temporary file will be used.
+        If offset_index is true, the offsets of FileStorage2 records are
+        kept in the file named by OFFSET_INDEX_SUFFIX appended to filename,
+        so that they need not all be loaded when the storage is opened.
+        If mmap_reads is true, records are sliced out of a memory map of the
+        file instead of being read with a seek() and read() for each one.
+        The durability is one of DURABILITY_MODES.  With 'group',
+        fsync() is called once group_commit_size commits are waiting for it,
+        or group_commit_delay seconds after the first of them.
         """
+        if durability not in DURABILITY_MODES:
+            raise ValueError("Unknown durability %r." % durability)
+        if (durability == 'group' and fp is not None and
+            not hasattr(fp, 'fileno')):
+            raise ValueError("A real file is required for group commits.")
+        self.durability = durability
+        self._committer = None
         self.oid = 0
         self.filename = filename
+        if offset_index and not filename:
+            raise ValueError("A filename is required for an offset index.")
+        self.offset_index = offset_index
+        if mmap_reads and fp is not None and not hasattr(fp, 'fileno'):
+            raise ValueError("A real file is required for mmap reads.")
+        self.mmap_reads = mmap_reads
+        self._map = None
         if fp is not None:
             self.fp = fp
         elif readonly:
@@ -93,16 +158,23 @@ class FileStorage(Storage):
                     "\n  %s is locked."
                     "\n  There is probably a Durus storage server (or a client)"
                     "\n  using it.\n" % self.get_filename())
+        if durability == 'group' and self.fp.mode != 'rb':
+            self._committer = GroupCommitter(
+                self, group_commit_delay, group_commit_size)
         self.pending_records = {}
         self.pack_extra = None
+        self.background_pack = None
         self.repair = repair
         self._set_concrete_class_for_magic()
         self.index = {}
         self._build_index()
-        max_oid = 0
-        for oid in self.index:
-            max_oid = max(max_oid, u64(oid))
-        self.oid = max_oid
+        if self.offset_index:
+            self.oid = self.index.max_oid
+        else:
+            max_oid = 0
+            for oid in self.index:
+                max_oid = max(max_oid, u64(oid))
+            self.oid = max_oid
 
     def _set_concrete_class_for_magic(self):
         """
@@ -143,9 +215,66 @@ class FileStorage(Storage):
         if self.fp is None:
             raise IOError, 'storage is closed'
         offset = self.index[oid]
+        if self.mmap_reads:
+            start, end = self._find_mapped_block(offset)
+            return self._map[start:end]
         self.fp.seek(offset)
         return self._read_block()
 
+    def load_buffer(self, oid):
+        if not self.mmap_reads:
+            return self.load(oid)
+        if self.fp is None:
+            raise IOError, 'storage is closed'
+        start, end = self._find_mapped_block(self.index[oid])
+        return buffer(self._map, start, end - start)
+
+    def bulk_load(self, oids):
+        """(oids:sequence(oid:str)) -> sequence(record:str)
+        The records are read in the order they appear in the file, with
+        nearby records read together, and generated in the order of oids.
+        """
+        if self.fp is None:
+            raise IOError, 'storage is closed'
+        if self.mmap_reads:
+            for oid in oids:
+                yield self.load(oid)
+            return
+        oids = list(oids)
+        index = self.index
+        offsets = sorted([(index[oid], position)
+                          for position, oid in enumerate(oids)])
+        records = [None] * len(oids)
+        count = len(offsets)
+        first = 0
+        while first < count:
+            span_start = offsets[first][0]
+            last = first + 1
+            while (last < count and
+                   offsets[last][0] - offsets[last - 1][0] <=
+                   self._BULK_READ_GAP and
+                   offsets[last][0] - span_start < self._BULK_READ_SIZE):
+                last += 1
+            self.fp.seek(span_start)
+            chunk = self.fp.read(offsets[last - 1][0] - span_start +
+                                 self._BULK_READ_TAIL)
+            for offset, position in offsets[first:last]:
+                start = offset - span_start + 4
+                size_str = chunk[start - 4:start]
+                if len(size_str) == 4:
+                    end = start + u32(size_str)
+                else:
+                    end = None
+                if end is not None and end <= len(chunk):
+                    records[position] = chunk[start:end]
+                else:
+                    # The record extends beyond the chunk.
+                    self.fp.seek(offset)
+                    records[position] = self._read_block()
+            first = last
+        for record in records:
+            yield record
+
     def begin(self):
         pass
 
@@ -167,18 +296,36 @@ class FileStorage(Storage):
             self.fp, self._generate_pending_records(), index):
             pass
         self.fp.flush()
-        if hasattr(self.fp, 'fileno'):
-            fsync(self.fp)
-        self.index.update(index)
+        if self.durability == 'sync':
+            if hasattr(self.fp, 'fileno'):
+                fsync(self.fp)
+        elif self._committer is not None:
+            self._committer.note_commit()
+        pack = self.background_pack
+        if pack is not None and isinstance(pack.index, SnapshotIndex):
+            pack.index.update(index)
+        else:
+            self.index.update(index)
+        if self.offset_index:
+            self.index.flush(self.fp.tell())
         if self.pack_extra is not None:
             self.pack_extra.extend(index)
         self.pending_records.clear()
+        self._check_background_pack()
+
+    def wait_durable(self):
+        """Wait until the commits made so far have been written to disk,
+        if they are being written by a GroupCommitter.
+        """
+        if self._committer is not None:
+            self._committer.wait()
 
     def sync(self):
         """
         A FileStorage is the storage of one StorageServer or one
         Connection, so there can never be any invalidations to transfer.
         """
+        self._check_background_pack()
         return []
 
     def get_filename(self):
@@ -190,52 +337,100 @@ class FileStorage(Storage):
 
     def _write_transaction(self, fp, records, index):
         fp.seek(0, 2)
+        offset = fp.tell()
+        chunks = []
+        size = 0
         for i, (oid, record) in enumerate(records):
             full_record = self._disk_format(record)
-            index[oid] = fp.tell()
-            fp.write(p32(len(full_record)))
-            fp.write(full_record)
+            index[oid] = offset + size
+            chunks.append(p32(len(full_record)))
+            chunks.append(full_record)
+            size += 4 + len(full_record)
+            if size > self._WRITE_BUFFER_SIZE:
+                fp.write(''.join(chunks))
+                offset += size
+                chunks = []
+                size = 0
             if i % self._PACK_INCREMENT == 0:
                 yield None
-        fp.write(p32(0)) # terminator
+        chunks.append(p32(0)) # terminator
+        fp.write(''.join(chunks))
 
     def _disk_format(self, record):
         return record
 
-    def _packer(self):
+    def _open_pack_file(self):
+        """() -> file
+        Open the file that packed records are written to, and write its
+        header.
+        """
         if self.filename:
-            prepack_name = self.filename + '.prepack'
-            pack_name = self.filename + '.pack'
-            packed = open(pack_name, 'w+b')
+            packed = open(self.filename + '.pack', 'w+b')
         else:
             packed = NamedTemporaryFile(suffix=".durus",
                                         mode="w+b")
         lock_file(packed)
         self._write_header(packed)
-        def gen_reachable_records():
-            todo = [ROOT_OID]
-            seen = set()
+        return packed
+
+    def _gen_reachable_records(self, load):
+        """(load:callable) -> sequence([(oid:str, record:str)])
+        Generate the records reachable from the root, as returned by
+        load(oid).  Memory use is about one bit per oid, as the oids seen
+        are kept in a bitmap and the oids to visit spill to a temporary
+        file.
+        """
+        seen = OidBitmap(len(self.index))
+        todo = OidStack()
+        seen.add(ROOT_OID)
+        todo.push(ROOT_OID)
+        add_new = seen.add_new
+        try:
             while todo:
                 oid = todo.pop()
-                if oid in seen:
-                    continue
-                seen.add(oid)
-                record = self.load(oid)
-                record_oid, data, refdata = unpack_record(record)
-                assert oid == record_oid
-                todo.extend(split_oids(refdata))
+                record = load(oid)
+                assert oid == record[:8]
+                todo.extend(add_new(unpack_record_refs(record)))
+                yield oid, record
+        finally:
+            todo.close()
+
+    def _packer(self):
+        packed = self._open_pack_file()
+        def gen_records():
+            for oid, record in self._gen_reachable_records(self.load):
                 yield oid, record
             while self.pack_extra:
                 oid = self.pack_extra.pop()
                 yield oid, self.load(oid)
         index = {}
-        for z in self._write_transaction(
-            packed, gen_reachable_records(), index):
+        for z in self._write_transaction(packed, gen_records(), index):
             yield None
+        self._finish_pack(packed, index)
+
+    def _finish_pack(self, packed, index):
+        """(packed:file, index:{oid:str : offset:int})
+        Write the records committed since the pack began that have not
+        been written yet, and the index, to packed, and replace the
+        storage file with it.
+        """
+        def gen_extra_records():
+            while self.pack_extra:
+                oid = self.pack_extra.pop()
+                yield oid, self.load(oid)
+        if self.pack_extra:
+            for z in self._write_transaction(
+                packed, gen_extra_records(), index):
+                pass
         self._write_index(packed, index)
         packed.flush()
         fsync(packed)
+        self._map = None
+        # Make sure the committer is not using the file being replaced.
+        self.wait_durable()
         if self.filename:
+            prepack_name = self.filename + '.prepack'
+            pack_name = self.filename + '.pack'
             if not RENAME_OPEN_FILE:
                 unlock_file(packed)
                 packed.close()
@@ -254,7 +449,11 @@ class FileStorage(Storage):
             unlock_file(self.fp)
             self.fp.close()
             self.fp = packed
-        self.index = index
+        if self.offset_index:
+            self.index.close()
+            self.index = self._new_offset_index(index)
+        else:
+            self.index = index
         self.pack_extra = None
 
     def get_packer(self):
@@ -275,6 +474,71 @@ class FileStorage(Storage):
         for z in self.get_packer():
             pass
 
+    def start_pack(self, rate=None):
+        """(rate:int=None) -> BackgroundPack
+        Start packing in a background thread, which reads at most rate
+        bytes of records per second if rate is given.  Loads and commits
+        can continue meanwhile, from the thread that uses the storage.
+        Once the reachable records have been copied, the packed file
+        replaces the storage file at the end of the next commit or call to
+        sync(), or when finish() is called on the BackgroundPack.
+        """
+        if self.fp is None:
+            raise IOError, 'storage is closed'
+        if self.fp.mode == 'rb':
+            raise IOError, "read-only storage"
+        assert not self.pending_records
+        assert self.pack_extra is None
+        self.pack_extra = []
+        self.background_pack = BackgroundPack(self, rate)
+        return self.background_pack
+
+    def _get_pack_snapshot(self):
+        """() -> (file, index)
+        Return a new read-only file object for the storage file, and an
+        index of the records in it, neither of which change with later
+        commits, for a BackgroundPack to read from another thread.  The
+        index is a SnapshotIndex over the storage's index, so that it is
+        not copied.
+        """
+        return open(self.get_filename(), 'rb'), SnapshotIndex(self.index)
+
+    def _load_from(self, fp, index, oid):
+        """(fp:file, index:{oid:str : offset:int}, oid:str) -> record:str
+        Like load(), but read with fp and index.
+        """
+        fp.seek(index[oid])
+        return self._read_block(fp)
+
+    def _check_background_pack(self):
+        """Complete the background pack, if it has finished copying."""
+        pack = self.background_pack
+        if pack is not None and pack.state != 'copying':
+            self._end_background_pack(pack.state == 'ready')
+
+    def _end_background_pack(self, replace):
+        """(replace:bool)
+        Stop using the background pack.  If replace is true, finish the
+        pack and replace the storage file with the packed file.  Otherwise
+        discard the packed file.
+        """
+        pack = self.background_pack
+        self.background_pack = None
+        pack.close_snapshot()
+        if replace:
+            self.fp.seek(0, 2)
+            size = self.fp.tell()
+            self._finish_pack(pack.packed, pack.packed_index)
+            self.fp.seek(0, 2)
+            pack.bytes_reclaimed = size - self.fp.tell()
+            pack.set_state('done')
+        else:
+            self.pack_extra = None
+            unlock_file(pack.packed)
+            pack.packed.close()
+            if self.filename:
+                os.unlink(self.filename + '.pack')
+
     def gen_oid_record(self):
         """() -> sequence([(oid:str, record:str)])
         Generate oid, record pairs, for all oids in the database.
@@ -285,25 +549,388 @@ class FileStorage(Storage):
             yield oid, self.load(oid)
 
     def close(self):
+        if self.background_pack is not None:
+            self.background_pack.cancel()
+        self._map = None
+        if self._committer is not None:
+            self._committer.close()
+            self._committer = None
+        if self.offset_index:
+            self.index.close()
         if self.fp is not None:
             if hasattr(self.fp, 'fileno'):
+                if self.durability != 'sync' and self.fp.mode != 'rb':
+                    self.fp.flush()
+                    fsync(self.fp)
                 unlock_file(self.fp)
             self.fp.close()
             self.fp = None
 
-    def _read_block(self):
-        size_str = self.fp.read(4)
+    def _get_map(self, end):
+        """(end:int) -> mmap
+        Return a memory map of the file that extends at least to end, if
+        the file does.  The file only grows between packs, so a map is
+        only replaced when a record lies beyond it.  The old map is not
+        closed, since buffers returned by load_buffer() may still use it.
+        """
+        if self._map is None or len(self._map) < end:
+            self._map = mmap(self.fp.fileno(), 0, access=ACCESS_READ)
+        return self._map
+
+    def _find_mapped_block(self, offset):
+        """(offset:int) -> (start:int, end:int)
+        Return the position in the memory map of the block at offset, as
+        _read_block() would read it from the file.
+        """
+        data = self._get_map(offset + 4)
+        size_str = data[offset:offset + 4]
+        if len(size_str) == 0:
+            raise IOError, "eof"
+        start = offset + 4
+        end = start + u32(size_str)
+        if len(self._get_map(end)) < end:
+            raise IOError, "short read"
+        return start, end
+
+    def _read_block(self, fp=None):
+        if fp is None:
+            fp = self.fp
+        size_str = fp.read(4)
         if len(size_str) == 0:
             raise IOError, "eof"
         size = u32(size_str)
         if size == 0:
             return ''
-        result = self.fp.read(size)
+        result = fp.read(size)
         if len(result) != size:
             raise IOError, "short read"
         return result
 
 
+class GroupCommitter(object):
+    """
+    Calls fsync() on the file of a FileStorage in a background thread, once
+    for all of the commits that have been made since its last call.
+
+    Instance attributes:
+      storage : FileStorage
+      delay : float
+        The longest time, in seconds, that a commit waits for fsync().
+      size : int
+        The number of waiting commits that cause fsync() to be called
+        without further delay.
+      written : int
+        The number of commits that have been made.
+      synced : int
+        The number of commits that have been written to disk.
+      sync_count : int
+        The number of times fsync() has been called.
+      since : float | None
+        The time of the first commit made since the last call to fsync().
+      error : Exception | None
+        The exception raised by fsync(), if it failed.
+    """
+
+    def __init__(self, storage, delay, size):
+        self.storage = storage
+        self.delay = delay
+        self.size = size
+        self.written = 0
+        self.synced = 0
+        self.sync_count = 0
+        self.since = None
+        self.error = None
+        self.closed = False
+        self.condition = Condition()
+        self.thread = Thread(target=self._run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def note_commit(self):
+        """Note that a commit has been written to the file."""
+        self.condition.acquire()
+        try:
+            self.written += 1
+            if self.since is None:
+                self.since = time()
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def wait(self):
+        """Wait until the commits noted so far are written to disk."""
+        self.condition.acquire()
+        try:
+            written = self.written
+            while self.synced < written and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise IOError("fsync failed: %s" % self.error)
+        finally:
+            self.condition.release()
+
+    def close(self):
+        """Write any remaining commits to disk and stop the thread."""
+        self.condition.acquire()
+        try:
+            self.closed = True
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        self.thread.join()
+
+    def _run(self):
+        condition = self.condition
+        condition.acquire()
+        try:
+            while True:
+                while self.written == self.synced and not self.closed:
+                    condition.wait()
+                if self.written == self.synced:
+                    return # closed
+                # Wait for more commits to join this group.
+                deadline = self.since + self.delay
+                while (self.written - self.synced < self.size and
+                       not self.closed):
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        break
+                    condition.wait(remaining)
+                written = self.written
+                self.since = None
+                condition.release()
+                try:
+                    try:
+                        fsync(self.storage.fp.fileno())
+                    except (IOError, OSError), exc:
+                        error = exc
+                    else:
+                        error = None
+                finally:
+                    condition.acquire()
+                self.sync_count += 1
+                if error is not None:
+                    self.error = error
+                    condition.notifyAll()
+                    return
+                self.synced = written
+                condition.notifyAll()
+        finally:
+            condition.release()
+
+
+class SnapshotIndex(object):
+    """
+    Gives the offsets that an index held when the SnapshotIndex was made,
+    without copying it.  While it is in use, records are added to the
+    index with update(), which first saves the offsets being replaced.
+    Lookups and updates may be made from different threads.
+
+    Instance attributes:
+      index : { oid:str : offset:int }
+        The index of the storage, which is updated in place.
+      saved : { oid:str : offset:int | None }
+        The offsets that updates have replaced, or None for oids that were
+        not in the index.
+      count : int
+        The number of records in the index when the SnapshotIndex was made.
+      lock : Lock
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.saved = {}
+        self.count = len(index)
+        self.lock = Lock()
+
+    def __getitem__(self, oid):
+        self.lock.acquire()
+        try:
+            if oid in self.saved:
+                offset = self.saved[oid]
+            else:
+                offset = self.index.get(oid)
+        finally:
+            self.lock.release()
+        if offset is None:
+            raise KeyError(oid)
+        return offset
+
+    def __len__(self):
+        return self.count
+
+    def update(self, index):
+        """(index:{oid:str : offset:int})
+        Add records to the underlying index, saving the offsets they replace.
+        """
+        self.lock.acquire()
+        try:
+            live = self.index
+            saved = self.saved
+            for oid in index:
+                if oid not in saved:
+                    saved[oid] = live.get(oid)
+            live.update(index)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.saved = {}
+
+
+class BackgroundPack(object):
+    """
+    Copies the records reachable from the root of a FileStorage to a new
+    file in a background thread.  The records are read from a snapshot of
+    the storage file taken when the pack began.  The thread that uses the
+    storage copies the records committed since then, and replaces the
+    storage file, once the background thread is finished.
+
+    Instance attributes:
+      storage : FileStorage
+      rate : int | None
+        The most bytes of records to copy per second.
+      state : str
+        'copying' while the background thread copies records, then
+        'ready', and 'done' once the storage file has been replaced.  It is
+        'cancelled' if cancel() was called first, and 'failed' if copying
+        raised an exception.
+      records_total : int
+        The number of records in the storage when the pack began.
+      records_copied : int
+        The number of records copied so far.
+      bytes_copied : int
+        The size of the records copied so far.
+      bytes_reclaimed : int | None
+        The size of the storage file before it was replaced, less the size
+        of the packed file.  It is None until the state is 'done'.
+      error : Exception | None
+        The exception raised while copying, if it failed.
+      packed : file
+      packed_index : {oid:str : offset:int}
+        The offsets of the copied records in packed.
+    """
+
+    def __init__(self, storage, rate=None):
+        self.storage = storage
+        self.rate = rate
+        self.state = 'copying'
+        self.records_copied = 0
+        self.bytes_copied = 0
+        self.bytes_reclaimed = None
+        self.error = None
+        self.cancelled = False
+        self.condition = Condition()
+        self.fp, self.index = storage._get_pack_snapshot()
+        self.records_total = len(self.index)
+        self.packed = storage._open_pack_file()
+        self.packed_index = {}
+        self.thread = Thread(target=self._run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def get_progress(self):
+        """() -> float
+        Return the fraction of the records in the storage that have been
+        copied so far, or 1.0 once copying is finished.  Unreachable
+        records are not copied, so the fraction jumps to 1.0 at the end.
+        """
+        if self.state != 'copying':
+            return 1.0
+        return min(1.0, self.records_copied / float(self.records_total or 1))
+
+    def wait(self, timeout=None):
+        """(timeout:float=None) -> bool
+        Wait until the background thread is finished, or until timeout
+        seconds have passed.  Return True if it is finished.
+        """
+        self.condition.acquire()
+        try:
+            if self.state == 'copying':
+                self.condition.wait(timeout)
+            return self.state != 'copying'
+        finally:
+            self.condition.release()
+
+    def finish(self):
+        """() -> bool
+        Wait until copying is finished, then copy the records committed
+        since the pack began and replace the storage file.  This must be
+        called from the thread that uses the storage, between commits.
+        Return False if the pack was cancelled.
+        """
+        self.wait()
+        while self.state == 'copying':
+            self.wait()
+        if self.storage.background_pack is self:
+            self.storage._check_background_pack()
+        if self.state == 'failed':
+            raise self.error
+        return self.state == 'done'
+
+    def cancel(self):
+        """() -> bool
+        Stop copying and discard the packed file, unless it has already
+        replaced the storage file.  This must be called from the thread
+        that uses the storage.  Return True if the pack was cancelled.
+        """
+        self.cancelled = True
+        self.thread.join()
+        if self.storage.background_pack is self:
+            self.storage._end_background_pack(False)
+            if self.state != 'failed':
+                self.set_state('cancelled')
+        return self.state == 'cancelled'
+
+    def set_state(self, state):
+        self.condition.acquire()
+        try:
+            self.state = state
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def close_snapshot(self):
+        self.fp.close()
+        if hasattr(self.index, 'close'):
+            self.index.close()
+
+    def _gen_records(self):
+        """Generate the reachable records of the snapshot, at no more than
+        the given rate, until cancelled.
+        """
+        storage = self.storage
+        fp = self.fp
+        index = self.index
+        def load(oid):
+            return storage._load_from(fp, index, oid)
+        start = time()
+        for oid, record in storage._gen_reachable_records(load):
+            if self.cancelled:
+                return
+            self.records_copied += 1
+            self.bytes_copied += len(record)
+            if self.rate:
+                delay = start + self.bytes_copied / float(self.rate) - time()
+                if delay > 0.01:
+                    sleep(delay)
+            yield oid, record
+
+    def _run(self):
+        try:
+            for z in self.storage._write_transaction(
+                self.packed, self._gen_records(), self.packed_index):
+                pass
+        except Exception, exc:
+            self.error = exc
+            self.set_state('failed')
+        else:
+            if self.cancelled:
+                self.set_state('cancelled')
+            else:
+                self.set_state('ready')
+
+
 class FileStorage1(FileStorage):
     """
     The file consists of a 6-byte distinguishing "magic" string followed
@@ -340,6 +967,8 @@ class FileStorage1(FileStorage):
         self.tid = 0
 
     def _build_index(self):
+        # Offset index files are only supported for FileStorage2.
+        self.offset_index = False
         self.index = {}
         self.fp.seek(0)
         if self.fp.read(len(self.MAGIC)) != self.MAGIC:
@@ -387,6 +1016,16 @@ class FileStorage1(FileStorage):
     def load(self, oid):
         return FileStorage.load(self, oid)[8:] # just strip the tid.
 
+    def _load_from(self, fp, index, oid):
+        return FileStorage._load_from(self, fp, index, oid)[8:]
+
+    def load_buffer(self, oid):
+        return self.load(oid)
+
+    def bulk_load(self, oids):
+        for record in FileStorage.bulk_load(self, oids):
+            yield record[8:] # just strip the tid.
+
 
 class FileStorage2(FileStorage):
     """
@@ -441,9 +1080,31 @@ class FileStorage2(FileStorage):
             raise IOError, "invalid storage (missing magic in %r)" % self.fp
         index_offset = u64(self.fp.read(8))
         assert index_offset > 0
+        if self.offset_index:
+            self.index = self._open_offset_index(index_offset)
+            if self.index is not None:
+                # Only transactions committed after the offset index was
+                # last written need to be read.
+                self.fp.seek(self.index.covered)
+                self._read_transactions()
+                if self.fp.mode != 'rb':
+                    self.index.flush(self.fp.tell())
+                return
         self.fp.seek(index_offset)
         index_size = u64(self.fp.read(8))
         self.index = loads(decompress(self.fp.read(index_size)))
+        self._read_transactions()
+        if self.offset_index:
+            if self.fp.mode == 'rb':
+                # The offset index can't be written, so use the dictionary.
+                self.offset_index = False
+            else:
+                self.index = self._new_offset_index(self.index)
+
+    def _read_transactions(self):
+        """Update the index with the transactions that follow the current
+        position of the file.
+        """
         while 1:
             # Read one transaction each time here.
             oids = {}
@@ -482,6 +1143,53 @@ class FileStorage2(FileStorage):
         fp.write(p64(index_offset))
         assert fp.tell() == len(self.MAGIC) + 8
 
+    def _get_offset_index_filename(self):
+        return self.filename + OFFSET_INDEX_SUFFIX
+
+    def _get_storage_ino(self):
+        """() -> int
+        The inode number of the storage file, used to recognize an offset
+        index written for a different file.  On systems without inode
+        numbers, this is 0.
+        """
+        return os.fstat(self.fp.fileno()).st_ino
+
+    def _open_offset_index(self, index_offset):
+        """(index_offset:int) -> OffsetIndex | None
+        Open the offset index file, if there is one that was written for
+        this storage file.
+        """
+        try:
+            index = OffsetIndex(self._get_offset_index_filename(),
+                                readonly=(self.fp.mode == 'rb'))
+        except (IOError, OSError):
+            return None
+        self.fp.seek(0, 2)
+        if (index.storage_index_offset != index_offset or
+            index.storage_ino != self._get_storage_ino() or
+            not index_offset < index.covered <= self.fp.tell()):
+            index.close()
+            return None
+        return index
+
+    def _get_pack_snapshot(self):
+        if not self.offset_index:
+            return FileStorage._get_pack_snapshot(self)
+        return (open(self.get_filename(), 'rb'),
+                OffsetIndex(self._get_offset_index_filename(), readonly=True))
+
+    def _new_offset_index(self, index):
+        """(index:{oid:str : offset:int}) -> OffsetIndex
+        Write a new offset index file containing the given offsets of all
+        records in the storage file, and open it.
+        """
+        self.fp.seek(len(self.MAGIC))
+        index_offset = u64(self.fp.read(8))
+        self.fp.seek(0, 2)
+        return new_offset_index(
+            self._get_offset_index_filename(), index, index_offset,
+            self._get_storage_ino(), self.fp.tell())
+
 
 class TempFileStorage(FileStorage2):
 
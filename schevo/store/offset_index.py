@@ -0,0 +1,330 @@
+"""
+A persistent, memory-mapped oid -> offset index for FileStorage2.
+
+The index file consists of:
+
+  1) a fixed-size header (see HEADER)
+  2) the base: fixed-width records sorted by oid
+  3) the journal: fixed-width records appended by commits since the base
+     was written, in commit order
+
+Each record is an oid (8 bytes) followed by an offset (u64).
+
+The header holds, in order:
+
+  1) a 6-byte distinguishing "magic" string
+  2) the index offset recorded in the header of the storage file (u64)
+  3) the inode number of the storage file, or 0 (u64)
+  4) the number of records in the base (u64)
+  5) the offset in the storage file up to which the base is complete (u64)
+  6) the number of records in the journal (u64)
+  7) the offset in the storage file up to which base and journal are
+     complete (u64)
+  8) the largest oid in the index, as an integer (u64)
+  9) the adler32 checksum of the journal (u32)
+
+The base is only written as a whole, to a temporary file that is then
+renamed into place, so it is never partially written.  The journal is
+appended to in place; if its checksum does not match, the journal is
+discarded and the storage file must be scanned from the end of the base.
+"""
+
+import os
+import sys
+from schevo.lib import optimize
+
+from mmap import mmap, ACCESS_READ
+from schevo.store.utils import u64
+from struct import Struct
+from zlib import adler32
+
+if hasattr(os, 'fsync'):
+    fsync = os.fsync
+else:
+    def fsync(fd):
+        pass
+
+HEADER = Struct('>6sQQQQQQQI')
+RECORD = Struct('>8sQ')
+RECORD_SIZE = RECORD.size
+
+
+class OffsetIndex(object):
+    """
+    Maps oids to offsets like the dictionary FileStorage uses, but only
+    the records committed since the base was written are kept in memory,
+    and there are never more than _COMPACT_MIN of them.  Other lookups
+    binary-search the base through a memory map.
+
+    Instance attributes:
+      filename : str
+      storage_index_offset : int
+      storage_ino : int
+      base_covered : int
+      covered : int
+        The offset in the storage file up to which this index is complete.
+      max_oid : int
+      journal : { oid:str : offset:int }
+        The records that are not in the base.
+      pending : { oid:str : offset:int }
+        The records that have been added to the journal, but not yet written
+        to the index file.
+    """
+
+    MAGIC = "DOI10\0"
+
+    # Rewrite the base when the journal would have at least this many
+    # records, so that the journal read when opening the index stays
+    # small however many records the base has.
+    _COMPACT_MIN = 50000
+
+    def __init__(self, filename, readonly=False):
+        """(filename:str, readonly:bool=False)
+        Open an existing index file.  Raise IOError if the file is not a
+        valid index file.
+        """
+        self.filename = filename
+        self.readonly = readonly
+        self._open()
+
+    def _open(self):
+        if self.readonly:
+            self.fp = open(self.filename, 'rb')
+        else:
+            self.fp = open(self.filename, 'r+b')
+        self._map = None
+        try:
+            self._read()
+        except:
+            self.close()
+            raise
+
+    def _read(self):
+        header = self.fp.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise IOError("short read")
+        (magic, self.storage_index_offset, self.storage_ino,
+         self.base_count, self.base_covered, journal_count, self.covered,
+         self.max_oid, self.checksum) = HEADER.unpack(header)
+        if magic != self.MAGIC:
+            raise IOError(
+                "invalid offset index (missing magic in %r)" % self.fp)
+        base_size = HEADER.size + self.base_count * RECORD_SIZE
+        self.fp.seek(0, 2)
+        if self.fp.tell() < base_size:
+            raise IOError("short read")
+        if self.base_count:
+            self._map = mmap(self.fp.fileno(), base_size, access=ACCESS_READ)
+        self.journal = {}
+        self.pending = {}
+        self.journal_count = 0
+        self.added = 0
+        self.fp.seek(base_size)
+        data = self.fp.read(journal_count * RECORD_SIZE)
+        if (len(data) != journal_count * RECORD_SIZE or
+            adler32(data) & 0xffffffff != self.checksum):
+            # The journal was not completely written.  Drop it.
+            self.covered = self.base_covered
+            self.checksum = adler32('') & 0xffffffff
+            return
+        for position in xrange(0, len(data), RECORD_SIZE):
+            oid, offset = RECORD.unpack_from(data, position)
+            self._add(oid, offset)
+        self.journal_count = journal_count
+
+    def _search(self, oid):
+        """(oid:str) -> int | None
+        Return the offset of oid in the base, or None if it is not there.
+        """
+        data = self._map
+        low = 0
+        high = self.base_count
+        while low < high:
+            middle = (low + high) // 2
+            position = HEADER.size + middle * RECORD_SIZE
+            key = data[position:position + 8]
+            if key < oid:
+                low = middle + 1
+            elif oid < key:
+                high = middle
+            else:
+                return RECORD.unpack_from(data, position)[1]
+        return None
+
+    def _add(self, oid, offset):
+        if oid not in self.journal and self._search(oid) is None:
+            self.added += 1
+        self.journal[oid] = offset
+
+    def __getitem__(self, oid):
+        offset = self.journal.get(oid)
+        if offset is None:
+            offset = self._search(oid)
+            if offset is None:
+                raise KeyError(oid)
+        return offset
+
+    def get(self, oid, default=None):
+        try:
+            return self[oid]
+        except KeyError:
+            return default
+
+    def __contains__(self, oid):
+        return oid in self.journal or self._search(oid) is not None
+
+    has_key = __contains__
+
+    def __len__(self):
+        return self.base_count + self.added
+
+    def _iter_base(self):
+        """() -> sequence([(oid:str, offset:int)])
+        Generate the records of the base, in oid order.
+        """
+        data = self._map
+        unpack_from = RECORD.unpack_from
+        for position in xrange(HEADER.size,
+                               HEADER.size + self.base_count * RECORD_SIZE,
+                               RECORD_SIZE):
+            yield unpack_from(data, position)
+
+    def iteritems(self):
+        """() -> sequence([(oid:str, offset:int)])
+        Generate all records, in oid order.
+        """
+        journal = self.journal
+        added = sorted(oid for oid in journal if self._search(oid) is None)
+        position = 0
+        for oid, offset in self._iter_base():
+            while position < len(added) and added[position] < oid:
+                yield added[position], journal[added[position]]
+                position += 1
+            yield oid, journal.get(oid, offset)
+        for oid in added[position:]:
+            yield oid, journal[oid]
+
+    def __iter__(self):
+        for oid, offset in self.iteritems():
+            yield oid
+
+    iterkeys = __iter__
+
+    def update(self, index):
+        """(index:{oid:str : offset:int})
+        Add records.  They are not written to the index file until flush()
+        is called.
+        """
+        for oid, offset in index.iteritems():
+            self._add(oid, offset)
+            self.pending[oid] = offset
+
+    def flush(self, covered):
+        """(covered:int)
+        Append the pending records to the journal in the index file, noting
+        that the index is complete up to the covered offset in the storage
+        file.  If the journal has grown large enough, rewrite the base
+        instead.
+        """
+        if self.readonly:
+            raise IOError("read-only offset index")
+        pending = self.pending
+        self.max_oid = max([self.max_oid] +
+                           [u64(oid) for oid in pending])
+        self.covered = covered
+        journal_count = self.journal_count + len(pending)
+        if journal_count >= self._COMPACT_MIN:
+            self.compact()
+            return
+        data = ''.join([RECORD.pack(oid, offset)
+                        for oid, offset in pending.iteritems()])
+        self.fp.seek(HEADER.size +
+                     (self.base_count + self.journal_count) * RECORD_SIZE)
+        self.fp.write(data)
+        self.journal_count += len(pending)
+        self.checksum = adler32(data, self.checksum) & 0xffffffff
+        self._write_header()
+        self.fp.flush()
+        pending.clear()
+
+    def _write_header(self):
+        self.fp.seek(0)
+        self.fp.write(HEADER.pack(
+            self.MAGIC, self.storage_index_offset, self.storage_ino,
+            self.base_count, self.base_covered, self.journal_count,
+            self.covered, self.max_oid, self.checksum))
+
+    def compact(self):
+        """Rewrite the index file with all records in the base."""
+        temp_name = write_index_file(
+            self.filename, self.iteritems(), len(self),
+            self.storage_index_offset, self.storage_ino, self.covered,
+            self.max_oid)
+        self.close()
+        replace_index_file(temp_name, self.filename)
+        self._open()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+def write_index_file(filename, items, count, storage_index_offset,
+                     storage_ino, covered, max_oid):
+    """(filename:str, items:sequence([(oid:str, offset:int)]), count:int,
+        storage_index_offset:int, storage_ino:int, covered:int, max_oid:int)
+    Write an index file containing count records, with no journal, under a
+    temporary name derived from filename.  The items must be in oid order.
+    Return the temporary name, to be given to replace_index_file().
+    """
+    temp_name = filename + '.tmp'
+    fp = open(temp_name, 'wb')
+    try:
+        fp.write(HEADER.pack(
+            OffsetIndex.MAGIC, storage_index_offset, storage_ino, count,
+            covered, 0, covered, max_oid, adler32('') & 0xffffffff))
+        chunk = []
+        for oid, offset in items:
+            chunk.append(RECORD.pack(oid, offset))
+            if len(chunk) == 4096:
+                fp.write(''.join(chunk))
+                chunk = []
+        fp.write(''.join(chunk))
+        fp.flush()
+        fsync(fp.fileno())
+    finally:
+        fp.close()
+    return temp_name
+
+
+def replace_index_file(temp_name, filename):
+    """(temp_name:str, filename:str)
+    Rename a file written by write_index_file() to filename, so that an
+    existing index file is replaced all at once.
+    """
+    if os.name != 'posix' and os.path.exists(filename):
+        os.unlink(filename) # for Win32
+    os.rename(temp_name, filename)
+
+
+def new_offset_index(filename, index, storage_index_offset, storage_ino,
+                     covered):
+    """(filename:str, index:{oid:str : offset:int}, storage_index_offset:int,
+        storage_ino:int, covered:int) -> OffsetIndex
+    Write a new index file containing the records of index and open it.
+    """
+    max_oid = 0
+    for oid in index:
+        max_oid = max(max_oid, u64(oid))
+    temp_name = write_index_file(
+        filename, sorted(index.iteritems()), len(index),
+        storage_index_offset, storage_ino, covered, max_oid)
+    replace_index_file(temp_name, filename)
+    return OffsetIndex(filename)
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
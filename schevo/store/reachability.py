@@ -0,0 +1,146 @@
+"""
+Compact structures for finding the records reachable from the root.
+
+Oids are assigned by counting up from zero, so a set of oids can be kept
+as a bitmap, at one bit per oid, rather than as a set of 8-byte strings.
+The oids waiting to be visited are kept on a stack that moves its older
+entries to a temporary file when it grows large.
+"""
+
+import sys
+from schevo.lib import optimize
+
+from struct import Struct
+from tempfile import TemporaryFile
+
+OID = Struct('>Q')
+
+# The oids an OidStack keeps in memory, in two chunks of this many.
+SPILL_SIZE = 65536
+
+
+class OidBitmap(object):
+    """
+    A set of oids, with one bit for each oid up to the largest added.
+
+    Instance attributes:
+      bits : bytearray
+      count : int
+        The number of oids in the set.
+    """
+
+    def __init__(self, size=0):
+        """(size:int=0)
+        size is the expected number of oids.  The bitmap grows as needed.
+        """
+        self.bits = bytearray((size + 7) >> 3)
+        self.count = 0
+
+    def add(self, oid):
+        """(oid:str) -> bool
+        Add oid to the set.  Return False if it was already there.
+        """
+        return bool(self.add_new((oid,)))
+
+    def add_new(self, oids):
+        """(oids:sequence(oid:str)) -> [oid:str]
+        Add the oids to the set, and return those that were not already
+        there.
+        """
+        bits = self.bits
+        unpack = OID.unpack
+        new = []
+        for oid in oids:
+            number = unpack(oid)[0]
+            position = number >> 3
+            mask = 1 << (number & 7)
+            if position >= len(bits):
+                bits.extend(
+                    bytearray(max(position + 1 - len(bits), len(bits))))
+            elif bits[position] & mask:
+                continue
+            bits[position] |= mask
+            new.append(oid)
+        self.count += len(new)
+        return new
+
+    def __contains__(self, oid):
+        number = OID.unpack(oid)[0]
+        position = number >> 3
+        return (position < len(self.bits) and
+                bool(self.bits[position] & (1 << (number & 7))))
+
+    def __len__(self):
+        return self.count
+
+
+class OidStack(object):
+    """
+    A last-in, first-out stack of oids.  When more than twice spill_size
+    oids are in memory, the oldest spill_size of them are written to a
+    temporary file, to be read back when the rest have been popped.
+
+    Instance attributes:
+      spill_size : int
+      oids : [oid:str]
+        The top of the stack.
+      file : file | None
+        The temporary file, once one is needed.
+      spilled : int
+        The number of chunks of spill_size oids in the file.
+    """
+
+    def __init__(self, spill_size=SPILL_SIZE):
+        self.spill_size = spill_size
+        self.oids = []
+        self.file = None
+        self.spilled = 0
+
+    def push(self, oid):
+        self.oids.append(oid)
+        if len(self.oids) > 2 * self.spill_size:
+            self._spill()
+
+    def extend(self, oids):
+        self.oids.extend(oids)
+        while len(self.oids) > 2 * self.spill_size:
+            self._spill()
+
+    def pop(self):
+        """() -> str
+        Raise IndexError if the stack is empty.
+        """
+        if not self.oids and self.spilled:
+            self._unspill()
+        return self.oids.pop()
+
+    def __len__(self):
+        return len(self.oids) + self.spilled * self.spill_size
+
+    def _spill(self):
+        if self.file is None:
+            self.file = TemporaryFile()
+        chunk_size = self.spill_size * 8
+        self.file.seek(self.spilled * chunk_size)
+        self.file.write(''.join(self.oids[:self.spill_size]))
+        del self.oids[:self.spill_size]
+        self.spilled += 1
+
+    def _unspill(self):
+        self.spilled -= 1
+        chunk_size = self.spill_size * 8
+        self.file.seek(self.spilled * chunk_size)
+        data = self.file.read(chunk_size)
+        assert len(data) == chunk_size
+        self.oids = [data[position:position + 8]
+                     for position in xrange(0, chunk_size, 8)]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.oids = []
+        self.spilled = 0
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -4,31 +4,83 @@ $Id$
 
 from schevo.lib import optimize
 
-import struct
 from cPickle import Pickler, Unpickler, loads
 from cStringIO import StringIO
+from schevo.store.compression import CompressionPolicy
+from schevo.store.compression import get_primed_decompressor
 from schevo.store.error import InvalidObjectReference
 from schevo.store.persistent import Persistent
-from schevo.store.utils import p32, u32
-from zlib import compress, decompress, error as zlib_error
+from schevo.store.utils import p32
+from struct import Struct
+from zlib import decompress, error as zlib_error
 
 WRITE_COMPRESSED_STATE_PICKLES = True
 
+def new_compression_policy():
+    """() -> CompressionPolicy
+    Return a policy that compresses every state pickle with zlib, unless
+    WRITE_COMPRESSED_STATE_PICKLES is false.
+    """
+    if WRITE_COMPRESSED_STATE_PICKLES:
+        return CompressionPolicy('zlib')
+    else:
+        return CompressionPolicy('none')
+
 def pack_record(oid, data, refs):
     """(oid:str, data:str, refs:str) -> record:str
     """
     return ''.join([oid, p32(len(data)), data, refs])
 
+# The oid and the length of the data at the start of a record.
+RECORD_HEADER = Struct('>8sL')
+RECORD_HEADER_SIZE = RECORD_HEADER.size
+
+# { count:int : Struct }, filled by get_oids_struct().
+_oids_structs = {}
+
+# Structs for more oids than this are not kept in _oids_structs.
+OIDS_STRUCT_CACHE_LIMIT = 1024
+
+def get_oids_struct(count):
+    """(count:int) -> Struct
+    Return a Struct for count packed oids.
+    """
+    oids_struct = _oids_structs.get(count)
+    if oids_struct is None:
+        oids_struct = Struct('>' + '8s' * count)
+        if count <= OIDS_STRUCT_CACHE_LIMIT:
+            _oids_structs[count] = oids_struct
+    return oids_struct
+
 def unpack_record(record):
     """(record:str) -> oid:str, data:str, refs:str
     The inverse of pack_record().
     """
-    oid = record[:8]
-    data_length = u32(record[8:12])
-    data_end = 12 + data_length
-    data = record[12:data_end]
-    refs = record[data_end:]
-    return oid, data, refs
+    oid, data_length = RECORD_HEADER.unpack_from(record)
+    data_end = RECORD_HEADER_SIZE + data_length
+    return oid, record[RECORD_HEADER_SIZE:data_end], record[data_end:]
+
+def unpack_record_data(record):
+    """(record:str|buffer) -> oid:str, data:buffer
+    Like unpack_record(), but the data is not copied.
+    """
+    oid, data_length = RECORD_HEADER.unpack_from(record)
+    return oid, buffer(record, RECORD_HEADER_SIZE, data_length)
+
+def unpack_record_refs(record):
+    """(record:str|buffer) -> (str)
+    Return the oids referred to by the record, unpacked in place.
+    """
+    oid, data_length = RECORD_HEADER.unpack_from(record)
+    refs_start = RECORD_HEADER_SIZE + data_length
+    count, extra = divmod(len(record) - refs_start, 8)
+    assert extra == 0, record
+    if not count:
+        return ()
+    oids_struct = _oids_structs.get(count)
+    if oids_struct is None:
+        oids_struct = get_oids_struct(count)
+    return oids_struct.unpack_from(record, refs_start)
 
 def split_oids(s):
     """(s:str) -> [str]
@@ -38,8 +90,8 @@ def split_oids(s):
         return []
     num, extra = divmod(len(s), 8)
     assert extra == 0, s
-    fmt = '8s' * num
-    return list(struct.unpack('>' + fmt, s))
+    return list(get_oids_struct(num).unpack(s))
+
 
 def extract_class_name(record):
     oid, state, refs = unpack_record(record)
@@ -48,7 +100,8 @@ def extract_class_name(record):
 
 class ObjectWriter(object):
     """
-    Serializes objects for storage in the database.
+    Serializes objects for storage in the database.  One writer can
+    serialize all of the objects stored by a transaction.
 
     The client is responsible for calling the close() method to avoid
     leaking memory.  The ObjectWriter uses a Pickler internally, and
@@ -62,6 +115,8 @@ class ObjectWriter(object):
         self.objects_found = []
         self.refs = set() # populated by _persistent_id()
         self.connection = connection
+        self.compression = (getattr(connection, 'compression', None) or
+                            new_compression_policy())
 
     def close(self):
         # see ObjectWriter.__doc__
@@ -87,12 +142,16 @@ class ObjectWriter(object):
         return obj._p_oid, type(obj)
 
     def gen_new_objects(self, obj):
-        def once(obj):
-            raise RuntimeError('gen_new_objects() already called.')
-        self.gen_new_objects = once
+        """(obj:Persistent) -> sequence(Persistent)
+        Generate obj, and then each object that is given an oid while the
+        state of the generated objects is found by get_state().  The
+        sequence must be exhausted before this is called again.
+        """
+        objects_found = self.objects_found
         yield obj # The modified object is also a "new" object.
-        for obj in self.objects_found:
+        for obj in objects_found:
             yield obj
+        del objects_found[:]
 
     def get_state(self, obj):
         self.sio.seek(0) # recycle StringIO instance
@@ -105,28 +164,66 @@ class ObjectWriter(object):
         uncompressed = self.sio.getvalue()
         pickled_type = uncompressed[:position]
         pickled_state = uncompressed[position:]
-        if WRITE_COMPRESSED_STATE_PICKLES:
-            state = compress(pickled_state)
-        else:
-            state = pickled_state
-        data = pickled_type + state
+        codec = self.compression.get_codec(type(obj))
+        if codec.dictionary is not None:
+            self._persistent_id(codec.dictionary)
+        data = pickled_type + codec.compress(pickled_state)
         self.refs.discard(obj._p_oid)
         return data, ''.join(self.refs)
 
 class ObjectReader(object):
+    """
+    Deserializes objects loaded from the database.
+
+    Instance attributes:
+      connection : Connection
+      decompressors : { oid:str : decompressobj }
+        Decompressors primed with the contents of CompressionDictionary
+        instances.
+      unpicklers : [(StringIO, Unpickler)]
+        The pool of unpicklers, and the files they read, that are not in
+        use.  Loads may be nested, or made from more than one thread, so
+        each takes a pair from the pool, or a new one if the pool is empty.
+    """
+
+    # Do not keep files in the pool that have grown beyond this size.
+    _POOLED_FILE_LIMIT = 1 << 20
 
     def __init__(self, connection):
         self.connection = connection
+        self.decompressors = {}
+        self.unpicklers = []
+
+    def _get_unpickler(self):
+        """() -> (StringIO, Unpickler)
+        Return an empty file and an unpickler that reads from it, taken
+        from the pool if possible.  Return them to the pool with
+        _release_unpickler().
+        """
+        try:
+            return self.unpicklers.pop()
+        except IndexError:
+            connection = self.connection
+            get_instance = connection.get_cache().get_instance
+            def persistent_load(oid_klass):
+                oid, klass = oid_klass
+                return get_instance(oid, klass, connection)
+            file = StringIO()
+            unpickler = Unpickler(file)
+            unpickler.persistent_load = persistent_load
+            return file, unpickler
 
-    def _get_unpickler(self, file):
-        connection = self.connection
-        get_instance = connection.get_cache().get_instance
-        def persistent_load(oid_klass):
-            oid, klass = oid_klass
-            return get_instance(oid, klass, connection)
-        unpickler = Unpickler(file)
-        unpickler.persistent_load = persistent_load
-        return unpickler
+    def _release_unpickler(self, file, unpickler):
+        """(file:StringIO, unpickler:Unpickler)
+        Clear the file and the memo of the unpickler, so that they keep no
+        objects alive, and return them to the pool.
+        """
+        unpickler.memo.clear()
+        file.seek(0, 2)
+        if file.tell() <= self._POOLED_FILE_LIMIT:
+            file.seek(0)
+            file.truncate()
+            self.unpicklers.append((file, unpickler))
 
     def get_ghost(self, data):
         klass = loads(data)
@@ -135,29 +232,52 @@ class ObjectReader(object):
         return instance
 
     def get_state(self, data, load=True):
-        s = StringIO()
-        s.write(data)
-        s.seek(0)
-        unpickler = self._get_unpickler(s)
-        klass = unpickler.load()
-        position = s.tell()
-        if data[s.tell()] == 'x':
-            # This is almost certainly a compressed pickle.
-            try:
-                decompressed = decompress(data[position:])
-            except zlib_error:
-                pass # let the unpickler try anyway.
-            else:
-                s.write(decompressed)
+        s, unpickler = self._get_unpickler()
+        try:
+            s.write(data)
+            s.seek(0)
+            klass = unpickler.load()
+            position = s.tell()
+            marker = data[position]
+            if marker == 'x':
+                # This is almost certainly a compressed pickle.
+                try:
+                    decompressed = decompress(buffer(data, position))
+                except zlib_error:
+                    pass # let the unpickler try anyway.
+                else:
+                    s.write(decompressed)
+                    s.truncate()
+                    s.seek(position)
+            elif marker == 'D':
+                # Compressed with a CompressionDictionary.
+                decompressor = self._get_decompressor(
+                    data[position + 1:position + 9]).copy()
+                s.write(decompressor.decompress(buffer(data, position + 9)))
+                s.truncate()
                 s.seek(position)
-        if load:
-            return unpickler.load()
-        else:
-            return s.read()
+            if load:
+                return unpickler.load()
+            else:
+                return s.read()
+        finally:
+            self._release_unpickler(s, unpickler)
 
     def get_state_pickle(self, data):
         return self.get_state(data, load=False)
 
+    def _get_decompressor(self, oid):
+        """(oid:str) -> decompressobj
+        Return a decompressor primed with the contents of the
+        CompressionDictionary with the given oid.
+        """
+        decompressor = self.decompressors.get(oid)
+        if decompressor is None:
+            dictionary = self.connection.get(oid)
+            decompressor = get_primed_decompressor(dictionary.data)
+            self.decompressors[oid] = decompressor
+        return decompressor
+
 
 import sys
 optimize.bind_all(sys.modules[__name__])  # Last line of module.
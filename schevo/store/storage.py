@@ -6,8 +6,7 @@ import sys
 from schevo.lib import optimize
 
 
-from schevo.store.serialize import (
-    unpack_record, split_oids, extract_class_name)
+from schevo.store.serialize import unpack_record_refs, extract_class_name
 from schevo.store.utils import p64
 
 
@@ -23,6 +22,14 @@ class Storage(object):
         """
         raise NotImplementedError
 
+    def load_buffer(self, oid):
+        """(oid:str) -> str | buffer
+        Return the record for this oid, possibly as a read-only buffer that
+        shares memory with the storage instead of a copy.  The result is
+        only for passing to unpack_record().
+        """
+        return self.load(oid)
+
     def begin(self):
         """
         Begin a commit.
@@ -85,7 +92,7 @@ def gen_referring_oid_record(storage, referred_oid):
     reference to the `referred_oid`.
     """
     for oid, record in storage.gen_oid_record():
-        if referred_oid in split_oids(unpack_record(record)[2]):
+        if referred_oid in unpack_record_refs(record):
             yield oid, record
 
 def gen_oid_class(storage, *classes):
@@ -114,7 +121,7 @@ def get_reference_index(storage):
     """
     result = {}
     for oid, record in storage.gen_oid_record():
-        for ref in split_oids(unpack_record(record)[2]):
+        for ref in unpack_record_refs(record):
             result.setdefault(ref, []).append(oid)
     return result
 
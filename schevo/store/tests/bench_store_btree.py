@@ -0,0 +1,72 @@
+"""
+Microbenchmark of BNode key lookup and insertion throughput.
+
+Not collected by the test runner.  Run it directly:
+
+    python -m schevo.store.tests.bench_store_btree [count]
+
+For each node size, random integer keys are inserted into an empty BTree
+and then looked up again, once with the bisect-based BNode.get_position
+and once with the linear scan it replaced.
+"""
+
+import sys
+from random import Random
+from time import time
+
+from schevo.store.btree import BNode, BTree
+from schevo.store.btree import BNode2, BNode4, BNode8, BNode16, BNode32
+from schevo.store.btree import BNode64, BNode128, BNode256, BNode512
+
+NODE_CLASSES = [BNode2, BNode4, BNode8, BNode16, BNode32, BNode64,
+                BNode128, BNode256, BNode512]
+
+
+def linear_get_position(self, key):
+    """The linear scan used by BNode.get_position before bisection."""
+    for position, item in enumerate(self.items):
+        if item[0] >= key:
+            return position
+    return len(self.items)
+
+
+def run(node_class, keys):
+    """(node_class:BNode subclass, keys:[int]) -> (float, float)
+    Return insertions per second and lookups per second.
+    """
+    bt = BTree(node_class)
+    start = time()
+    for key in keys:
+        bt[key] = key
+    insert_rate = len(keys) / max(time() - start, 1e-9)
+    start = time()
+    for key in keys:
+        bt[key]
+    lookup_rate = len(keys) / max(time() - start, 1e-9)
+    return insert_rate, lookup_rate
+
+
+def main(count=20000):
+    keys = range(count)
+    Random(1).shuffle(keys)
+    print '%d keys, operations per second' % count
+    print '%-10s %12s %12s %12s %12s' % (
+        'node', 'insert', 'lookup', 'insert(lin)', 'lookup(lin)')
+    bisect_get_position = BNode.get_position
+    for node_class in NODE_CLASSES:
+        insert_rate, lookup_rate = run(node_class, keys)
+        BNode.get_position = linear_get_position
+        try:
+            linear_insert_rate, linear_lookup_rate = run(node_class, keys)
+        finally:
+            BNode.get_position = bisect_get_position
+        print '%-10s %12d %12d %12d %12d' % (
+            node_class.__name__, insert_rate, lookup_rate,
+            linear_insert_rate, linear_lookup_rate)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,127 @@
+"""
+Benchmark of object cache replacement under cache-thrashing reads.
+
+Not collected by the test runner.  Run it directly:
+
+    python -m schevo.store.tests.bench_store_cache [count] [seconds]
+
+A temporary storage is filled with a BTree of count objects.  Then, for a
+number of seconds, transactions read the objects at random keys and abort,
+with a cache much smaller than the number of objects, once with the
+access queue of Cache and once with the heap rebuilt by every call to
+Cache.shrink() before it.  Transactions per second, the share of the time
+spent in Connection.abort(), and the cache count at the end are reported.
+"""
+
+import sys
+from heapq import heappush, heappop
+from itertools import islice, chain
+from random import Random
+from time import time
+
+from schevo.store.btree import BTree
+from schevo.store.connection import Cache, Connection
+from schevo.store.file_storage import TempFileStorage
+from schevo.store.persistent import PersistentTester as Persistent
+
+# (cache size, reads per transaction)
+WORKLOADS = [(5000, 10), (5000, 100), (20000, 100), (20000, 1000)]
+
+
+class HeapCache(Cache):
+    """The Cache replacement used before the access queue."""
+
+    def __init__(self, size):
+        Cache.__init__(self, size)
+        self.recent_objects = set()
+        self.finger = 0
+
+    def note_access(self, obj):
+        self.recent_objects.add(obj)
+
+    def _build_heap(self, transaction_serial):
+        all = self.objects
+        heap_size_target = (len(all) - self.size) * 2
+        start = self.finger % len(all)
+        heap = []
+        for oid in islice(chain(all, all), start, start + len(all)):
+            self.finger += 1
+            obj = all.get(oid)
+            if obj is None:
+                continue # The ref is dead.
+            if obj._p_serial == transaction_serial:
+                continue # obj is current.  Leave it alone.
+            heappush(heap, (obj._p_serial, oid))
+            if len(heap) >= heap_size_target:
+                break
+        self.finger = self.finger % len(all)
+        return heap
+
+    def shrink(self, connection):
+        if len(self.objects) <= self.size:
+            return
+        heap = self._build_heap(connection.get_transaction_serial())
+        while heap and len(self.objects) > self.size:
+            serial, oid = heappop(heap)
+            obj = self.objects.get(oid)
+            if obj is None:
+                continue
+            if obj._p_is_saved():
+                obj._p_set_status_ghost()
+            self.recent_objects.discard(obj)
+
+
+def populate(storage, count):
+    connection = Connection(storage)
+    tree = connection.get_root()['tree'] = BTree()
+    for key in xrange(count):
+        value = tree[key] = Persistent()
+        value.key = key
+        if key % 10000 == 9999:
+            connection.commit()
+    connection.commit()
+
+
+def run(storage, cache_class, cache_size, reads, count, seconds):
+    """Return transactions per second, the fraction of the time spent in
+    abort(), and the cache count at the end."""
+    connection = Connection(storage, cache_size=cache_size)
+    connection.cache = cache_class(cache_size)
+    tree = connection.get_root()['tree']
+    randrange = Random(1).randrange
+    transactions = 0
+    abort_time = 0.0
+    start = time()
+    while time() - start < seconds:
+        for n in xrange(reads):
+            tree[randrange(count)].key
+        before = time()
+        connection.abort()
+        abort_time += time() - before
+        transactions += 1
+    elapsed = time() - start
+    return (transactions / elapsed, abort_time / elapsed,
+            connection.get_cache_count())
+
+
+def main(count=200000, seconds=5):
+    storage = TempFileStorage()
+    populate(storage, count)
+    print '%d objects, %d seconds per run' % (count, seconds)
+    print '%-13s | %-24s | %-24s' % ('', 'queue', 'heap')
+    print '%-6s %6s | %8s %6s %7s | %8s %6s %7s' % (
+        'cache', 'reads', 'tx/s', 'abort', 'count',
+        'tx/s', 'abort', 'count')
+    for cache_size, reads in WORKLOADS:
+        results = []
+        for cache_class in (Cache, HeapCache):
+            results.extend(run(storage, cache_class, cache_size, reads,
+                               count, seconds))
+        print '%-6d %6d | %8.1f %5.1f%% %7d | %8.1f %5.1f%% %7d' % ((
+            cache_size, reads) + tuple(results[:1]) + (results[1] * 100,
+            results[2], results[3], results[4] * 100, results[5]))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*args)
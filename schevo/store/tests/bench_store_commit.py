@@ -0,0 +1,78 @@
+"""
+Microbenchmark of FileStorage commit throughput.
+
+Not collected by the test runner.  Run it directly:
+
+    python -m schevo.store.tests.bench_store_commit [seconds]
+
+For several transaction sizes, records are committed to a temporary
+FileStorage, once with the buffered FileStorage._write_transaction and once
+with the per-record writes it replaced.  The storage uses durability='os',
+so that the time taken by fsync() does not hide the cost of writing.
+"""
+
+import sys
+from time import time
+
+from schevo.store.file_storage import FileStorage
+from schevo.store.serialize import pack_record
+from schevo.store.utils import p32, p64
+
+# (records per transaction, bytes per record)
+TRANSACTION_SIZES = [(1, 200), (10, 200), (100, 200), (1000, 200),
+                     (10000, 200), (100, 20000)]
+
+
+def per_record_write_transaction(self, fp, records, index):
+    """The FileStorage._write_transaction used before buffering."""
+    fp.seek(0, 2)
+    for i, (oid, record) in enumerate(records):
+        full_record = self._disk_format(record)
+        index[oid] = fp.tell()
+        fp.write(p32(len(full_record)))
+        fp.write(full_record)
+        if i % self._PACK_INCREMENT == 0:
+            yield None
+    fp.write(p32(0)) # terminator
+
+
+def run(count, size, seconds):
+    """(count:int, size:int, seconds:float) -> (float, float)
+    Return commits per second and records per second.
+    """
+    storage = FileStorage(durability='os')
+    records = [(p64(n), pack_record(p64(n), 'x' * size, ''))
+               for n in xrange(count)]
+    commits = 0
+    start = time()
+    while True:
+        storage.begin()
+        for oid, record in records:
+            storage.store(oid, record)
+        storage.end()
+        commits += 1
+        elapsed = time() - start
+        if elapsed >= seconds:
+            break
+    storage.close()
+    return commits / elapsed, commits * count / elapsed
+
+
+def main(seconds=1.0):
+    print 'commits per second (records per second)'
+    print '%-14s %24s %24s' % ('transaction', 'buffered', 'per-record')
+    buffered_write_transaction = FileStorage._write_transaction
+    for count, size in TRANSACTION_SIZES:
+        buffered = run(count, size, seconds)
+        FileStorage._write_transaction = per_record_write_transaction
+        try:
+            per_record = run(count, size, seconds)
+        finally:
+            FileStorage._write_transaction = buffered_write_transaction
+        print '%-14s %10.0f (%11.0f) %10.0f (%11.0f)' % (
+            ('%d x %dB' % (count, size),) + buffered + per_record)
+
+
+if __name__ == '__main__':
+    args = [float(arg) for arg in sys.argv[1:]]
+    main(*args)
@@ -0,0 +1,127 @@
+"""
+Benchmark of the memory and time taken to pack a large FileStorage.
+
+Not collected by the test runner.  Run it directly:
+
+    python -m schevo.store.tests.bench_store_pack [count]
+
+A temporary storage with offset_index=1 is filled with count records
+(10 million by default), forming a tree with some branches cut off, so
+that some of the records are unreachable.  Then the reachable records are
+marked, in a separate process for each way of keeping track of them, and
+the peak memory of that process is reported: once with the set of oid
+strings and list of oids to visit that FileStorage used before, and once
+with FileStorage's OidBitmap and OidStack.  Finally the storage is packed.
+"""
+
+import os
+import sys
+from resource import getrusage, RUSAGE_SELF
+from subprocess import Popen, PIPE
+from tempfile import mktemp
+from time import time
+
+from schevo.store.connection import ROOT_OID
+from schevo.store.file_storage import FileStorage
+from schevo.store.serialize import pack_record, unpack_record_refs
+from schevo.store.utils import p64
+
+BRANCHING = 4
+TRANSACTION_SIZE = 100000
+
+
+def gen_records(count):
+    """Record n refers to records BRANCHING * n + 1 and on, except that
+    records ending in 9 refer to none, so that the records below them are
+    unreachable.
+    """
+    for n in xrange(count):
+        first = BRANCHING * n + 1
+        if n % 10 == 9:
+            refs = ''
+        else:
+            refs = ''.join([p64(child) for child in
+                            xrange(first, min(first + BRANCHING, count))])
+        yield p64(n), pack_record(p64(n), 'x' * 20, refs)
+
+
+def populate(filename, count):
+    storage = FileStorage(filename, offset_index=True, durability='os')
+    records = gen_records(count)
+    for start in xrange(0, count, TRANSACTION_SIZE):
+        storage.begin()
+        for n in xrange(start, min(start + TRANSACTION_SIZE, count)):
+            storage.store(*records.next())
+        storage.end()
+    storage.close()
+
+
+def gen_reachable_records_with_set(storage):
+    """The FileStorage._gen_reachable_records used before OidBitmap."""
+    todo = [ROOT_OID]
+    seen = set()
+    while todo:
+        oid = todo.pop()
+        if oid in seen:
+            continue
+        seen.add(oid)
+        record = storage.load(oid)
+        todo.extend(unpack_record_refs(record))
+        yield oid, record
+
+
+def mark(filename, method):
+    """Mark the reachable records and print the number of them, the
+    seconds taken, and the growth of the peak memory of this process,
+    in KB."""
+    storage = FileStorage(filename, offset_index=True, readonly=True)
+    # Bring the whole memory-mapped index into memory first, so that only
+    # the memory used for marking is counted.
+    for oid, offset in storage.index.iteritems():
+        pass
+    before = getrusage(RUSAGE_SELF).ru_maxrss
+    start = time()
+    if method == 'set':
+        records = gen_reachable_records_with_set(storage)
+    else:
+        records = storage._gen_reachable_records(storage.load)
+    count = 0
+    for oid, record in records:
+        count += 1
+    print count, time() - start, getrusage(RUSAGE_SELF).ru_maxrss - before
+    storage.close()
+
+
+def main(count=10000000):
+    filename = mktemp(suffix='.durus')
+    try:
+        start = time()
+        populate(filename, count)
+        print '%d records written in %.1f s, %.1f MB' % (
+            count, time() - start, os.path.getsize(filename) / 1048576.0)
+        print '%-8s %10s %10s %14s' % ('marking', 'reachable', 'seconds',
+                                        'peak MB added')
+        for method in ('set', 'bitmap'):
+            process = Popen([sys.executable, '-m',
+                             'schevo.store.tests.bench_store_pack',
+                             'mark', filename, method], stdout=PIPE)
+            reachable, seconds, peak = process.communicate()[0].split()
+            print '%-8s %10s %10.1f %14.1f' % (
+                method, reachable, float(seconds), int(peak) / 1024.0)
+        storage = FileStorage(filename, offset_index=True, durability='os')
+        start = time()
+        storage.pack()
+        storage.close()
+        print 'pack: %.1f s, %.1f MB after' % (
+            time() - start, os.path.getsize(filename) / 1048576.0)
+    finally:
+        for suffix in ('', '.index', '.prepack', '.pack'):
+            if os.path.exists(filename + suffix):
+                os.remove(filename + suffix)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['mark']:
+        mark(*sys.argv[2:])
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,104 @@
+"""
+Microbenchmark of object serialization and deserialization throughput.
+
+Not collected by the test runner.  Run it directly:
+
+    python -m schevo.store.tests.bench_store_serialize [seconds]
+
+Small objects like the field maps of entities, and BTree nodes that refer
+to other persistent objects, are serialized with one ObjectWriter for all
+of them, as a commit does now, and with a new ObjectWriter for each, as
+commits did before.  The resulting records are then deserialized with one
+ObjectReader, whose pooled unpickler is reused, and with a new ObjectReader
+for each, which makes a new StringIO and Unpickler as every load did
+before.
+"""
+
+import sys
+from time import time
+
+from schevo.store.btree import BTree
+from schevo.store.connection import Connection
+from schevo.store.file_storage import TempFileStorage
+from schevo.store.persistent_dict import PersistentDict
+from schevo.store.serialize import ObjectReader, ObjectWriter
+
+
+def make_objects(connection, kind, count=1000):
+    """(connection:Connection, kind:str, count:int) -> [Persistent]
+    Return committed objects of the given kind.
+    """
+    root = connection.get_root()
+    if kind == 'field map':
+        objects = [PersistentDict(name=u'person %d' % n, age=n % 100,
+                                  notes=u'notes about person %d' % n)
+                   for n in xrange(count)]
+    else:
+        tree = BTree()
+        for n in xrange(count * 8):
+            tree[n] = PersistentDict()
+        objects = []
+        nodes = [tree.root]
+        while nodes:
+            node = nodes.pop()
+            objects.append(node)
+            nodes.extend(node.nodes or ())
+        root['tree'] = tree
+    root[kind] = objects
+    connection.commit()
+    return objects
+
+
+def rate(fn, count, seconds):
+    """(fn:callable, count:int, seconds:float) -> float
+    Return the number of objects per second handled by fn, which handles
+    count objects each time it is called.
+    """
+    calls = 0
+    start = time()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time() - start
+        if elapsed >= seconds:
+            return calls * count / elapsed
+
+
+def main(seconds=1.0):
+    connection = Connection(TempFileStorage())
+    print 'objects per second'
+    print '%-10s %12s %12s %12s %12s' % (
+        '', 'write reused', 'write new', 'read pooled', 'read new')
+    for kind in ('field map', 'BTree node'):
+        objects = make_objects(connection, kind)
+        def write_reused():
+            writer = ObjectWriter(connection)
+            for obj in objects:
+                writer.get_state(obj)
+            writer.close()
+        def write_new():
+            for obj in objects:
+                writer = ObjectWriter(connection)
+                writer.get_state(obj)
+                writer.close()
+        writer = ObjectWriter(connection)
+        records = [writer.get_state(obj)[0] for obj in objects]
+        writer.close()
+        reader = ObjectReader(connection)
+        def read_pooled():
+            for data in records:
+                reader.get_state(data)
+        def read_new():
+            for data in records:
+                ObjectReader(connection).get_state(data)
+        count = len(objects)
+        print '%-10s %12.0f %12.0f %12.0f %12.0f' % (
+            kind, rate(write_reused, count, seconds),
+            rate(write_new, count, seconds),
+            rate(read_pooled, count, seconds),
+            rate(read_new, count, seconds))
+
+
+if __name__ == '__main__':
+    args = [float(arg) for arg in sys.argv[1:]]
+    main(*args)
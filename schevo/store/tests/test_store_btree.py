@@ -5,10 +5,15 @@ $Id: utest_btree.py 27868 2006-01-25 14:55:43Z dbinger $
 
 import os
 
-from schevo.store.btree import BTree, BNode
+from schevo.store.btree import BTree, BNode, BNode4
+from schevo.store.btree import CountedBTree, CountedBNode, CountedBNode2
+from schevo.store.btree import BTreeBuilder, CountedBNode16, counted_copy
+from schevo.store.btree import BNode16
+from schevo.constant import UNASSIGNED
+from schevo.placeholder import Placeholder
 from schevo.store.connection import Connection
 from schevo.store.file_storage import TempFileStorage
-from random import randint
+from random import randint, Random
 from schevo.test import raises
 
 
@@ -192,6 +197,218 @@ class TestCoverage(object):
         assert not bt.has_key(2)
         assert bt.keys() == []
 
+    def test_insert_again_after_split(self):
+        bt = BTree(BNode)
+        map(bt.add, range(100))
+        for x in range(100):
+            bt[x] = x
+        assert bt.items() == zip(range(100), range(100))
+
+    def test_mixed_keys(self):
+        placeholders = []
+        for extent_id in range(1, 4):
+            for oid in range(1, 20):
+                p = Placeholder.__new__(Placeholder)
+                p.__setstate__((extent_id, oid))
+                placeholders.append(p)
+        keys = [UNASSIGNED] + placeholders
+        shuffled = keys[:]
+        Random(7).shuffle(shuffled)
+        bt = BTree(BNode4)
+        for key in shuffled:
+            bt[key] = key
+        assert [k for k in bt] == keys
+        for key in keys:
+            assert bt[key] is key
+            assert bt.get((key,)) is None
+        assert bt.get_min_item()[0] is UNASSIGNED
+        bt = BTree(BNode4)
+        for key in shuffled:
+            if key is UNASSIGNED:
+                continue
+            bt[(key.extent_id, key.oid)] = key
+        for key in placeholders:
+            assert bt[(key.extent_id, key.oid)] is key
+
+    def test_delete_missing_from_thin_root(self):
+        bt = BTree(BNode)
+        map(bt.add, range(7))
+        map(bt.__delitem__, [0, 1, 2])
+        assert raises(KeyError, bt.__delitem__, 10)
+        assert bt.root.items
+        assert bt.keys() == range(3, 7)
+
+
+def check_counts(node):
+    """Return the number of items under `node`, checking that the counts
+    kept by each CountedBNode are correct along the way."""
+    if node.is_leaf():
+        assert node.counts is None
+        return len(node.items)
+    assert len(node.counts) == len(node.nodes) == len(node.items) + 1
+    total = len(node.items)
+    for count, child in zip(node.counts, node.nodes):
+        assert count == check_counts(child)
+        total += count
+    return total
+
+
+class TestCounted(object):
+
+    def test_random_changes(self):
+        bt = CountedBTree(CountedBNode2)
+        d = {}
+        for x in xrange(2000):
+            key = randint(0, 200)
+            if randint(0, 2):
+                bt[key] = x
+                d[key] = x
+            elif key in d:
+                del bt[key]
+                del d[key]
+            else:
+                assert raises(KeyError, bt.__delitem__, key)
+            if x % 100 == 0:
+                assert check_counts(bt.root) == len(bt) == len(d)
+        assert bt.items() == sorted(d.items())
+
+    def test_item_at(self):
+        bt = CountedBTree(CountedBNode)
+        map(bt.add, range(0, 200, 2))
+        for index in range(100):
+            assert bt.item_at(index) == (index * 2, True)
+        assert bt.item_at(-1) == (198, True)
+        assert raises(IndexError, bt.item_at, 100)
+        assert raises(IndexError, bt.item_at, -101)
+        assert raises(IndexError, CountedBTree().item_at, 0)
+
+    def test_rank(self):
+        bt = CountedBTree(CountedBNode)
+        map(bt.add, range(0, 200, 2))
+        for key in range(-1, 202):
+            assert bt.rank(key) == len([x for x in range(0, 200, 2)
+                                        if x < key])
+
+    def test_counted_copy(self):
+        bt = BTree(BNode4)
+        map(bt.add, range(500))
+        copy = counted_copy(bt)
+        assert isinstance(copy.root, CountedBNode)
+        assert copy.root.minimum_degree == 4
+        assert check_counts(copy.root) == len(copy) == 500
+        assert copy.items() == bt.items()
+        copy.add(500)
+        assert len(copy) == 501
+        assert len(bt) == 500
+
+
+def check_shape(node, root=True):
+    """Return the depth of the leaves under `node`, checking that they
+    are all at the same depth and that every node but the root has at
+    least the minimum number of items."""
+    t = node.minimum_degree
+    assert len(node.items) <= 2 * t - 1
+    if not root:
+        assert len(node.items) >= t - 1
+    if node.is_leaf():
+        return 1
+    depths = set(check_shape(child, False) for child in node.nodes)
+    assert len(depths) == 1
+    return depths.pop() + 1
+
+
+def count_nodes(node):
+    """Return the number of nodes in the tree under `node`."""
+    if node.is_leaf():
+        return 1
+    return 1 + sum(count_nodes(child) for child in node.nodes)
+
+
+class TestBuilder(object):
+
+    def test_sizes(self):
+        for node_constructor in (BNode, BNode4, CountedBNode2,
+                                 CountedBNode16):
+            t = node_constructor.minimum_degree
+            counted = issubclass(node_constructor, CountedBNode)
+            sizes = set(range(2 * t + 3))
+            for depth in range(2, 5):
+                full = (2 * t) ** depth - 1
+                if full > 5000:
+                    break
+                sizes.update([full - 1, full, full + 1, full + t])
+            for size in sorted(sizes):
+                if counted:
+                    bt = CountedBTree(node_constructor)
+                else:
+                    bt = BTree(node_constructor)
+                builder = BTreeBuilder(bt)
+                for key in range(size):
+                    builder.add(key, -key)
+                builder.finish()
+                assert bt.items() == [(key, -key) for key in range(size)]
+                check_shape(bt.root)
+                if counted:
+                    assert check_counts(bt.root) == size
+                bt.add(size)
+                bt.add(-1)
+                assert len(bt) == size + 2
+
+    def test_order(self):
+        builder = BTreeBuilder(BTree())
+        builder.add(2)
+        assert raises(ValueError, builder.add, 2)
+        assert raises(ValueError, builder.add, 1)
+        bt = BTree()
+        bt.add(1)
+        assert raises(AssertionError, BTreeBuilder, bt)
+
+    def test_commit_while_building(self):
+        connection = Connection(TempFileStorage(), cache_size=50)
+        bt = connection.get_root()['bt'] = CountedBTree(CountedBNode2)
+        builder = BTreeBuilder(bt)
+        for key in xrange(5000):
+            builder.add(key, str(key))
+            if key % 100 == 0:
+                connection.commit()
+        builder.finish()
+        connection.commit()
+        connection.abort()
+        assert check_counts(bt.root) == len(bt) == 5000
+        check_shape(bt.root)
+        assert bt.item_at(4321) == (4321, '4321')
+
+    def test_from_sorted(self):
+        items = [(key, str(key)) for key in range(1000)]
+        bt = BTree.from_sorted(items)
+        assert type(bt) is BTree
+        assert type(bt.root) is BNode16
+        assert bt.items() == items
+        check_shape(bt.root)
+        # Every node but the last one at each level is full.
+        assert len(bt.root.nodes[0].items) == 31
+        added = BTree()
+        for key, value in items:
+            added.add(key, value)
+        assert count_nodes(bt.root) < count_nodes(added.root) * 2 // 3
+        bt = CountedBTree.from_sorted(iter(items), CountedBNode2)
+        assert type(bt.root) is CountedBNode2
+        assert check_counts(bt.root) == len(bt) == 1000
+        assert bt.item_at(500) == (500, '500')
+        assert len(BTree.from_sorted([])) == 0
+
+    def test_fill_factor(self):
+        items = [(key, True) for key in range(1000)]
+        for fill_factor, size in ((0.5, 16), (0.75, 23), (0.01, 15)):
+            bt = BTree.from_sorted(items, fill_factor=fill_factor)
+            assert bt.items() == items
+            check_shape(bt.root)
+            assert len(bt.root.nodes[0].items) == size
+        for fill_factor in (0, 1.5):
+            assert raises(ValueError, BTree.from_sorted, items,
+                          fill_factor=fill_factor)
+
+
 if not 'SKIP_SLOW' in os.environ:
     class TestSlow(object):
 
@@ -243,3 +460,16 @@ class TestDurus(object):
         bt.add(2 * t - 1)
         self.connection.commit()
         assert self.connection.get_cache_count() == 5
+
+    def test_counted(self):
+        root = self.connection.get_root()
+        bt = root['bt'] = CountedBTree()
+        map(bt.add, range(1000))
+        self.connection.commit()
+        del bt[500]
+        self.connection.commit()
+        connection = Connection(self.connection.get_storage())
+        bt = connection.get_root()['bt']
+        assert len(bt) == 999
+        assert bt.item_at(500) == (501, True)
+        assert check_counts(bt.root) == 999
@@ -0,0 +1,128 @@
+"""
+Tests for schevo.store.compression.
+"""
+from cPickle import Unpickler
+from cStringIO import StringIO
+from schevo.store.btree import BTree, BNode
+from schevo.store.compression import CompressionDictionary, CompressionPolicy
+from schevo.store.compression import DictionaryCompression, NoCompression
+from schevo.store.compression import ZlibCompression, get_codec
+from schevo.store.compression import train_dictionary
+from schevo.store.connection import Connection, get_compression_stats
+from schevo.store.file_storage import TempFileStorage
+from schevo.store.persistent_dict import PersistentDict
+from schevo.store.serialize import unpack_record
+
+
+class Test(object):
+
+    def _populate(self, connection):
+        root = connection.get_root()
+        for number in xrange(20):
+            root[number] = PersistentDict(
+                name='person %d' % number, notes='notes ' * number)
+        connection.commit()
+
+    def _check_values(self, connection):
+        root = connection.get_root()
+        for number in xrange(20):
+            assert root[number]['name'] == 'person %d' % number
+            assert root[number]['notes'] == 'notes ' * number
+
+    def _get_state(self, connection, obj):
+        oid, data, refs = unpack_record(
+            connection.get_storage().load(obj._p_oid))
+        s = StringIO(data)
+        Unpickler(s).load()
+        return data[s.tell():]
+
+    def test_get_codec(self):
+        assert isinstance(get_codec('none'), NoCompression)
+        assert get_codec('zlib').level == 6
+        assert get_codec('zlib:1').level == 1
+        assert get_codec('zlib:9').name == 'zlib:9'
+        for name in ('zlib:10', 'lzma', ''):
+            try:
+                get_codec(name)
+                assert 0
+            except ValueError:
+                pass
+
+    def test_policy(self):
+        policy = CompressionPolicy()
+        assert policy.get_codec(PersistentDict).name == 'zlib:6'
+        policy.set(BNode, 'none')
+        assert policy.get_codec(BTree().root.__class__).name == 'none'
+        assert policy.get_codec(PersistentDict).name == 'zlib:6'
+        dictionary = CompressionDictionary('abc')
+        try:
+            policy.set(CompressionDictionary,
+                       DictionaryCompression(dictionary))
+            assert 0
+        except ValueError:
+            pass
+        policy = CompressionPolicy(DictionaryCompression(dictionary))
+        assert policy.get_codec(CompressionDictionary).name == 'zlib:6'
+
+    def test_codecs(self):
+        for codec, marker in [('none', '\x80'),
+                              ('zlib:1', 'x'),
+                              ('zlib:9', 'x')]:
+            storage = TempFileStorage()
+            connection = Connection(
+                storage, compression=CompressionPolicy(codec))
+            self._populate(connection)
+            root = connection.get_root()
+            assert self._get_state(connection, root[3])[0] == marker
+            self._check_values(Connection(storage))
+
+    def test_dictionary(self):
+        storage = TempFileStorage()
+        connection = Connection(storage)
+        self._populate(connection)
+        root = connection.get_root()
+        samples = [connection.reader.get_state_pickle(
+            unpack_record(storage.load(root[number]._p_oid))[1])
+                   for number in xrange(20)]
+        dictionary = CompressionDictionary(train_dictionary(samples))
+        connection.compression.set(
+            PersistentDict, DictionaryCompression(dictionary))
+        before = len(self._get_state(connection, root[19]))
+        for number in xrange(20):
+            root[number]['name'] = 'person %d' % number
+            root[number]._p_note_change()
+        connection.commit()
+        state = self._get_state(connection, root[19])
+        assert state[:9] == 'D' + dictionary._p_oid
+        assert len(state) < before
+        assert dictionary._p_oid in unpack_record(
+            storage.load(root[19]._p_oid))[2]
+        # The dictionary is kept by packing, although only the records
+        # compressed with it refer to it.
+        connection.pack()
+        self._check_values(Connection(storage))
+
+    def test_train_dictionary(self):
+        samples = ['a' * 10, 'b' * 10, 'a' * 10, 'c' * 10]
+        assert train_dictionary(samples) == 'b' * 10 + 'c' * 10 + 'a' * 10
+        assert train_dictionary(samples, size=15) == 'c' * 5 + 'a' * 10
+        assert len(train_dictionary(['x' * 50000], size=50000)) == 32768
+        try:
+            CompressionDictionary('x' * 40000)
+            assert 0
+        except ValueError:
+            pass
+
+    def test_get_compression_stats(self):
+        connection = Connection(TempFileStorage(),
+                                compression=CompressionPolicy('none'))
+        self._populate(connection)
+        connection.compression.set(PersistentDict, ZlibCompression(9))
+        stats = get_compression_stats(connection)
+        assert stats.keys() == ['schevo.store.persistent_dict.PersistentDict']
+        class_stats = stats['schevo.store.persistent_dict.PersistentDict']
+        assert class_stats.codec == 'zlib:9'
+        assert class_stats.count == 21
+        assert class_stats.raw_bytes == class_stats.stored_bytes
+        assert class_stats.get_saved_bytes() == 0
+        assert class_stats.compressed_bytes < class_stats.raw_bytes
@@ -78,6 +78,57 @@ class TestConnection(object):
         conn.commit()
         conn.pack()
 
+    def test_cache_eviction(self):
+        conn = Connection(self._get_storage(), cache_size=1000)
+        root = conn.get_root()
+        for n in xrange(50):
+            root[n] = Persistent()
+            root[n].n = n
+        conn.commit()
+        for n in xrange(50):
+            root[n].n
+            conn.abort()
+        assert not [n for n in xrange(50) if root[n]._p_is_ghost()]
+        # Each access to the root after the first in a transaction left a
+        # stale entry.
+        assert len(conn.cache.queue) > 100
+        conn.cache._compact_queue()
+        assert len(conn.cache.queue) == 51
+        # Twice the excess of 11 objects are ghosted, least recently
+        # accessed first.
+        conn.set_cache_size(40)
+        conn.abort()
+        assert [n for n in xrange(50) if root[n]._p_is_ghost()] == range(22)
+        assert not root._p_is_ghost()
+
+    def test_cache_bytes(self):
+        storage = self._get_storage()
+        conn = Connection(storage)
+        root = conn.get_root()
+        for n in xrange(20):
+            root[n] = Persistent()
+            # Random data, so that compression does not shrink it.
+            root[n].data = os.urandom(3000 * (n % 2))
+        conn.commit()
+        conn = Connection(storage, cache_bytes=20000)
+        assert conn.get_cache_bytes() == 20000
+        root = conn.get_root()
+        for n in xrange(20):
+            root[n].data
+            conn.abort()
+        stats = conn.get_cache_stats()
+        assert stats['faults'] == 21
+        assert stats['accesses'] == 40
+        assert stats['hit_ratio'] == 1.0 - 21 / 40.0
+        assert stats['bytes'] <= 20000
+        assert stats['evictions'] > 0
+        # Only the most recently accessed objects fit.
+        loaded = [n for n in xrange(20) if not root[n]._p_is_ghost()]
+        assert loaded == range(20 - len(loaded), 20)
+        assert 1 <= len(loaded) <= 4
+        conn.set_cache_bytes(None)
+        assert raises(ValueError, conn.set_cache_bytes, 0)
+
     def test_check_storage_tools(self):
         connection = Connection(self._get_storage())
         root = connection.get_root()
@@ -0,0 +1,84 @@
+"""
+Tests for schevo.store.entity_record.
+"""
+from schevo.store.btree import BTree
+from schevo.store.connection import Connection
+from schevo.store.entity_record import EntityRecord, pack_items
+from schevo.store.file_storage import TempFileStorage
+from schevo.store.persistent_dict import PersistentDict
+from schevo.test import raises
+
+
+class Test(object):
+
+    def test_pack_items(self):
+        assert pack_items({}) == ((), ())
+        assert pack_items({3: 'c', 1: 'a', 2: 1}) == ((1, 2, 3), ('a', 1, 'c'))
+        # Equal tuples of keys are shared.
+        assert (pack_items({1: 'a', 2: 'b'})[0] is
+                pack_items({2: 'c', 1: 'd'})[0])
+
+    def test_fields(self):
+        record = EntityRecord({2: 'b', 1: 'a'}, {2: frozenset()}, 4)
+        assert record['rev'] == 4
+        assert record['link_count'] == 0
+        fields = record['fields']
+        assert fields[1] == 'a'
+        assert raises(KeyError, fields.__getitem__, 3)
+        assert fields.get(3, 'x') == 'x'
+        assert 2 in fields and 'b' not in fields
+        assert len(fields) == 2
+        assert sorted(fields.iteritems()) == [(1, 'a'), (2, 'b')]
+        assert dict(fields) == {1: 'a', 2: 'b'}
+        fields[3] = 'c'
+        fields.update({1: 'A'})
+        del fields[2]
+        assert record.fields == ((1, 3), ('A', 'c'))
+        assert raises(KeyError, fields.__delitem__, 2)
+        record['fields'] = {5: None}
+        assert fields.keys() == [5]
+        assert record['related_entities'].keys() == [2]
+        assert raises(KeyError, record.__getitem__, 'other')
+
+    def test_links(self):
+        record = EntityRecord()
+        links = record['links']
+        assert record.links is None
+        assert len(links) == 0
+        assert links.get((1, 2)) is None
+        assert (1, 2) not in links
+        assert raises(KeyError, links.__delitem__, (1, 2))
+        links[(1, 2)] = BTree()
+        assert isinstance(record.links, PersistentDict)
+        assert record['links'] is record.links
+        links[(1, 2)][7] = None
+        assert links.keys() == [(1, 2)]
+        assert record['links'][(1, 2)].keys() == [7]
+
+    def test_storage(self):
+        connection = Connection(TempFileStorage())
+        root = connection.get_root()
+        root['a'] = EntityRecord({1: u'a'}, {}, 1)
+        root['b'] = EntityRecord({1: u'b'}, {}, 1)
+        root['b']['links'][(1, 1)] = BTree()
+        root['b']['links'][(1, 1)][1] = None
+        root['b']['link_count'] += 1
+        connection.commit()
+        connection.abort()
+        for record in root['a'], root['b']:
+            record._p_set_status_ghost()
+        assert root['a']['fields'][1] == u'a'
+        assert root['a'].fields[0] is root['b'].fields[0]
+        assert root['a'].links is None
+        assert root['b']['link_count'] == 1
+        assert root['b']['links'][(1, 1)].keys() == [1]
+        # Changing a ghost loads its state first.
+        root['a']._p_set_status_ghost()
+        root['a']['rev'] = 2
+        assert root['a']['fields'][1] == u'a'
+        root['a']['fields'][1] = u'A'
+        connection.commit()
+        connection.abort()
+        root['a']._p_set_status_ghost()
+        assert root['a']['rev'] == 2
+        assert root['a']['fields'][1] == u'A'
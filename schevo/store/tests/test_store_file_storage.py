@@ -4,10 +4,12 @@ $Id: utest_file_storage.py 28063 2006-03-13 21:03:18Z dbinger $
 """
 from schevo.store.file_storage import FileStorage1, FileStorage2
 from schevo.store.file_storage import TempFileStorage, FileStorage
+from schevo.store.file_storage import SnapshotIndex
 from schevo.store.serialize import pack_record
 from schevo.store.utils import p64
 
 from os import unlink
+import os
 from tempfile import mktemp
 import sys
 
@@ -20,6 +22,30 @@ class Test(object):
     def test_check_file_storage_1(self):
         self._check_file_storage(FileStorage1())
 
+    def test_check_file_storage_mmap_reads(self):
+        self._check_file_storage(FileStorage(mmap_reads=True))
+
+    def test_mmap_reads(self):
+        s = FileStorage(mmap_reads=True)
+        s.begin()
+        s.store(p64(0), pack_record(p64(0), 'root', ''))
+        s.end()
+        assert s.load(p64(0)) == pack_record(p64(0), 'root', '')
+        buf = s.load_buffer(p64(0))
+        assert isinstance(buf, buffer)
+        assert str(buf) == pack_record(p64(0), 'root', '')
+        # Records written after the file was mapped are still found.
+        s.begin()
+        s.store(p64(1), pack_record(p64(1), 'one', ''))
+        s.end()
+        assert s.load(p64(1)) == pack_record(p64(1), 'one', '')
+        assert str(buf) == pack_record(p64(0), 'root', '')
+        s.pack()
+        assert s.load(p64(0)) == pack_record(p64(0), 'root', '')
+        s.close()
+        # The buffer still refers to the old map.
+        assert str(buf) == pack_record(p64(0), 'root', '')
+
     def _check_file_storage(self, storage):
         b = storage
         assert b.new_oid() == p64(1)
@@ -60,6 +86,167 @@ class Test(object):
         except IOError: # storage closed
             pass
 
+    def test_bulk_load(self):
+        for s in (FileStorage1(), FileStorage2(), FileStorage(mmap_reads=True)):
+            records = {}
+            for n in xrange(50):
+                oid = p64(n)
+                records[oid] = pack_record(oid, str(n) * (n * 50), '')
+                s.begin()
+                s.store(oid, records[oid])
+                s.end()
+            oids = [p64(n) for n in (7, 3, 49, 0, 3, 20, 48, 1)]
+            expected = [records[oid] for oid in oids]
+            assert list(s.bulk_load(oids)) == expected
+            # Spans that are broken up, and records that extend beyond
+            # the tail of a span, are read separately.
+            s._BULK_READ_GAP = 3000
+            s._BULK_READ_SIZE = 20000
+            s._BULK_READ_TAIL = 100
+            assert list(s.bulk_load(oids)) == expected
+            assert list(s.bulk_load(sorted(records))) == [
+                records[oid] for oid in sorted(records)]
+            try:
+                list(s.bulk_load([p64(50)]))
+                assert 0
+            except KeyError:
+                pass
+            s.close()
+
+    def test_durability(self):
+        try:
+            FileStorage(durability='never')
+            assert 0
+        except ValueError:
+            pass
+        for durability in ('sync', 'group', 'os'):
+            s = FileStorage(durability=durability, group_commit_delay=0.05)
+            for n in xrange(20):
+                s.begin()
+                s.store(p64(n), pack_record(p64(n), str(n), ''))
+                s.end()
+            s.wait_durable()
+            if durability == 'group':
+                committer = s._committer
+                assert committer.synced == committer.written == 20
+                # The commits were written to disk in groups.
+                assert 1 <= committer.sync_count < 20
+            else:
+                assert s._committer is None
+            assert s.load(p64(19)) == pack_record(p64(19), '19', '')
+            s.pack()
+            assert s.load(p64(0)) == pack_record(p64(0), '0', '')
+            s.close()
+            if durability == 'group':
+                assert not committer.thread.isAlive()
+
+    def test_background_pack(self):
+        for s in (TempFileStorage(), FileStorage1(),
+                  FileStorage(mmap_reads=True)):
+            s.begin()
+            s.store(p64(0), pack_record(p64(0), 'root', p64(1)))
+            s.store(p64(1), pack_record(p64(1), 'one', ''))
+            s.store(p64(2), pack_record(p64(2), 'garbage' * 100, ''))
+            s.end()
+            pack = s.start_pack()
+            # Commits continue while the pack is copying.
+            s.begin()
+            s.store(p64(0), pack_record(p64(0), 'root', p64(1) + p64(3)))
+            s.store(p64(3), pack_record(p64(3), 'three', ''))
+            s.end()
+            assert pack.finish()
+            assert pack.state == 'done'
+            assert pack.get_progress() == 1.0
+            assert pack.records_copied == 2
+            assert pack.bytes_reclaimed > 600
+            assert s.background_pack is None
+            assert s.load(p64(0)) == pack_record(
+                p64(0), 'root', p64(1) + p64(3))
+            assert s.load(p64(3)) == pack_record(p64(3), 'three', '')
+            try:
+                s.load(p64(2))
+                assert 0
+            except KeyError:
+                pass
+            # The storage can be packed again.
+            s.pack()
+            assert s.load(p64(1)) == pack_record(p64(1), 'one', '')
+            s.close()
+
+    def test_snapshot_index(self):
+        index = {p64(0): 10, p64(1): 20}
+        snapshot = SnapshotIndex(index)
+        snapshot.update({p64(1): 30, p64(2): 40})
+        snapshot.update({p64(1): 50})
+        # The index is updated in place, and the snapshot is unchanged.
+        assert index == {p64(0): 10, p64(1): 50, p64(2): 40}
+        assert len(snapshot) == 2
+        assert snapshot[p64(0)] == 10
+        assert snapshot[p64(1)] == 20
+        try:
+            snapshot[p64(2)]
+            assert 0
+        except KeyError:
+            pass
+        # The storage's own index is not copied for a background pack.
+        s = TempFileStorage()
+        s.begin()
+        s.store(p64(0), pack_record(p64(0), 'root', ''))
+        s.end()
+        pack = s.start_pack()
+        assert pack.index.index is s.index
+        assert pack.finish()
+        s.close()
+
+    def test_background_pack_offset_index(self):
+        name = mktemp()
+        s = FileStorage2(name, offset_index=True)
+        s.begin()
+        s.store(p64(0), pack_record(p64(0), 'root', ''))
+        s.store(p64(1), pack_record(p64(1), 'garbage', ''))
+        s.end()
+        pack = s.start_pack()
+        pack.wait()
+        # The packed file replaces the storage file at the next commit.
+        s.begin()
+        s.store(p64(0), pack_record(p64(0), 'new root', ''))
+        s.end()
+        assert pack.state == 'done'
+        assert p64(1) not in s.index
+        s.close()
+        s = FileStorage2(name, offset_index=True)
+        assert s.load(p64(0)) == pack_record(p64(0), 'new root', '')
+        assert p64(1) not in s.index
+        s.close()
+        for suffix in ('', '.prepack', '.index'):
+            unlink(name + suffix)
+
+    def test_background_pack_cancel(self):
+        name = mktemp()
+        s = FileStorage(name)
+        s.begin()
+        s.store(p64(0), pack_record(p64(0), 'root', p64(1)))
+        s.store(p64(1), pack_record(p64(1), 'x' * 1000, p64(2)))
+        s.store(p64(2), pack_record(p64(2), 'x' * 1000, ''))
+        s.end()
+        # At 100 bytes per second, copying would take many seconds.
+        pack = s.start_pack(rate=100)
+        assert not pack.wait(0.01)
+        assert pack.get_progress() < 1.0
+        assert pack.cancel()
+        assert pack.state == 'cancelled'
+        assert pack.bytes_reclaimed is None
+        assert s.background_pack is None
+        assert s.pack_extra is None
+        assert not os.path.exists(name + '.pack')
+        assert s.load(p64(2)) == pack_record(p64(2), 'x' * 1000, '')
+        # A pack still running when the storage is closed is cancelled.
+        pack = s.start_pack(rate=100)
+        s.close()
+        assert pack.state == 'cancelled'
+        assert not os.path.exists(name + '.pack')
+        unlink(name)
+
     def test_check_reopen(self):
         if sys.platform != 'win32':
             f = TempFileStorage()
@@ -0,0 +1,162 @@
+"""
+Tests for FileStorage2 with an offset index file.
+"""
+from schevo.store.file_storage import FileStorage, OFFSET_INDEX_SUFFIX
+from schevo.store.offset_index import OffsetIndex, HEADER, RECORD_SIZE
+from schevo.store.serialize import pack_record
+from schevo.store.utils import p64, u64
+
+import os
+from tempfile import mktemp
+
+
+class Test(object):
+
+    def setUp(self):
+        self.filename = mktemp()
+        self.index_filename = self.filename + OFFSET_INDEX_SUFFIX
+
+    def tearDown(self):
+        for name in (self.filename, self.index_filename,
+                     self.filename + '.prepack'):
+            if os.path.exists(name):
+                os.unlink(name)
+
+    def _open(self, **kwargs):
+        return FileStorage(self.filename, offset_index=True, **kwargs)
+
+    def _commit(self, storage, values):
+        """Store a record for each (oid:int, data:str) pair."""
+        storage.begin()
+        for oid, data in values:
+            storage.store(p64(oid), pack_record(p64(oid), data, ''))
+        storage.end()
+
+    def _check(self, storage, expected):
+        assert len(storage.index) == len(expected)
+        assert sorted(storage.index) == sorted(p64(oid) for oid in expected)
+        for oid, data in expected.iteritems():
+            assert storage.load(p64(oid)) == pack_record(p64(oid), data, '')
+
+    def test_reopen(self):
+        s = self._open()
+        assert isinstance(s.index, OffsetIndex)
+        assert os.path.exists(self.index_filename)
+        expected = {}
+        for n in xrange(4):
+            values = [(u64(s.new_oid()), 'r%s' % n) for i in xrange(10)]
+            self._commit(s, values)
+            expected.update(values)
+        self._commit(s, [(5, 'changed')])
+        expected[5] = 'changed'
+        self._check(s, expected)
+        s.close()
+        s = self._open()
+        self._check(s, expected)
+        # The journal, not a rescan of the storage, provided the records.
+        assert s.index.journal_count == 41
+        assert s.new_oid() == p64(41)
+        s.close()
+        s = FileStorage(self.filename)
+        assert isinstance(s.index, dict)
+        self._check(s, expected)
+        s.close()
+
+    def test_stale_index(self):
+        s = self._open()
+        self._commit(s, [(0, 'root'), (1, 'one')])
+        s.close()
+        # Commit without using the offset index.
+        s = FileStorage(self.filename)
+        self._commit(s, [(1, 'uno'), (2, 'two')])
+        s.close()
+        s = self._open(readonly=True)
+        self._check(s, {0: 'root', 1: 'uno', 2: 'two'})
+        s.close()
+        s = self._open()
+        self._check(s, {0: 'root', 1: 'uno', 2: 'two'})
+        assert s.index.covered == os.path.getsize(self.filename)
+        s.close()
+
+    def test_torn_journal(self):
+        s = self._open()
+        self._commit(s, [(0, 'root'), (1, 'one')])
+        self._commit(s, [(2, 'two')])
+        s.close()
+        f = open(self.index_filename, 'r+b')
+        f.seek(HEADER.size + 2 * RECORD_SIZE)
+        f.write('garbage')
+        f.close()
+        s = self._open()
+        self._check(s, {0: 'root', 1: 'one', 2: 'two'})
+        s.close()
+
+    def test_missing_or_invalid_index(self):
+        s = self._open()
+        self._commit(s, [(0, 'root'), (1, 'one')])
+        s.close()
+        os.unlink(self.index_filename)
+        s = self._open(readonly=True)
+        assert not s.offset_index
+        self._check(s, {0: 'root', 1: 'one'})
+        s.close()
+        f = open(self.index_filename, 'wb')
+        f.write('not an index')
+        f.close()
+        s = self._open()
+        assert s.offset_index
+        self._check(s, {0: 'root', 1: 'one'})
+        s.close()
+
+    def test_compact(self):
+        compact_min = OffsetIndex._COMPACT_MIN
+        OffsetIndex._COMPACT_MIN = 8
+        try:
+            s = self._open()
+            expected = {}
+            for n in xrange(10):
+                self._commit(s, [(0, 'root %s' % n), (n + 1, 'n%s' % n)])
+                expected[0] = 'root %s' % n
+                expected[n + 1] = 'n%s' % n
+                self._check(s, expected)
+            assert s.index.base_count > 0
+            assert s.index.journal_count < 8
+            # The journal stays small however large the base is.
+            self._commit(s, [(n, 'm%s' % n) for n in xrange(11, 100)])
+            for n in xrange(100, 110):
+                self._commit(s, [(n, 'm%s' % n)])
+                assert s.index.journal_count < 8
+            for n in xrange(11, 110):
+                expected[n] = 'm%s' % n
+            self._check(s, expected)
+            s.close()
+            s = self._open()
+            self._check(s, expected)
+            s.close()
+        finally:
+            OffsetIndex._COMPACT_MIN = compact_min
+
+    def test_pack(self):
+        s = self._open()
+        s.begin()
+        s.store(p64(0), pack_record(p64(0), 'root', p64(1)))
+        s.store(p64(1), pack_record(p64(1), 'one', ''))
+        s.store(p64(2), pack_record(p64(2), 'garbage', ''))
+        s.end()
+        s.pack()
+        assert s.index.base_count == 2
+        assert s.index.journal_count == 0
+        assert len(s.index) == 2
+        assert s.load(p64(1)) == pack_record(p64(1), 'one', '')
+        s.close()
+        s = self._open()
+        assert sorted(s.index) == [p64(0), p64(1)]
+        assert s.load(p64(1)) == pack_record(p64(1), 'one', '')
+        s.close()
+
+    def test_requires_filename(self):
+        try:
+            FileStorage(offset_index=True)
+            assert 0
+        except ValueError:
+            pass
@@ -0,0 +1,44 @@
+"""
+Tests for schevo.store.reachability.
+"""
+from schevo.store.reachability import OidBitmap, OidStack
+from schevo.store.utils import p64
+
+
+class Test(object):
+
+    def test_oid_bitmap(self):
+        seen = OidBitmap()
+        assert len(seen) == 0
+        assert p64(0) not in seen
+        assert seen.add(p64(0))
+        assert not seen.add(p64(0))
+        assert p64(0) in seen
+        # The bitmap grows to hold large oids.
+        assert seen.add(p64(100000))
+        assert p64(100000) in seen
+        assert p64(99999) not in seen
+        assert p64(10 ** 9) not in seen
+        assert len(seen) == 2
+        assert len(seen.bits) < 20000
+
+    def test_oid_stack(self):
+        stack = OidStack(spill_size=10)
+        for n in xrange(95):
+            stack.push(p64(n))
+        assert len(stack) == 95
+        assert stack.spilled == 8
+        assert len(stack.oids) == 15
+        for n in xrange(94, 49, -1):
+            assert stack.pop() == p64(n)
+        for n in xrange(50, 60):
+            stack.push(p64(n))
+        assert [stack.pop() for n in xrange(60)] == [
+            p64(n) for n in xrange(59, -1, -1)]
+        assert len(stack) == 0
+        try:
+            stack.pop()
+            assert 0
+        except IndexError:
+            pass
+        stack.close()
@@ -2,12 +2,16 @@
 $URL: svn+ssh://svn/repos/trunk/durus/test/utest_serialize.py $
 $Id: utest_serialize.py 28275 2006-04-28 17:44:20Z dbinger $
 """
-from schevo.store.connection import ROOT_OID
+from schevo.store.connection import Connection, ROOT_OID
 from schevo.store.error import InvalidObjectReference
+from schevo.store.file_storage import TempFileStorage
 from schevo.store.persistent import ConnectionBase
 from schevo.store.persistent import PersistentTester as Persistent
+from schevo.store.persistent_dict import PersistentDict
 from schevo.store.serialize import ObjectWriter, ObjectReader, pack_record
 from schevo.store.serialize import unpack_record, split_oids
+from schevo.store.serialize import unpack_record_data, unpack_record_refs
+from schevo.store.serialize import get_oids_struct
 
 
 class Test(object):
@@ -37,11 +41,13 @@ class Test(object):
             '\x02U\x01aU\x08\x00\x00\x00\x00\x00\x00\x00\x00q\x03h\x01\x86Qs.',
             '\x00\x00\x00\x00\x00\x00\x00\x00')
         assert list(s.gen_new_objects(x)) == [x, x.a]
-        # gen_new_objects() can only be called once.
-        try:
-            s.gen_new_objects(3)
-            assert 0
-        except RuntimeError: pass
+        # The writer can be used again for another object.
+        x.a.b = Persistent()
+        new_objects = []
+        for obj in s.gen_new_objects(x.a):
+            s.get_state(obj)
+            new_objects.append(obj)
+        assert new_objects == [x.a, x.a.b]
         s.close()
 
     def test_check_object_reader(self):
@@ -52,6 +58,24 @@ class Test(object):
                 '\x80\x02}q\x02U\x04dataq\x03}q\x04s.\x00\x00\x00\x00')
         assert r.get_ghost(root)._p_is_ghost()
 
+    def test_object_reader_pool(self):
+        connection = Connection(TempFileStorage())
+        root = connection.get_root()
+        root['a'] = PersistentDict(b=PersistentDict())
+        connection.commit()
+        reader = connection.reader
+        data = unpack_record(
+            connection.get_storage().load(root['a']._p_oid))[1]
+        state = reader.get_state(data)
+        assert state['data']['b'] is root['a']['b']
+        assert len(reader.unpicklers) == 1
+        s, unpickler = reader.unpicklers[0]
+        assert not unpickler.memo
+        assert s.getvalue() == ''
+        assert reader.get_state(data) == state
+        assert reader.get_state_pickle(data) == reader.get_state_pickle(data)
+        assert reader.unpicklers == [(s, unpickler)]
+
     def test_check_record_pack_unpack(self):
         oid = '0'*8
         data = 'sample'
@@ -62,3 +86,17 @@ class Test(object):
         assert result[1] == data
         assert split_oids(result[2]) == reflist
         assert split_oids('') == []
+
+    def test_check_record_unpack_in_place(self):
+        oid = '0'*8
+        reflist = ['1'*8, '2'*8]
+        record = pack_record(oid, 'sample', ''.join(reflist))
+        for r in (record, buffer('xx' + record, 2)):
+            record_oid, data = unpack_record_data(r)
+            assert record_oid == oid
+            assert isinstance(data, buffer)
+            assert str(data) == 'sample'
+            assert unpack_record_refs(r) == tuple(reflist)
+        assert unpack_record_refs(pack_record(oid, 'sample', '')) == ()
+        assert get_oids_struct(2) is get_oids_struct(2)
+        assert get_oids_struct(2).size == 16
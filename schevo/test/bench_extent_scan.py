@@ -0,0 +1,94 @@
+"""
+Benchmark of a cold full-extent scan with different backend arguments.
+
+Not collected by the test runner.  Run it directly:
+
+    python -m schevo.test.bench_extent_scan [count]
+
+A temporary database is populated with `count` entities and closed.  For
+each set of backend arguments, the database is reopened, so that the
+object cache is empty, and every field of every entity is read.  Then
+every record in the storage file is loaded, without unpickling it.
+"""
+
+import os
+import sys
+from tempfile import mkstemp
+from time import time
+
+from schevo import database
+
+SCHEMA = """
+from schevo.schema import *
+schevo.schema.prep(locals())
+
+class Person(E.Entity):
+
+    name = f.string()
+    age = f.integer()
+    notes = f.string(multiline=True, required=False)
+
+    _key(name)
+"""
+
+BACKEND_ARGS = [
+    '',
+    'mmap_reads=1',
+    'offset_index=1',
+    'offset_index=1,mmap_reads=1',
+    ]
+
+
+def scan(filename, backend_args):
+    """(filename:str, backend_args:str) -> (float, float, float)
+    Return the seconds taken to open the database, to scan the extent, and
+    to load every record in the storage.
+    """
+    start = time()
+    db = database.open(filename, backend_args=backend_args or None)
+    opened = time()
+    try:
+        for person in db.Person:
+            person.name, person.age, person.notes
+        scanned = time()
+        storage = db.backend.storage
+        load_buffer = storage.load_buffer
+        for oid in storage.index:
+            load_buffer(oid)
+        return opened - start, scanned - opened, time() - scanned
+    finally:
+        db.close()
+
+
+def main(count=5000, repeat=3):
+    fd, filename = mkstemp(suffix='.db')
+    os.close(fd)
+    os.remove(filename)
+    db = database.create(filename, 'schevo.store', schema_source=SCHEMA)
+    try:
+        create = db.Person.t.create
+        for number in xrange(count):
+            db.execute(create(
+                name=u'person %d' % number,
+                age=number % 100,
+                notes=u'notes about person %d\n' % number * 4,
+                ))
+        db.close()
+        print '%d entities, best of %d, seconds' % (count, repeat)
+        print '%-28s %8s %8s %8s' % ('backend args', 'open', 'scan', 'load')
+        for backend_args in BACKEND_ARGS:
+            # The first open with offset_index=1 writes the index file.
+            scan(filename, backend_args)
+            results = [scan(filename, backend_args) for i in xrange(repeat)]
+            print '%-28s %8.3f %8.3f %8.3f' % (
+                (backend_args or '(none)',) +
+                tuple(min(times) for times in zip(*results)))
+    finally:
+        for name in (filename, filename + '.index'):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*args)
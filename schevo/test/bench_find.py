@@ -0,0 +1,82 @@
+"""
+Benchmark of extent.find() and query construction throughput.
+
+Not collected by the test runner.  Run it directly:
+
+    python -m schevo.test.bench_find [count]
+
+A temporary database is populated with `count` entities, then
+extent.find() is called on indexed and unindexed fields, and Match and
+ByExample queries are constructed and run.
+"""
+
+import os
+import sys
+from tempfile import mkstemp
+from time import time
+
+from schevo import database
+from schevo.query import ByExample, Match
+
+SCHEMA = """
+from schevo.schema import *
+schevo.schema.prep(locals())
+
+class Person(E.Entity):
+
+    name = f.string()
+    age = f.integer()
+    nickname = f.string(required=False)
+
+    _key(name)
+    _index(age)
+"""
+
+
+def rate(fn, seconds=1.0):
+    """(fn:callable, seconds:float) -> float
+    Return the number of times per second `fn` can be called.
+    """
+    calls = 0
+    start = time()
+    stop = start + seconds
+    while True:
+        fn()
+        calls += 1
+        now = time()
+        if now >= stop:
+            return calls / (now - start)
+
+
+def main(count=1000):
+    fd, filename = mkstemp(suffix='.db')
+    os.close(fd)
+    os.remove(filename)
+    db = database.create(filename, 'schevo.store', schema_source=SCHEMA)
+    try:
+        for number in xrange(count):
+            db.execute(db.Person.t.create(
+                name=u'person %d' % number,
+                age=number % 100,
+                nickname=u'nick %d' % (number % 10),
+                ))
+        Person = db.Person
+        name = u'person %d' % (count // 2)
+        cases = [
+            ('find (key)', lambda: Person.find(name=name)),
+            ('find (index)', lambda: Person.find(age=42)),
+            ('find (scan)', lambda: Person.find(nickname=u'nick 3')),
+            ('Match', lambda: Match(Person, 'age', '==', 42)()),
+            ('ByExample', lambda: ByExample(Person, age=42)()),
+            ]
+        print '%d entities, calls per second' % count
+        for label, fn in cases:
+            print '%-14s %12.0f' % (label, rate(fn))
+    finally:
+        db.close()
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*args)
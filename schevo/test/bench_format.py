@@ -0,0 +1,114 @@
+"""
+Benchmark of database format 2 against format 3.
+
+Not collected by the test runner.  Run it directly:
+
+    python -m schevo.test.bench_format [count] [reads]
+
+For each format, a temporary database is populated with `count` people,
+each belonging to one of a few teams, and packed.  The size of the file
+and the number of records in it are reported, and the database is then
+reopened a few times to time opening it, reading one field of `reads`
+entities chosen at random from the cold cache, and reading them again
+from the warm cache.
+"""
+
+import os
+import sys
+from random import Random
+from tempfile import mkstemp
+from time import time
+
+from schevo import database
+
+SCHEMA = """
+from schevo.schema import *
+schevo.schema.prep(locals())
+
+class Team(E.Entity):
+
+    name = f.string()
+
+    _key(name)
+
+class Person(E.Entity):
+
+    name = f.string()
+    age = f.integer()
+    team = f.entity('Team')
+    notes = f.string(multiline=True, required=False)
+
+    _key(name)
+"""
+
+TEAMS = 10
+
+
+def populate(filename, format, count):
+    db = database.create(filename, 'schevo.store', schema_source=SCHEMA,
+                         format=format)
+    try:
+        teams = [db.execute(db.Team.t.create(name=u'team %d' % number))
+                 for number in xrange(TEAMS)]
+        create = db.Person.t.create
+        for number in xrange(count):
+            db.execute(create(
+                name=u'person %d' % number,
+                age=number % 100,
+                team=teams[number % TEAMS],
+                notes=u'notes about person %d\n' % number,
+                ))
+        db.backend.pack()
+    finally:
+        db.close()
+
+
+def read(filename, oids):
+    """(filename:str, oids:[int]) -> (float, float, float)
+    Return the seconds taken to open the database, to read the name of
+    the people with the given oids from the cold cache, and to read them
+    again.
+    """
+    start = time()
+    db = database.open(filename)
+    opened = time()
+    try:
+        extent = db.Person
+        for oid in oids:
+            extent[oid].name
+        cold = time()
+        for oid in oids:
+            extent[oid].name
+        return opened - start, cold - opened, time() - cold
+    finally:
+        db.close()
+
+
+def main(count=20000, reads=2000, repeat=3):
+    oids = Random(1).sample(xrange(1, count + 1), reads)
+    print '%d people, %d random reads, best of %d, seconds' % (
+        count, reads, repeat)
+    print '%-8s %10s %8s %8s %8s %8s' % (
+        'format', 'KB', 'records', 'open', 'cold', 'warm')
+    for format in (2, 3):
+        fd, filename = mkstemp(suffix='.db')
+        os.close(fd)
+        os.remove(filename)
+        try:
+            populate(filename, format, count)
+            db = database.open(filename)
+            records = len(db.backend.storage.index)
+            db.close()
+            results = [read(filename, oids) for i in xrange(repeat)]
+            print '%-8s %10.1f %8d %8.3f %8.3f %8.3f' % (
+                (format, os.path.getsize(filename) / 1024.0, records) +
+                tuple(min(times) for times in zip(*results)))
+        finally:
+            for name in (filename, filename + '.prepack'):
+                if os.path.exists(name):
+                    os.remove(name)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*args)
@@ -176,3 +176,10 @@ class TestBank2(BaseBank):
     include = True
 
     format = 2
+
+
+class TestBank3(BaseBank):
+
+    include = True
+
+    format = 3
@@ -0,0 +1,242 @@
+"""Bulk creation of entities."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import random
+
+from schevo.constant import UNASSIGNED
+from schevo import error
+from schevo.test import CreatesSchema, raises
+from schevo.transaction import Transaction
+
+
+class BaseBulkCreate(CreatesSchema):
+
+    body = '''
+
+    class Person(E.Entity):
+
+        name = f.string()
+        age = f.integer(required=False)
+        team = f.entity('Team', required=False)
+        mentor = f.entity('Person', required=False)
+        nickname = f.string(default='nobody')
+
+        _key(name)
+
+        _index(age, name)
+
+
+    class Team(E.Entity):
+
+        name = f.string()
+
+        _key(name)
+    '''
+
+    def test_create(self):
+        assert db.Team.bulk_create([(u'Red', ), dict(name=u'Blue')]) == 2
+        assert len(db.Team) == 2
+        assert db.Team.next_oid == 3
+        assert db.Team.findone(name=u'Red').s.oid == 1
+        assert db.Team.findone(name=u'Blue').s.oid == 2
+        assert db.Team.bulk_create([]) == 0
+        # Entities can still be created and changed by transactions.
+        green = db.execute(db.Team.t.create(name=u'Green'))
+        assert green.s.oid == 3
+        db.execute(green.t.update(name=u'Yellow'))
+        self.reopen()
+        assert sorted(team.name for team in db.Team) == [
+            u'Blue', u'Red', u'Yellow']
+        assert db.Team.findone(name=u'Green') is None
+
+    def test_default_values(self):
+        db.Person.bulk_create([dict(name=u'Ann'), (u'Bob', 30)])
+        ann = db.Person.findone(name=u'Ann')
+        assert ann.age is UNASSIGNED
+        assert ann.team is UNASSIGNED
+        assert ann.nickname == u'nobody'
+        bob = db.Person.findone(name=u'Bob')
+        assert bob.age == 30
+        assert bob.nickname == u'nobody'
+
+    def test_converted_values(self):
+        db.Team.bulk_create([(u'Red', )])
+        db.Person.bulk_create([(u'Ann', '30', 'Team-1')])
+        ann = db.Person.findone(name=u'Ann')
+        assert ann.age == 30
+        assert ann.team == db.Team[1]
+
+    def test_indices(self):
+        db.execute(db.Person.t.create(name=u'person 500', age=0))
+        numbers = range(1000)
+        numbers.remove(500)
+        random.shuffle(numbers)
+        db.Person.bulk_create(
+            (u'person %i' % number, number % 10) for number in numbers)
+        self.reopen()
+        assert len(db.Person) == 1000
+        expected = sorted(
+            (number % 10, u'person %i' % number) for number in range(1000))
+        assert [(person.age, person.name) for person in db.Person.by(
+            'age', 'name')] == expected
+        assert len(db.Person.find(age=5)) == 100
+        assert db.Person.findone(name=u'person 500').age == 0
+        assert db.Person.findone(name=u'person 999').age == 9
+
+    def test_indices_committed_while_built(self):
+        if db.format < 2:
+            return
+        extent_map = db._extent_map('Person')
+        building = []
+        commit = db._commit
+        def note_commit():
+            building.append('bulk_indices' in extent_map)
+            commit()
+        db._commit = note_commit
+        try:
+            db.Person.bulk_create(
+                ((u'person %i' % number, number % 10)
+                 for number in range(100)), commit_interval=10)
+            # Commits are made while the new indices are built, and the
+            # new indices then replace the old ones.
+            assert building.count(True) >= 20
+            assert 'bulk_indices' not in extent_map
+            assert len(db.Person.find(age=5)) == 10
+            # New indices are discarded if they cannot be completed.
+            assert raises(error.KeyCollision, db.Person.bulk_create,
+                          [(u'person 1', )], commit_interval=1)
+            assert 'bulk_indices' not in extent_map
+        finally:
+            db._commit = commit
+        self.reopen()
+        assert len(db.Person) == 100
+        assert len(db.Person.find(age=5)) == 10
+        assert db.Person.findone(name=u'person 1').age == 1
+
+    def test_links(self):
+        red, blue = [db.execute(db.Team.t.create(name=name))
+                     for name in (u'Red', u'Blue')]
+        ann = db.execute(db.Person.t.create(name=u'Ann', team=red))
+        bob_oid = db.Person.next_oid
+        db.Person.bulk_create([
+            (u'Bob', 20, red, ann),
+            (u'Cy', 30, blue, ann),
+            # Mentors may be created earlier in the same bulk create.
+            (u'Dee', 40, red, 'Person-%i' % bob_oid),
+            ])
+        dee = db.Person.findone(name=u'Dee')
+        db.Person.bulk_create([
+            (u'Fay', 60, blue),
+            dict(name=u'Gus', mentor=dee, team=red),
+            ])
+        self.reopen()
+        red = db.Team.findone(name=u'Red')
+        blue = db.Team.findone(name=u'Blue')
+        ann = db.Person.findone(name=u'Ann')
+        bob = db.Person.findone(name=u'Bob')
+        dee = db.Person.findone(name=u'Dee')
+        assert red.s.count('Person', 'team') == 4
+        assert blue.s.count('Person', 'team') == 2
+        assert sorted(person.name for person in red.s.links(
+            'Person', 'team')) == [u'Ann', u'Bob', u'Dee', u'Gus']
+        assert sorted(person.name for person in ann.s.links(
+            'Person', 'mentor')) == [u'Bob', u'Cy']
+        assert ann.s.count() == 2
+        assert [person.name for person in bob.s.links(
+            'Person', 'mentor')] == [u'Dee']
+        assert [person.name for person in dee.s.links(
+            'Person', 'mentor')] == [u'Gus']
+        # Links are maintained as usual afterwards.
+        gus = db.Person.findone(name=u'Gus')
+        db.execute(gus.t.update(team=blue))
+        assert red.s.count('Person', 'team') == 3
+        assert blue.s.count('Person', 'team') == 3
+        db.execute(gus.t.delete())
+        assert dee.s.count() == 0
+        assert raises(error.DeleteRestricted, db.execute, bob.t.delete())
+
+    def test_key_collision(self):
+        db.execute(db.Person.t.create(name=u'Ann'))
+        for commit_interval in (None, 1):
+            assert raises(error.KeyCollision, db.Person.bulk_create,
+                          [(u'Bob', ), (u'Ann', ), (u'Cy', )],
+                          commit_interval=commit_interval)
+            assert raises(error.KeyCollision, db.Person.bulk_create,
+                          [(u'Bob', ), (u'Cy', ), (u'Bob', )],
+                          commit_interval=commit_interval)
+            assert len(db.Person) == 1
+            assert db.Person.findone(name=u'Bob') is None
+            assert [person.name for person in db.Person] == [u'Ann']
+        self.reopen()
+        assert [person.name for person in db.Person] == [u'Ann']
+        assert db.Person.bulk_create([(u'Bob', ), (u'Cy', )]) == 2
+        assert len(db.Person) == 3
+
+    def test_removed_after_error(self):
+        db.Team.bulk_create([(u'Red', )])
+        red = db.Team[1]
+        for commit_interval in (None, 1, 2):
+            def rows():
+                yield (u'Ann', 20, red)
+                yield (u'Bob', 30, red)
+                raise ValueError()
+            assert raises(ValueError, db.Person.bulk_create, rows(),
+                          commit_interval=commit_interval)
+            assert len(db.Person) == 0
+            assert red.s.count() == 0
+            assert db.Person.findone(name=u'Ann') is None
+        assert db.Person.bulk_create([(u'Ann', 20, red)]) == 1
+        assert red.s.count() == 1
+
+    def test_entity_does_not_exist(self):
+        red = db.execute(db.Team.t.create(name=u'Red'))
+        db.execute(red.t.delete())
+        assert raises(error.EntityDoesNotExist, db.Person.bulk_create,
+                      [(u'Ann', 20), (u'Bob', 30, red)])
+        assert len(db.Person) == 0
+
+    def test_validate(self):
+        assert raises(error.FieldRequired, db.Person.bulk_create,
+                      [dict(age=20)])
+        assert len(db.Person) == 0
+        db.Person.bulk_create([dict(age=20)], validate=False)
+        assert len(db.Person) == 1
+        assert db.Person[1].name is UNASSIGNED
+
+    def test_bad_rows(self):
+        assert raises(error.FieldDoesNotExist, db.Team.bulk_create,
+                      [dict(title=u'Red')])
+        assert raises(ValueError, db.Team.bulk_create, [(u'Red', 1)])
+        assert raises(ValueError, db.Team.bulk_create, [(None, )])
+        assert len(db.Team) == 0
+
+    def test_executing_transaction(self):
+        class BulkCreate(Transaction):
+            def _execute(self, db):
+                db.Team.bulk_create([(u'Red', )])
+        assert raises(error.DatabaseExecutingTransaction,
+                      db.execute, BulkCreate())
+        assert len(db.Team) == 0
+
+
+class TestBulkCreate1(BaseBulkCreate):
+
+    include = True
+
+    format = 1
+
+
+class TestBulkCreate2(BaseBulkCreate):
+
+    include = True
+
+    format = 2
+
+
+class TestBulkCreate3(BaseBulkCreate):
+
+    include = True
+
+    format = 3
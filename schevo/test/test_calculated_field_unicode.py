@@ -53,3 +53,10 @@ class TestCalculatedUnicode2(BaseCalculatedUnicode):
     include = True
 
     format = 2
+
+
+class TestCalculatedUnicode3(BaseCalculatedUnicode):
+
+    include = True
+
+    format = 3
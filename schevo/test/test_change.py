@@ -479,6 +479,13 @@ class TestChangeset2(BaseChangeset):
     format = 2
 
 
+class TestChangeset3(BaseChangeset):
+
+    include = True
+
+    format = 3
+
+
 class TestExecuteNotification1(BaseExecuteNotification):
 
     include = True
@@ -493,6 +500,13 @@ class TestExecuteNotification2(BaseExecuteNotification):
     format = 2
 
 
+class TestExecuteNotification3(BaseExecuteNotification):
+
+    include = True
+
+    format = 3
+
+
 class TestDistributor1(BaseDistributor):
 
     include = True
@@ -505,3 +519,10 @@ class TestDistributor2(BaseDistributor):
     include = True
 
     format = 2
+
+
+class TestDistributor3(BaseDistributor):
+
+    include = True
+
+    format = 3
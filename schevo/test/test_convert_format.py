@@ -206,3 +206,51 @@ class TestFormat1Format2ConversionComplex(CreatesSchema):
         assert bar3.gee == gee1
         assert bar4.foo == foo2
         assert bar4.gee == gee2
+
+
+class TestFormat2Format3Conversion(TestFormat1Format2ConversionComplex):
+    """Test of the format 2 to format 3 converter."""
+
+    format = 2
+
+    def test(self):
+        self.check_using_public_api()
+        self.reopen(format=3)
+        assert db.format == 3
+        self.check_using_public_api()
+        self.internal_structure_format_3(db)
+        # The converted database can still be changed.
+        bar1 = db.Bar[1]
+        ex(bar1.t.update(gee=db.Gee[2]))
+        assert db.Bar.findone(foo=db.Foo[1], gee=db.Gee[2]) == bar1
+        assert db.Gee[1].s.count() == 2
+        assert db.Gee[2].s.count() == 2
+        ex(db.Bar.t.create(id=5, foo=db.Foo[2], gee=db.Gee[2]))
+        assert db.Foo[2].s.count() == 3
+        ex(db.Bar[4].t.delete())
+        assert db.Foo[2].s.count() == 2
+
+    def internal_structure_format_3(self, db):
+        EntityRecord = db.backend.EntityRecord
+        schevo = db._root['SCHEVO']
+        extent_name_id = schevo['extent_name_id']
+        extents = schevo['extents']
+        Foo_extent = extents[extent_name_id['Foo']]
+        Bar_extent = extents[extent_name_id['Bar']]
+        Bar_id = extent_name_id['Bar']
+        Bar_field_name_id = Bar_extent['field_name_id']
+        Bar_foo_field_id = Bar_field_name_id['foo']
+        Foo_1 = Foo_extent['entities'][1]
+        Bar_1 = Bar_extent['entities'][1]
+        assert isinstance(Foo_1, EntityRecord)
+        assert isinstance(Bar_1, EntityRecord)
+        assert Foo_1['link_count'] == 2
+        assert sorted(Foo_1['links'][(Bar_id, Bar_foo_field_id)].keys()) == [
+            1, 3]
+        # Nothing links to Bar entities, so they have no links structure.
+        assert Bar_1.links is None
+        assert Bar_1['links'].keys() == []
+        assert Bar_1['fields'][Bar_field_name_id['id']] == 1
+        assert Bar_1['fields'][Bar_foo_field_id] == Placeholder(db.Foo[1])
+        assert Bar_1['related_entities'][Bar_foo_field_id] == frozenset([
+            Placeholder(db.Foo[1])])
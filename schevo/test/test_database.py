@@ -146,3 +146,14 @@ class TestDatabase2(BaseDatabase):
     def test_format_2(self):
         """A newly-created database will be in database format version 2."""
         assert self.db.format == 2
+
+
+class TestDatabase3(BaseDatabase):
+
+    include = True
+
+    format = 3
+
+    def test_format_3(self):
+        """A newly-created database will be in database format version 3."""
+        assert self.db.format == 3
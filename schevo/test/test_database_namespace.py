@@ -39,3 +39,10 @@ class TestDatabaseNamespaces2(BaseDatabaseNamespaces):
     include = True
 
     format = 2
+
+
+class TestDatabaseNamespaces3(BaseDatabaseNamespaces):
+
+    include = True
+
+    format = 3
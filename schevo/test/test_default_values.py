@@ -52,3 +52,10 @@ class TestDefaultValues2(BaseDefaultValues):
     include = True
 
     format = 2
+
+
+class TestDefaultValues3(BaseDefaultValues):
+
+    include = True
+
+    format = 3
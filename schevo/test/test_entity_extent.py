@@ -208,6 +208,14 @@ class BaseEntityExtent(CreatesSchema):
         _key(datetime)
 
 
+    class Upload(E.Entity):
+        """An upload is identified by its binary digest."""
+
+        digest = f.bytes()
+
+        _key(digest)
+
+
     class Multiple_Keys_Create(T.Transaction):
 
         def _execute(self, db):
@@ -509,6 +517,64 @@ class BaseEntityExtent(CreatesSchema):
         assert len(avatar_user) == 1
         assert avatar_user[0] == avatar
 
+    def test_update_writes_only_changed_structures(self):
+        if db.format < 2:
+            return
+        def btree_objects(btree, depth):
+            # The BTree, its nodes and, for all but the last level of an
+            # index, the BTrees below it.
+            objects = [btree]
+            nodes = [btree.root]
+            while nodes:
+                node = nodes.pop()
+                objects.append(node)
+                if node.nodes:
+                    nodes.extend(node.nodes)
+                if depth > 1:
+                    for key, value in node.items:
+                        objects.extend(btree_objects(value, depth - 1))
+            return objects
+        def index_objects():
+            objects = []
+            indices = db._extent_map('Account')['indices']
+            for index_spec, (unique, branch) in indices.iteritems():
+                objects.extend(btree_objects(branch, len(index_spec)))
+            return objects
+        def link_objects():
+            entity_map = db._entity_extent_map('Person', fred.sys.oid)[0]
+            links = entity_map['links']
+            objects = [entity_map, links]
+            for link_key in links.keys():
+                objects.extend(btree_objects(links[link_key], 1))
+            return objects
+        def changed(objects):
+            changed = db.backend.conn.changed.values()
+            return [obj for obj in objects if obj in changed]
+        fred = db.Person.findone(name='Fred Flintstone')
+        betty = db.Person.findone(name='Betty Rubble')
+        account = db.Account.findone(owner=fred, name='Personal')
+        class Update(Transaction):
+            def __init__(self, **fields):
+                Transaction.__init__(self)
+                self._fields = fields
+            def _execute(self, db):
+                db.execute(account.t.update(**self._fields))
+                return changed(index_objects()), changed(link_objects())
+        # Neither the indices nor the links change when the fields they
+        # depend on do not.
+        indices, links = db.execute(Update(balance=100.00))
+        assert indices == []
+        assert links == []
+        # The key index changes when the name changes.
+        indices, links = db.execute(Update(name='Checking'))
+        assert indices != []
+        assert links == []
+        # Links change when the owner changes.
+        indices, links = db.execute(Update(owner=betty))
+        assert links != []
+        assert account.owner == betty
+        assert len(db.Account.find(owner=fred)) == 1
+
     def test_entity_links_delete(self):
         user, realm, avatar = self.db.execute(db.t.user_realm_avatar())
         tx = avatar.t.delete()
@@ -642,6 +708,53 @@ class BaseEntityExtent(CreatesSchema):
         tx.f.name.required = False
         assert raises(AttributeError, db.execute, tx)
 
+    def test_field_cache(self):
+        user, realm, avatar = db.execute(db.t.user_realm_avatar())
+        db.cache_field_values = True
+        hits, misses = db.field_cache_hits, db.field_cache_misses
+        assert avatar.name == 'baz'
+        assert avatar.user == user
+        assert avatar.name == 'baz'
+        assert avatar.user == user
+        assert db.field_cache_misses == misses + 2
+        assert db.field_cache_hits == hits + 2
+        # Updates are seen.
+        db.execute(avatar.t.update(name='qux'))
+        assert avatar.name == 'qux'
+        # So are rollbacks, even of values cached during the
+        # transaction that was rolled back.
+        class UpdateThenFail(Transaction):
+            def _execute(self, db):
+                db.execute(avatar.t.update(name='temporary'))
+                assert avatar.name == 'temporary'
+                raise RuntimeError()
+        assert raises(RuntimeError, db.execute, UpdateThenFail())
+        assert avatar.name == 'qux'
+        db.execute(avatar.t.update(name='other'))
+        assert avatar.name == 'other'
+        # Deleted entities have no field values.
+        db.execute(avatar.t.delete())
+        assert raises(error.EntityDoesNotExist, getattr, avatar, 'name')
+
+    def test_warm_cache(self):
+        db.execute(db.t.user_realm_avatar())
+        self.reopen()
+        user_entities = db._extent_map('User')['entities']
+        realm_entities = db._extent_map('Realm')['entities']
+        assert user_entities._p_is_ghost()
+        assert realm_entities._p_is_ghost()
+        db.warm_cache(['User'])
+        assert not user_entities._p_is_ghost()
+        for oid, entity_map in user_entities.iteritems():
+            assert not entity_map._p_is_ghost()
+            if db.format < 3:
+                # Format 3 keeps the fields in the entity's own record.
+                assert not entity_map['fields']._p_is_ghost()
+        assert realm_entities._p_is_ghost()
+        db.warm_cache()
+        assert not realm_entities._p_is_ghost()
+        assert db.User.findone(name='foo').name == 'foo'
+
     def test_find(self):
         user, realm, avatar = self.db.execute(db.t.user_realm_avatar())
         extent = db.User
@@ -730,6 +843,82 @@ class BaseEntityExtent(CreatesSchema):
         result = db.Event.findone(date=d)
         assert result == event2
 
+    def test_estimate_count(self):
+        user, realm, avatar = self.db.execute(db.t.user_realm_avatar())
+        extent = db.User
+        user1 = db.execute(extent.t.create(name='foo3', age=20))
+        user2 = db.execute(extent.t.create(name='bar3', age=20))
+        user3 = db.execute(extent.t.create(name='baz3', age=25))
+        # Counts from single-field indexes and links are exact.
+        assert extent.estimate_count('age', 20) == 2
+        assert extent.estimate_count('age', 30) == 0
+        assert extent.estimate_count('age', UNASSIGNED) == 1
+        assert db.Avatar.estimate_count('user', user) == 1
+        assert db.Avatar.estimate_count('user', user1) == 0
+        # Ranges are estimated.
+        assert extent.estimate_range_count('age', 21) >= 1
+        assert extent.estimate_range_count('age', 30) == 0
+        assert extent.estimate_range_count('name', prefix='ba') >= 1
+        # Binary prefixes are compared with binary values.
+        upload1 = db.execute(db.Upload.t.create(digest='\x00\x01'))
+        upload2 = db.execute(db.Upload.t.create(digest='\x00\xfe'))
+        upload3 = db.execute(db.Upload.t.create(digest='\x01'))
+        assert db.Upload.estimate_range_count('digest', prefix='\x00') >= 1
+        assert db.Upload.find_prefix('digest', '\x00') == [upload1, upload2]
+        # Unindexed fields cannot be estimated.
+        assert db.Account.estimate_count('balance', 291.00) is None
+        assert db.Account.estimate_range_count('balance', 250) is None
+
+    def test_find_range(self):
+        extent = db.User
+        user1 = db.execute(extent.t.create(name='foo', age=20))
+        user2 = db.execute(extent.t.create(name='bar', age=25))
+        user3 = db.execute(extent.t.create(name='baz', age=22))
+        user4 = db.execute(extent.t.create(name='qux'))
+        # Find using an index, in order of value.
+        assert extent.find_range('age', 20, 25) == [user1, user3]
+        assert extent.find_range(
+            'age', 20, 25, include_low=False, include_high=True) == [
+            user3, user2]
+        assert extent.find_range('age', high=22) == [user1]
+        assert extent.find_range('age', low=21) == [user3, user2]
+        # UNASSIGNED values are never in range.
+        assert extent.find_range('age') == [user1, user3, user2]
+        assert extent.find_range_oids('age', 21) == [
+            user3.s.oid, user2.s.oid]
+        # Date values are converted before comparison.
+        event1 = db.execute(db.Event.t.create(date='2009-01-15'))
+        event2 = db.execute(db.Event.t.create(
+            date='2008-12-31', datetime=datetime.datetime(2009, 1, 1)))
+        event3 = db.execute(db.Event.t.create(
+            date='2009-02-01', datetime=datetime.datetime(2009, 1, 2)))
+        assert db.Event.find_range(
+            'date', datetime.date(2009, 1, 1), '2009-02-01') == [event1]
+        assert db.Event.find_range(
+            'datetime', high=datetime.datetime(2009, 1, 2),
+            include_high=True) == [event2, event3]
+        # Find without an index.
+        accounts = db.Account.find_range('balance', 250, 3000)
+        assert [a.balance for a in accounts] == [291.00, 2816.50]
+        accounts = db.Account.find_range('balance', high=291.00)
+        assert [a.balance for a in accounts] == [204.52]
+
+    def test_find_prefix(self):
+        extent = db.User
+        user1 = db.execute(extent.t.create(name='bart'))
+        user2 = db.execute(extent.t.create(name='bar'))
+        user3 = db.execute(extent.t.create(name='ba'))
+        user4 = db.execute(extent.t.create(name='bat'))
+        assert extent.find_prefix('name', 'bar') == [user2, user1]
+        assert extent.find_prefix('name', 'ba') == [
+            user3, user2, user1, user4]
+        assert extent.find_prefix('name', 'c') == []
+        # Find without an index.
+        accounts = db.Account.find_prefix('name', 'S')
+        assert [a.name for a in accounts] == [u'Savings']
+        assert raises(error.FieldDoesNotExist,
+                      extent.find_prefix, 'some_field', 'a')
+
     def test_transaction_error(self):
         ## skip('Temporarily unimportant')
         return
@@ -876,3 +1065,10 @@ class TestEntityExtent2(BaseEntityExtent):
     include = True
 
     format = 2
+
+
+class TestEntityExtent3(BaseEntityExtent):
+
+    include = True
+
+    format = 3
@@ -138,6 +138,13 @@ class TestHiddenBases2(BaseHiddenBases):
     format = 2
 
 
+class TestHiddenBases3(BaseHiddenBases):
+
+    include = True
+
+    format = 3
+
+
 class TestSameNameSubclasses1(BaseSameNameSubclasses):
 
     include = True
@@ -152,6 +159,13 @@ class TestSameNameSubclasses2(BaseSameNameSubclasses):
     format = 2
 
 
+class TestSameNameSubclasses3(BaseSameNameSubclasses):
+
+    include = True
+
+    format = 3
+
+
 class TestSubclassTransactionCorrectness1(BaseSubclassTransactionCorrectness):
 
     include = True
@@ -164,3 +178,10 @@ class TestSubclassTransactionCorrectness2(BaseSubclassTransactionCorrectness):
     include = True
 
     format = 2
+
+
+class TestSubclassTransactionCorrectness3(BaseSubclassTransactionCorrectness):
+
+    include = True
+
+    format = 3
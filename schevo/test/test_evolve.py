@@ -1188,6 +1188,13 @@ class TestEvolveIntraVersion2(BaseEvolveIntraVersion):
     format = 2
 
 
+class TestEvolveIntraVersion3(BaseEvolveIntraVersion):
+
+    include = True
+
+    format = 3
+
+
 class TestEvolveInterVersion1(BaseEvolveInterVersion):
 
     include = True
@@ -1202,6 +1209,13 @@ class TestEvolveInterVersion2(BaseEvolveInterVersion):
     format = 2
 
 
+class TestEvolveInterVersion3(BaseEvolveInterVersion):
+
+    include = True
+
+    format = 3
+
+
 class TestEvolvesSchemataNoSkip1(BaseEvolvesSchemataNoSkip):
 
     include = True
@@ -1216,6 +1230,13 @@ class TestEvolvesSchemataNoSkip2(BaseEvolvesSchemataNoSkip):
     format = 2
 
 
+class TestEvolvesSchemataNoSkip3(BaseEvolvesSchemataNoSkip):
+
+    include = True
+
+    format = 3
+
+
 class TestEvolvesSchemataSkip1(BaseEvolvesSchemataSkip):
 
     include = True
@@ -1228,3 +1249,10 @@ class TestEvolvesSchemataSkip2(BaseEvolvesSchemataSkip):
     include = True
 
     format = 2
+
+
+class TestEvolvesSchemataSkip3(BaseEvolvesSchemataSkip):
+
+    include = True
+
+    format = 3
@@ -39,3 +39,10 @@ class TestOverride2(BaseOverride):
     include = True
 
     format = 2
+
+
+class TestOverride3(BaseOverride):
+
+    include = True
+
+    format = 3
@@ -63,3 +63,10 @@ class TestExtentWithoutFields2(BaseExtentWithoutFields):
     include = True
 
     format = 2
+
+
+class TestExtentWithoutFields3(BaseExtentWithoutFields):
+
+    include = True
+
+    format = 3
@@ -56,3 +56,10 @@ class TestExtentMethod2(BaseExtentMethod):
     include = True
 
     format = 2
+
+
+class TestExtentMethod3(BaseExtentMethod):
+
+    include = True
+
+    format = 3
@@ -118,3 +118,10 @@ class TestEntity2(BaseEntity):
     include = True
 
     format = 2
+
+
+class TestEntity3(BaseEntity):
+
+    include = True
+
+    format = 3
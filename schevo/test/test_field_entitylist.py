@@ -266,6 +266,13 @@ class TestFieldEntityList2(BaseFieldEntityList):
     format = 2
 
 
+class TestFieldEntityList3(BaseFieldEntityList):
+
+    include = True
+
+    format = 3
+
+
 class TestFieldEntityList1(BaseTest):
     """This tests for failure, since EntityList is not allowed in format 1
     databases.
@@ -230,6 +230,13 @@ class TestFieldEntitySet2(BaseFieldEntitySet):
     format = 2
 
 
+class TestFieldEntitySet3(BaseFieldEntitySet):
+
+    include = True
+
+    format = 3
+
+
 class TestFieldEntitySet1(BaseTest):
     """This tests for failure, since EntitySet is not allowed in
     format 1 databases.
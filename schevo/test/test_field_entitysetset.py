@@ -122,6 +122,13 @@ class TestFieldEntitySetSet2(BaseFieldEntitySetSet):
     format = 2
 
 
+class TestFieldEntitySetSet3(BaseFieldEntitySetSet):
+
+    include = True
+
+    format = 3
+
+
 class TestFieldEntitySetSet1(BaseTest):
     """This tests for failure, since EntitySetSet is not allowed in
     format 1 databases.
@@ -105,3 +105,10 @@ class TestFieldMaps2(BaseFieldMaps):
     include = True
 
     format = 2
+
+
+class TestFieldMaps3(BaseFieldMaps):
+
+    include = True
+
+    format = 3
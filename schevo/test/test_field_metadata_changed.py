@@ -61,3 +61,10 @@ class TestFieldMetadataChanged2(BaseFieldMetadataChanged):
     include = True
 
     format = 2
+
+
+class TestFieldMetadataChanged3(BaseFieldMetadataChanged):
+
+    include = True
+
+    format = 3
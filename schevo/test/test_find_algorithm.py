@@ -5,7 +5,8 @@
 
 from textwrap import dedent
 
-from schevo.test import EvolvesSchemata
+from schevo.constant import UNASSIGNED
+from schevo.test import CreatesSchema, EvolvesSchemata
 
 
 class BaseFindAlgorithm(EvolvesSchemata):
@@ -64,3 +65,90 @@ class TestFindAlgorithm2(BaseFindAlgorithm):
     include = True
 
     format = 2
+
+
+class TestFindAlgorithm3(BaseFindAlgorithm):
+
+    include = True
+
+    format = 3
+
+
+class BaseFindLeadingIndexFields(CreatesSchema):
+
+    body = """
+
+    class Person(E.Entity):
+
+        last_name = f.string()
+        first_name = f.string()
+        city = f.string(required=False)
+
+        _key(last_name, first_name)
+
+        _index(city, last_name, first_name)
+
+        _initial = [
+            ('Smith', 'John', 'Boston'),
+            ('Smith', 'Jane', 'Denver'),
+            ('Smith', 'Adam', UNASSIGNED),
+            ('Jones', 'John', 'Boston'),
+            ('Brown', 'Adam', 'Denver'),
+            ]
+    """
+
+    def expected(self, **criteria):
+        return sorted(
+            person for person in db.Person
+            if all(getattr(person, name) == value
+                   for name, value in criteria.iteritems())
+            )
+
+    def test_find_leading_fields_of_index(self):
+        for criteria in [
+            dict(last_name='Smith'),
+            dict(last_name='Jones'),
+            dict(last_name='Nobody'),
+            dict(city='Denver'),
+            dict(city=UNASSIGNED),
+            dict(city='Boston', last_name='Jones'),
+            ]:
+            results = db.Person.find(**criteria)
+            assert sorted(results) == self.expected(**criteria)
+            assert len(results) == len(set(results))
+
+    def test_find_some_fields_in_index(self):
+        for criteria in [
+            dict(last_name='Smith', city='Boston'),
+            dict(last_name='Smith', city=UNASSIGNED),
+            dict(city='Denver', first_name='Adam'),
+            dict(last_name='Brown', city='Boston'),
+            ]:
+            results = db.Person.find(**criteria)
+            assert sorted(results) == self.expected(**criteria)
+
+    def test_find_fields_not_in_index(self):
+        criteria = dict(first_name='John')
+        results = db.Person.find(**criteria)
+        assert sorted(results) == self.expected(**criteria)
+
+
+class TestFindLeadingIndexFields1(BaseFindLeadingIndexFields):
+
+    include = True
+
+    format = 1
+
+
+class TestFindLeadingIndexFields2(BaseFindLeadingIndexFields):
+
+    include = True
+
+    format = 2
+
+
+class TestFindLeadingIndexFields3(BaseFindLeadingIndexFields):
+
+    include = True
+
+    format = 3
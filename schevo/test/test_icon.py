@@ -59,3 +59,10 @@ class TestFsIconMap2(BaseFsIconMap):
     include = True
 
     format = 2
+
+
+class TestFsIconMap3(BaseFsIconMap):
+
+    include = True
+
+    format = 3
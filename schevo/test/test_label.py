@@ -523,6 +523,13 @@ class TestDecoration2(BaseDecoration):
     format = 2
 
 
+class TestDecoration3(BaseDecoration):
+
+    include = True
+
+    format = 3
+
+
 class TestDatabaseDecoration1(BaseDatabaseDecoration):
 
     include = True
@@ -535,3 +542,10 @@ class TestDatabaseDecoration2(BaseDatabaseDecoration):
     include = True
 
     format = 2
+
+
+class TestDatabaseDecoration3(BaseDatabaseDecoration):
+
+    include = True
+
+    format = 3
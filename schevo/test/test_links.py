@@ -212,3 +212,10 @@ class TestLinks2(BaseLinks):
     include = True
 
     format = 2
+
+
+class TestLinks3(BaseLinks):
+
+    include = True
+
+    format = 3
@@ -7,6 +7,7 @@ from schevo.constant import UNASSIGNED
 from schevo import error
 from schevo.placeholder import Placeholder
 from schevo.test import CreatesSchema, raises
+from schevo.transaction import Combination, Transaction, Update
 
 
 class BaseOnDelete(CreatesSchema):
@@ -702,6 +703,11 @@ class TestOnDelete2(BaseOnDelete):
         assert len(Baz_extent['entities']) == 0
 
 
+class TestOnDelete3(TestOnDelete2):
+
+    format = 3
+
+
 # --------------------------------------------------------------------
 
 
@@ -777,6 +783,13 @@ class TestOnDeleteKeyRelax2(BaseOnDeleteKeyRelax):
     format = 2
 
 
+class TestOnDeleteKeyRelax3(BaseOnDeleteKeyRelax):
+
+    include = True
+
+    format = 3
+
+
 # --------------------------------------------------------------------
 
 
@@ -864,6 +877,13 @@ class TestOnDeleteEntityListRemove2(BaseOnDeleteEntityListRemove):
     format = 2
 
 
+class TestOnDeleteEntityListRemove3(BaseOnDeleteEntityListRemove):
+
+    include = True
+
+    format = 3
+
+
 # --------------------------------------------------------------------
 
 
@@ -924,6 +944,13 @@ class TestOnDeleteUnassignReadonlyField2(BaseOnDeleteUnassignReadonlyField):
     format = 2
 
 
+class TestOnDeleteUnassignReadonlyField3(BaseOnDeleteUnassignReadonlyField):
+
+    include = True
+
+    format = 3
+
+
 # --------------------------------------------------------------------
 
 
@@ -1017,3 +1044,233 @@ class TestOnDeleteUnassignEntityList2(BaseOnDeleteUnassignEntityList):
     include = True
 
     format = 2
+
+
+class TestOnDeleteUnassignEntityList3(BaseOnDeleteUnassignEntityList):
+
+    include = True
+
+    format = 3
+
+
+# --------------------------------------------------------------------
+
+
+class BaseOnDeletePlan(CreatesSchema):
+
+    body = """
+
+    class Tree(E.Entity):
+
+        name = f.string()
+        parent = f.entity('Tree', on_delete=CASCADE, required=False)
+
+        _key(name)
+
+        class _Delete(T.Delete):
+
+            def _after_execute(self, db):
+                db.execute(db.Deleted.t.create(name=self.name))
+
+
+    class Deleted(E.Entity):
+        \"\"\"Names of the trees whose Delete transactions were executed.\"\"\"
+
+        name = f.string()
+
+
+    class Note(E.Entity):
+
+        tree = f.entity('Tree', on_delete=UNASSIGN, required=False)
+        other_tree = f.entity('Tree', on_delete=UNASSIGN, required=False)
+
+
+    class Comment(E.Entity):
+        \"\"\"Its Update transaction customizes execution.\"\"\"
+
+        tree = f.entity('Tree', on_delete=UNASSIGN, required=False)
+
+        class _Update(T.Update):
+
+            def _after_execute(self, db, comment):
+                db.execute(db.Deleted.t.create(name=u'comment'))
+
+
+    class Pin(E.Entity):
+
+        tree = f.entity('Tree')
+
+
+    class Leaf(E.Entity):
+        \"\"\"Its Delete transaction customizes execution.\"\"\"
+
+        name = f.string()
+        tree = f.entity('Tree', on_delete=CASCADE)
+        other_tree = f.entity('Tree', required=False)
+
+        class _Delete(T.Delete):
+
+            _restrict_subclasses = False
+
+            def _execute(self, db):
+                db.execute(db.Deleted.t.create(name=u'leaf ' + self.name))
+                return T.Delete._execute(self, db)
+    """
+
+    def test_deep_cascade(self):
+        # Deeper than the recursion limit.
+        count = 1500
+        db.Tree.bulk_create(
+            (u'tree %i' % number, number and 'Tree-%i' % number or UNASSIGNED)
+            for number in xrange(count))
+        assert db.Tree[count].parent == db.Tree[count - 1]
+        db.execute(db.Tree[1].t.delete())
+        assert len(db.Tree) == 0
+        # Delete hooks are called for cascade deleted entities too.
+        assert len(db.Deleted) == count
+
+    def test_unassign_once(self):
+        a = db.execute(db.Tree.t.create(name=u'a'))
+        b = db.execute(db.Tree.t.create(name=u'b', parent=a))
+        note = db.execute(db.Note.t.create(tree=a, other_tree=b))
+        rev = note.s.rev
+        db.execute(a.t.delete())
+        assert len(db.Tree) == 0
+        assert note.tree is UNASSIGNED
+        assert note.other_tree is UNASSIGNED
+        assert note.s.rev == rev + 1
+
+    def test_batch_update(self):
+        a = db.execute(db.Tree.t.create(name=u'a'))
+        b = db.execute(db.Tree.t.create(name=u'b'))
+        notes = [db.execute(db.Note.t.create(tree=a, other_tree=b))
+                 for number in xrange(3)]
+        comment = db.execute(db.Comment.t.create(tree=a))
+        updated = []
+        execute = db.execute
+        def note_execute(tx, *args, **kw):
+            if isinstance(tx, Update):
+                updated.append(tx._extent_name)
+            return execute(tx, *args, **kw)
+        db.execute = note_execute
+        try:
+            db.execute(a.t.delete())
+        finally:
+            db.execute = execute
+        # Only the referrer with a customized Update transaction is
+        # updated by executing it.
+        assert updated == ['Comment']
+        assert [deleted.name for deleted in db.Deleted] == [u'comment', u'a']
+        assert comment.tree is UNASSIGNED
+        for note in notes:
+            assert note.tree is UNASSIGNED
+            assert note.other_tree == b
+        assert b.s.count('Note', 'other_tree') == 3
+
+    def test_restrict(self):
+        a = db.execute(db.Tree.t.create(name=u'a'))
+        b = db.execute(db.Tree.t.create(name=u'b', parent=a))
+        note = db.execute(db.Note.t.create(tree=a))
+        pin = db.execute(db.Pin.t.create(tree=b))
+        try:
+            db.execute(a.t.delete())
+        except error.DeleteRestricted, e:
+            assert e.restrictions == set([(b, pin, 'tree')])
+        else:
+            raise AssertionError('DeleteRestricted not raised.')
+        assert len(db.Tree) == 2
+        assert note.tree == a
+        assert len(db.Deleted) == 0
+
+    def test_undo(self):
+        # Each tree refers to the one created before it, and the first
+        # refers to the last, so none can be deleted before the others.
+        a = db.execute(db.Tree.t.create(name=u'a'))
+        b = db.execute(db.Tree.t.create(name=u'b', parent=a))
+        c = db.execute(db.Tree.t.create(name=u'c', parent=b))
+        d = db.execute(db.Tree.t.create(name=u'd'))
+        e = db.execute(db.Tree.t.create(name=u'e', parent=d))
+        db.execute(a.t.update(parent=c))
+        note = db.execute(db.Note.t.create(tree=b, other_tree=e))
+        leaf = db.execute(db.Leaf.t.create(name=u'x', tree=c, other_tree=a))
+        class DeleteThenFail(Transaction):
+            def _execute(self, db):
+                try:
+                    db.execute(Combination([
+                        a.t.delete(),
+                        d.t.delete(),
+                        db.Tree.t.create(name=u'q'),
+                        db.Tree.t.create(name=u'q'),
+                        ]))
+                except error.KeyCollision:
+                    pass
+                else:
+                    raise AssertionError('KeyCollision not raised.')
+        db.execute(DeleteThenFail())
+        # Every entity and link is restored.
+        assert len(db.Tree) == 5
+        assert (a.parent, b.parent, c.parent, d.parent, e.parent) == (
+            c, a, b, UNASSIGNED, d)
+        assert (note.tree, note.other_tree) == (b, e)
+        assert (leaf.tree, leaf.other_tree) == (c, a)
+        assert len(db.Deleted) == 0
+        assert a.s.count() == 2
+        assert b.s.count() == 2
+        assert c.s.count() == 2
+        assert d.s.count() == 1
+        assert e.s.count() == 1
+        assert [tree.name for tree in a.s.links('Tree', 'parent')] == [u'b']
+        assert [note.tree for note in b.s.links('Note', 'tree')] == [b]
+        # The database is still usable.
+        db.execute(a.t.delete())
+        assert sorted(tree.name for tree in db.Tree) == [u'd', u'e']
+        assert note.tree is UNASSIGNED
+        assert len(db.Leaf) == 0
+
+    def test_custom_execute(self):
+        a = db.execute(db.Tree.t.create(name=u'a'))
+        b = db.execute(db.Tree.t.create(name=u'b', parent=a))
+        db.execute(db.Leaf.t.create(name=u'x', tree=b, other_tree=a))
+        db.execute(db.Leaf.t.create(name=u'y', tree=a))
+        db.execute(a.t.delete())
+        assert len(db.Tree) == 0
+        assert len(db.Leaf) == 0
+        # The Delete transactions of the leaves were executed.
+        assert sorted(deleted.name for deleted in db.Deleted) == [
+            u'a', u'b', u'leaf x', u'leaf y']
+
+    def test_delete_selected(self):
+        a = db.execute(db.Tree.t.create(name=u'a'))
+        b = db.execute(db.Tree.t.create(name=u'b', parent=a))
+        c = db.execute(db.Tree.t.create(name=u'c'))
+        pin = db.execute(db.Pin.t.create(tree=c))
+        tx = db.Tree.EntityClass.t.delete_selected([c])
+        assert raises(error.DeleteRestricted, db.execute, tx)
+        # A restricting entity may be deleted along with the entity it
+        # refers to.
+        db.execute(db.Tree.EntityClass.t.delete_selected([c, pin, a]))
+        assert len(db.Tree) == 0
+        assert len(db.Pin) == 0
+        assert sorted(deleted.name for deleted in db.Deleted) == [
+            u'a', u'b', u'c']
+
+
+class TestOnDeletePlan1(BaseOnDeletePlan):
+
+    include = True
+
+    format = 1
+
+
+class TestOnDeletePlan2(BaseOnDeletePlan):
+
+    include = True
+
+    format = 2
+
+
+class TestOnDeletePlan3(BaseOnDeletePlan):
+
+    include = True
+
+    format = 3
@@ -262,6 +262,13 @@ class TestPopulateSimple2(BasePopulateSimple):
     format = 2
 
 
+class TestPopulateSimple3(BasePopulateSimple):
+
+    include = True
+
+    format = 3
+
+
 class TestPopulateComplex1(BasePopulateComplex):
 
     include = True
@@ -276,6 +283,13 @@ class TestPopulateComplex2(BasePopulateComplex):
     format = 2
 
 
+class TestPopulateComplex3(BasePopulateComplex):
+
+    include = True
+
+    format = 3
+
+
 class TestPopulateHidden1(BasePopulateHidden):
 
     include = True
@@ -288,3 +302,10 @@ class TestPopulateHidden2(BasePopulateHidden):
     include = True
 
     format = 2
+
+
+class TestPopulateHidden3(BasePopulateHidden):
+
+    include = True
+
+    format = 3
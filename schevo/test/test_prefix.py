@@ -40,6 +40,13 @@ class TestAlternatePrefixGood2(BaseAlternatePrefixGood):
     format = 2
 
 
+class TestAlternatePrefixGood3(BaseAlternatePrefixGood):
+
+    include = True
+
+    format = 3
+
+
 class TestSchemaFilenamePrefix(BaseTest):
 
     def test_good(self):
@@ -7,6 +7,7 @@ from schevo.constant import UNASSIGNED
 from schevo import error
 from schevo import field
 from schevo.label import label
+import schevo.query
 from schevo.test import CreatesSchema, raises
 
 
@@ -33,6 +34,19 @@ class BaseQuery(CreatesSchema):
         _hide('q_by_example')
 
 
+    class DeltaDelta(E.Entity):
+        """An extent with indexed fields."""
+
+        string = f.string(required=False)
+        integer = f.integer(required=False)
+        date = f.date(required=False)
+        float = f.float(required=False)
+
+        _index(string)
+        _index(integer, string)
+        _index(date)
+
+
     class DeltaCharlie(E.Entity):
         """An extent that has a custom query."""
 
@@ -168,6 +182,135 @@ class BaseQuery(CreatesSchema):
         results = list(sorted(q()))
         assert len(results) == 0
 
+    def test_query_field_classes_reused(self):
+        extent = db.DeltaAlpha
+        FieldClass = extent.field_spec['string']
+        assert FieldClass.readonly
+        m1 = schevo.query.Match(extent, 'string', '==', 'foo')
+        m2 = schevo.query.Match(extent, 'integer', '==', 5)
+        m3 = schevo.query.Match(extent, 'string', 'startswith', 'f')
+        # Each field class is converted for querying only once.
+        assert m1.FieldClass is m3.FieldClass
+        assert m1.FieldClass is not m2.FieldClass
+        assert issubclass(m1.FieldClass, FieldClass)
+        assert m1.FieldClass.__name__ == FieldClass.__name__
+        assert not m1.FieldClass.readonly
+        assert not m1.FieldClass.required
+        assert m1.FieldClass.fget is None
+        # Exact and ByExample queries share the same converted classes.
+        q = extent.q.exact()
+        assert q._field_map['string'].__class__ is m1.FieldClass
+        q = extent.q.by_example()
+        assert q.queries[0].FieldClass is m1.FieldClass
+        # The original field class is unchanged.
+        assert FieldClass.readonly
+        # Classes made for a single field are not given a cached query
+        # field class.
+        extra = field.String._def_class().field('extra')
+        ExtraClass = extra.__class__
+        m4 = schevo.query.Match(extent, 'extra', 'any', FieldClass=ExtraClass)
+        assert issubclass(m4.FieldClass, ExtraClass)
+        assert '_query_field_class' not in ExtraClass.__dict__
+
+    def test_match_range_query(self):
+        new_dd = lambda **kw: db.execute(db.DeltaDelta.t.create(**kw))
+        new_dd(string='foo', integer=5, date='2009-01-15', float=1.5)
+        new_dd(string='foobar', integer=12, float=2.5)
+        new_dd(string='bar', date='2008-12-31')
+        new_dd(integer=5, date='2009-02-01', float=0.5)
+        new_dd(string='fob', integer=-3)
+        new_dd()
+        extent = db.DeltaDelta
+        all_results = schevo.query.results(list(extent))
+        for field_name, operator, value in [
+            ('string', 'startswith', 'foo'),
+            ('string', 'startswith', 'fo'),
+            ('string', '<', 'foo'),
+            ('string', '>=', 'fob'),
+            ('integer', '<=', 5),
+            ('integer', '<', 5),
+            ('integer', '>', 5),
+            ('integer', '>=', -3),
+            ('date', '<', '2009-02-01'),
+            ('date', '>=', '2009-01-15'),
+            ('float', '<=', 1.5),
+            ('float', '>', 1.5),
+            ]:
+            # Matching on the extent uses the range search; matching on
+            # a list of results compares each value in turn.  The two
+            # must agree.
+            q = schevo.query.Match(extent, field_name, operator, value)
+            expected = schevo.query.Match(
+                all_results, field_name, operator, value,
+                FieldClass=getattr(extent.f, field_name))
+            assert list(q()) == list(expected())
+
+    def test_intersection_plan(self):
+        new_dd = lambda **kw: db.execute(db.DeltaDelta.t.create(**kw))
+        dd1 = new_dd(string='foo', integer=5, float=1.5)
+        dd2 = new_dd(string='bar', integer=5, float=2.5)
+        dd3 = new_dd(string='baz', integer=6, float=1.5)
+        dd4 = new_dd(string='qux', integer=7, date='2009-01-01')
+        # Subqueries that match anything are skipped, indexed matches
+        # are found first, and others are checked afterwards.
+        q = db.DeltaDelta.q.by_example(integer=5, float=1.5)
+        assert [step for step, query, estimate in q._plan()] == [
+            'skip', 'skip', 'index', 'filter']
+        assert sorted(q()) == [dd1]
+        assert q.explain().splitlines()[3].startswith(u'  index (about 2): ')
+        # The most selective index is used first.
+        q = db.DeltaDelta.q.by_example(integer=5, string='bar')
+        plan = q._plan()
+        assert [step for step, query, estimate in plan] == [
+            'skip', 'skip', 'index', 'index']
+        assert [query.field_name for step, query, estimate in plan] == [
+            'date', 'float', 'string', 'integer']
+        assert sorted(q()) == [dd2]
+        # Without an indexed match, the extent is scanned once.
+        q = db.DeltaDelta.q.by_example(float=1.5)
+        assert [step for step, query, estimate in q._plan()][-1] == 'scan'
+        assert sorted(q()) == [dd1, dd3]
+        # Every entity is found when nothing is matched.
+        q = db.DeltaDelta.q.by_example()
+        assert q._plan()[-1] == ('all', None, 4)
+        assert sorted(q()) == [dd1, dd2, dd3, dd4]
+        # Ranges may be estimated too.
+        q = schevo.query.Intersection(
+            schevo.query.Match(db.DeltaDelta, 'integer', '>=', 6),
+            schevo.query.Match(db.DeltaDelta, 'string', 'startswith', 'ba'),
+            schevo.query.Match(db.DeltaDelta, 'date', 'unassigned'),
+            )
+        plan = q._plan()
+        assert [step for step, query, estimate in plan] == [
+            'index', 'index', 'index']
+        assert [query.field_name for step, query, estimate in plan] == [
+            'string', 'integer', 'date']
+        assert sorted(q()) == [dd3]
+        # Queries on different extents are intersected as results.
+        q = schevo.query.Intersection(
+            schevo.query.Match(db.DeltaDelta, 'integer', '==', 5),
+            schevo.query.Match(db.DeltaAlpha, 'integer', 'any'),
+            )
+        assert q._plan() is None
+        assert sorted(q()) == []
+        assert q.explain().splitlines()[0] == u'intersect:'
+
+    def test_estimate_multi_field_index(self):
+        new_dd = lambda **kw: db.execute(db.DeltaDelta.t.create(**kw))
+        new_dd(string='foo', integer=5)
+        new_dd(string='foo', integer=5)
+        new_dd(string='bar', integer=5)
+        new_dd(string='foo', integer=6)
+        # Fields that begin a multi-field index are estimated from the
+        # distinct values of the following field, without visiting the
+        # branches below them.
+        assert db.DeltaDelta.estimate_count('integer', 5) == 2
+        assert db.DeltaDelta.estimate_count('integer', 6) == 1
+        assert db.DeltaDelta.estimate_count('integer', 7) == 0
+        q = db.DeltaDelta.q.by_example(integer=5)
+        assert q.explain().splitlines()[-1].startswith(u'  index (about 2): ')
+        assert len(q()) == 3
+
     def test_parameterized_query(self):
         hashes = db.DeltaCharlie.q.hashes
         new_dc = lambda **kw: db.execute(db.DeltaCharlie.t.create(**kw))
@@ -233,3 +376,10 @@ class TestQuery2(BaseQuery):
     include = True
 
     format = 2
+
+
+class TestQuery3(BaseQuery):
+
+    include = True
+
+    format = 3
@@ -73,3 +73,10 @@ class TestRelaxIndex2(BaseRelaxIndex):
     include = True
 
     format = 2
+
+
+class TestRelaxIndex3(BaseRelaxIndex):
+
+    include = True
+
+    format = 3
@@ -220,3 +220,10 @@ class TestSchema2(BaseSchema):
     include = True
 
     format = 2
+
+
+class TestSchema3(BaseSchema):
+
+    include = True
+
+    format = 3
@@ -0,0 +1,59 @@
+"""External sort tests."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import random
+
+from schevo.constant import UNASSIGNED
+from schevo.lib.sort import ExternalSort, merge
+from schevo.test import BaseTest
+
+
+class TestMerge(BaseTest):
+
+    def test_merge(self):
+        assert list(merge()) == []
+        assert list(merge([], [1, 3], [], [2])) == [1, 2, 3]
+        assert list(merge([1, 4, 4], iter([2, 4]), [0, 5])) == [
+            0, 1, 2, 4, 4, 4, 5]
+
+
+class TestExternalSort(BaseTest):
+
+    def items(self, count):
+        items = [(random.randint(0, 50), u'item %i' % n)
+                 for n in xrange(count)]
+        items.extend([(UNASSIGNED, u'unassigned'), (0, UNASSIGNED)])
+        random.shuffle(items)
+        return items
+
+    def test_in_memory(self):
+        items = self.items(100)
+        s = ExternalSort()
+        for item in items:
+            s.add(item)
+        assert len(s) == len(items)
+        assert not s._files
+        assert list(s) == sorted(items)
+        s.close()
+        assert len(s) == 0
+        assert list(s) == []
+
+    def test_spilled(self):
+        items = self.items(1000)
+        s = ExternalSort(buffer_size=10)
+        s.chunk_size = 3
+        s.max_files = 4
+        for item in items:
+            s.add(item)
+        assert len(s) == len(items)
+        # Files are merged so there are never max_files of them.
+        assert 0 < len(s._files) < 4
+        sorted_items = list(s)
+        assert sorted_items == sorted(items)
+        assert sorted_items[0] == (UNASSIGNED, u'unassigned')
+        # The sort can be iterated again.
+        assert list(s) == sorted_items
+        s.close()
+        assert s._files == []
@@ -1285,3 +1285,8 @@ class TestTransaction2(BaseTransaction):
         p_related_genders = p_related_entities[Person_gender_field_id]
         expected_p_related_genders = frozenset([Placeholder(expected)])
         assert p_related_genders == expected_p_related_genders
+
+
+class TestTransaction3(TestTransaction2):
+
+    format = 3
@@ -68,3 +68,10 @@ class TestTransactionBeforeAfter2(BaseTransactionBeforeAfter):
     include = True
 
     format = 2
+
+
+class TestTransactionBeforeAfter3(BaseTransactionBeforeAfter):
+
+    include = True
+
+    format = 3
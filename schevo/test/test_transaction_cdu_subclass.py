@@ -100,3 +100,10 @@ class TestTransactionCDUSubclass2(BaseTransactionCDUSubclass):
     include = True
 
     format = 2
+
+
+class TestTransactionCDUSubclass3(BaseTransactionCDUSubclass):
+
+    include = True
+
+    format = 3
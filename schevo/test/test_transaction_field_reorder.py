@@ -83,3 +83,10 @@ class TestTransactionFieldReorder2(BaseTransactionFieldReorder):
     include = True
 
     format = 2
+
+
+class TestTransactionFieldReorder3(BaseTransactionFieldReorder):
+
+    include = True
+
+    format = 3
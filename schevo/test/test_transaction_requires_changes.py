@@ -60,3 +60,10 @@ class TestTransactionRequireChanges2(BaseTransactionRequireChanges):
     include = True
 
     format = 2
+
+
+class TestTransactionRequireChanges3(BaseTransactionRequireChanges):
+
+    include = True
+
+    format = 3
@@ -113,3 +113,10 @@ class TestValidValuesResolve2(BaseValidValuesResolve):
     include = True
 
     format = 2
+
+
+class TestValidValuesResolve3(BaseValidValuesResolve):
+
+    include = True
+
+    format = 3
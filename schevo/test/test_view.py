@@ -118,3 +118,10 @@ class TestView2(BaseView):
     include = True
 
     format = 2
+
+
+class TestView3(BaseView):
+
+    include = True
+
+    format = 3
@@ -12,7 +12,6 @@ from schevo.constant import (CASCADE, DEFAULT, REMOVE, RESTRICT,
                              UNASSIGN, UNASSIGNED)
 from schevo.error import (
     DeleteRestricted,
-    KeyCollision,
     SchemaError,
     TransactionExecuteRedefinitionRestricted,
     TransactionExpired,
@@ -327,101 +326,9 @@ class Delete(Transaction):
         entity = self._entity
         if entity._rev != self._rev:
             raise TransactionExpired(self, self._rev, entity._rev)
-        deletes = self._deletes
         # Before execute callback.
         self._before_execute(db, entity)
-        # Build list of direct and indirect references.
-        traversed = set()
-        restricters = dict()
-        cascaders = dict()
-        unassigners = dict()
-        removers = dict()
-        find_references(db, entity, traversed,
-                        restricters, cascaders, unassigners, removers)
-        # Referrers should be removed from restricters if they are
-        # also requesting cascade deletion.
-        restricter_keys = set(restricters) - set(cascaders)
-        # The entity whose deletion was requested should never be
-        # considered a restricter.
-        restricter_keys.discard(entity)
-        if len(restricter_keys) != 0:
-            # Raise DeleteRestricted if there are any restricters left
-            # over.
-            error = DeleteRestricted()
-            for referrer in restricter_keys:
-                restricter_set = restricters[referrer]
-                for f_name, referred in restricter_set:
-                    error.add(referred, referrer, f_name)
-            if error.restrictions:
-                raise error
-        else:
-            # Convert all restricters to cascaders so that fields are
-            # unassigned properly before deletion.
-            for referrer, field_referred_set in restricters.iteritems():
-                field_names = cascaders.setdefault(referrer, set())
-                for field_name, referred in field_referred_set:
-                    field_names.add(field_name)
-        # Unassign fields requested by unassigners.
-        for referrer, field_referred_set in unassigners.iteritems():
-            tx = referrer.t.update()
-            for f_name, referred in field_referred_set:
-                tx.f[f_name]._unassign(referred)
-            db.execute(tx)
-        # Remove values from fields marked as removers.
-        for referrer, field_referred_set in removers.iteritems():
-            tx = referrer.t.update()
-            for f_name, referred in field_referred_set:
-                tx.f[f_name]._remove(referred)
-            db.execute(tx)
-        # Forceably update fields to UNASSIGNED first to prevent
-        # DeleteRestrict from being raised by the database itself.
-        referrers = set()
-        for referrer, field_names in cascaders.iteritems():
-            field_map = referrer.s.field_map(not_fget)
-            field_dump_map = dict(field_map.dump_map())
-            field_related_entity_map = dict(field_map.related_entity_map())
-            new_dump_map = dict((name, UNASSIGNED) for name in field_names)
-            new_related_entity_map = dict(
-                (name, frozenset()) for name in field_names)
-            field_dump_map.update(new_dump_map)
-            field_related_entity_map.update(new_related_entity_map)
-            extent = referrer._extent
-            extent_name = extent.name
-            oid = referrer._oid
-            try:
-                db._update_entity(
-                    extent_name, oid, field_dump_map, field_related_entity_map)
-            except KeyCollision:
-                # Since it takes more time to relax an index, only do
-                # it when we find a key collision.
-                extent.relax_all_indices()
-                # Try the update again.
-                db._update_entity(
-                    extent_name, oid, field_dump_map, field_related_entity_map)
-            referrers.add((extent_name, oid, referrer))
-        # Everything checks out okay for this entity, so add it to the
-        # set of deleted entities.
-        deletes.add((entity.__class__, entity._oid))
-        # Delete entities in a deterministic (sorted) fashion.
-        for extent_name, oid, referrer in sorted(referrers):
-            referrer_e_o = referrer.__class__, referrer._oid
-            if referrer_e_o in deletes:
-                # Skip the original entity whose deletion was
-                # requested, since we must delete it using a call to
-                # the database's `_delete_entity` method.  Also skip
-                # any entity that has already been deleted.
-                continue
-            if not db._extent_contains_oid(extent_name, oid):
-                # A nested transaction or cascade deleted this entity
-                # before we could.
-                continue
-            tx = referrer.t.delete()
-            tx._deletes.update(deletes)
-            db.execute(tx, strict=False)
-        # Attempt to delete the entity itself.
-        extent_name = self._extent_name
-        oid = entity._oid
-        db._delete_entity(extent_name, oid)
+        execute_delete(db, [entity], self)
         self._after_execute(db)
         return None
 
@@ -444,9 +351,9 @@ class DeleteSelected(Transaction):
         pass
 
     def _execute(self, db):
-        for entity in self._selection:
-            if entity in entity._extent:
-                db.execute(entity.t.delete())
+        entities = [entity for entity in self._selection
+                    if entity in entity._extent]
+        execute_delete(db, entities, self)
         return None
 
 
@@ -785,32 +692,166 @@ class CallableWrapper(Transaction):
 # ---------------------------------------------------------------------
 
 
-def find_references(db, entity, traversed,
-                    restricters, cascaders, unassigners, removers):
-    """Support function for Delete transactions.  Acts recursively to
-    get a list of all entities directly or indirectly related to
-    `entity`.
+def execute_delete(db, entities, tx):
+    """Support function for Delete and DeleteSelected transactions.
+    Delete `entities`, and the entities that cascade deletion reaches
+    from them, as planned by `plan_delete`.
 
-    NOTE: This function returns nothing.  Instead, the `references`
-    and `traversed` arguments are mutated.
+    Deletion is restricted if any entity that is not being deleted
+    refers to one that is, with a RESTRICT reference.  Otherwise, each
+    entity that refers to deleted entities with UNASSIGN or REMOVE
+    references is updated once, and then all the entities are deleted
+    together.  Referrers whose Update transactions are customized are
+    updated by executing those transactions; the others are updated
+    together by the database.
 
-    - `db`: The database the Delete is occuring in.
+    The `_before_execute` and `_after_execute` methods of an entity's
+    Delete transaction are called for each deleted entity whose class
+    overrides them, except for the entity deleted by `tx`.  Entities
+    whose Delete transactions override `_execute` are instead deleted
+    by executing those transactions, after the others.
 
-    - `entity`: The entity to inspect when adding to the references
-      list.
+    - `db`: The database the deletion is occuring in.
 
-    The following arguments are directly mutated during execution:
+    - `entities`: The entities whose deletion was requested.
 
-    - `traversed`: The set of already-traversed entities.
+    - `tx`: The Delete or DeleteSelected transaction being executed.
+      Entities in its `_deletes` are being deleted by an enclosing
+      Delete transaction, so they do not restrict deletion.
+    """
+    known = set((EntityClass.__name__, oid)
+                for EntityClass, oid in tx._deletes)
+    deletes, restricters, unassigners, removers = plan_delete(
+        db, entities, known)
+    if restricters:
+        error = DeleteRestricted()
+        for referrer, field_referred_set in restricters.iteritems():
+            for f_name, referred in field_referred_set:
+                error.add(referred, referrer, f_name)
+        raise error
+    # Unassign and remove values from the fields of referrers, in a
+    # deterministic (sorted) fashion.
+    referrers = set(unassigners)
+    referrers.update(removers)
+    referrers = sorted((referrer._extent.name, referrer._oid, referrer)
+                       for referrer in referrers)
+    updates = []
+    update_customized = {}
+    for extent_name, oid, referrer in referrers:
+        unassigns = unassigners.get(referrer, ())
+        removes = removers.get(referrer, ())
+        customized = update_customized.get(extent_name)
+        if customized is None:
+            customized = update_customized[extent_name] = (
+                _update_is_customized(referrer._Update))
+        if not customized:
+            updates.append((referrer, unassigns, removes))
+            continue
+        update_tx = referrer.t.update()
+        for f_name, referred in unassigns:
+            update_tx.f[f_name]._unassign(referred)
+        for f_name, referred in removes:
+            update_tx.f[f_name]._remove(referred)
+        db.execute(update_tx)
+    if updates:
+        db._remove_references(updates)
+    # Find the entities whose Delete transactions customize execution.
+    own_entity = getattr(tx, '_entity', None)
+    hooked = []
+    executed = []
+    customized_by_extent = {}
+    entity = db._entity
+    for extent_name, oid in sorted(deletes):
+        customized = customized_by_extent.get(extent_name)
+        if customized is None:
+            DeleteClass = db.extent(extent_name).EntityClass._Delete
+            customized = customized_by_extent[extent_name] = (
+                DeleteClass._execute.im_func is not Delete._execute.im_func,
+                DeleteClass._before_execute.im_func
+                is not Delete._before_execute.im_func
+                or DeleteClass._after_execute.im_func
+                is not Delete._after_execute.im_func,
+                )
+        executes, hooks = customized
+        if executes or hooks:
+            deleted = entity(extent_name, oid)
+            if deleted == own_entity:
+                continue
+            if executes:
+                executed.append((extent_name, oid))
+            else:
+                hooked.append((deleted, deleted.t.delete()))
+    # Entities deleted by their own Delete transactions must not refer
+    # to the others once those are deleted, so that the deletes can be
+    # inverted.
+    if executed:
+        for extent_name, oid in executed:
+            deletes.discard((extent_name, oid))
+        tx._deletes.update(
+            (db.extent(extent_name).EntityClass, oid)
+            for extent_name, oid in executed)
+        planned = set(deletes)
+        planned.update(executed)
+        extent_id_name = db._extent_id_name
+        for extent_name, oid in executed:
+            field_names = [
+                field_name for field_name, related_entity_set in
+                db._entity_related_entities(extent_name, oid).iteritems()
+                if [placeholder for placeholder in related_entity_set
+                    if (extent_id_name[placeholder.extent_id],
+                        placeholder.oid) in planned]
+                ]
+            if field_names:
+                db._unassign_entity_fields(extent_name, oid, field_names)
+    for deleted, delete_tx in hooked:
+        delete_tx._before_execute(db, deleted)
+    db._delete_entities(deletes)
+    for deleted, delete_tx in hooked:
+        delete_tx._after_execute(db)
+    for extent_name, oid in executed:
+        if not db._extent_contains_oid(extent_name, oid):
+            # A cascade from another of these transactions deleted
+            # this entity before we could.
+            continue
+        delete_tx = entity(extent_name, oid).t.delete()
+        delete_tx._deletes.update(tx._deletes)
+        db.execute(delete_tx, strict=False)
+
+
+def _update_is_customized(UpdateClass):
+    """Return True if Update transactions of `UpdateClass` do more than
+    change the values of fields, so that they must be executed."""
+    for name in ('_setup', '_before_execute', '_during_execute',
+                 '_after_execute', '_execute'):
+        if (getattr(UpdateClass, name).im_func
+            is not getattr(Update, name).im_func):
+            return True
+    if UpdateClass._call_change_handlers_on_init:
+        for name in dir(UpdateClass):
+            if name.startswith('h_'):
+                return True
+    return False
+
+
+def plan_delete(db, entities, known=()):
+    """Support function for Delete and DeleteSelected transactions.
+    Find the entities deleted along with `entities`, and the references
+    to them.  Entities in `known`, a set of ``(extent_name, oid)``
+    pairs, are being deleted already, and are not planned again.
+
+    Entities that refer to an entity being deleted with a CASCADE
+    reference are deleted too, and so on.  They are found iteratively,
+    reading the links to each entity only once.
+
+    Return a ``(deletes, restricters, unassigners, removers)`` tuple:
+
+    - `deletes`: Set of ``(extent_name, oid)`` pairs of the entities to
+      delete, including `entities`.
 
     - `restricters`: Dictionary of ``referrer: set([(f_name,
       referred), ...])`` pairs storing information about references
       that RESTRICT deletion.
 
-    - `cascaders`: Dictionary of ``referrer: set([f_name, ...])``
-      pairs storing information about references that allow CASCADE
-      deletion.
-
     - `unassigners`: Dictionary of ``referrer: set([(f_name,
       referred), ...])`` pairs storing information about references
       that desire to UNASSIGN values on deletion.
@@ -818,43 +859,64 @@ def find_references(db, entity, traversed,
     - `removers`: Dictionary of ``referrer: set([(f_name, referred),
       ...])`` pairs storing information about references that desire
       to REMOVE values on deletion.
+
+    Referrers that are being deleted themselves, or are in `known`, are
+    left out of `restricters`, `unassigners`, and `removers`.
     """
-    if entity in traversed:
-        return
-    traversed.add(entity)
-    entity_extent_name = entity._extent.name
-    for (e_name, f_name), others in entity.s.links().iteritems():
-        extent = db.extent(e_name)
-        field_class = extent.field_spec[f_name]
-        on_delete_get = field_class.on_delete.get
-        on_delete_default = field_class.on_delete_default
-        for referrer in others:
-            on_delete = on_delete_get(entity_extent_name, on_delete_default)
-            if on_delete is RESTRICT:
-                if referrer == entity:
-                    # Don't restrict when an entity refers to
-                    # itself. Instead, treat it as a CASCADE delete.
-                    field_names = cascaders.setdefault(referrer, set())
-                    field_names.add(f_name)
-                else:
-                    field_referred_set = restricters.setdefault(
-                        referrer, set())
-                    field_referred_set.add((f_name, entity))
-            elif on_delete is CASCADE:
-                field_names = cascaders.setdefault(referrer, set())
-                field_names.add(f_name)
-            elif on_delete is UNASSIGN:
-                field_referred_set = unassigners.setdefault(referrer, set())
-                field_referred_set.add((f_name, entity))
-            elif on_delete is REMOVE:
-                field_referred_set = removers.setdefault(referrer, set())
-                field_referred_set.add((f_name, entity))
+    deletes = set()
+    pending = []
+    for entity in entities:
+        key = (entity._extent.name, entity._oid)
+        if key not in deletes:
+            deletes.add(key)
+            pending.append(key)
+    references = {
+        RESTRICT: [],
+        UNASSIGN: [],
+        REMOVE: [],
+        }
+    on_delete_by_link = {}
+    while pending:
+        key = pending.pop()
+        extent_name = key[0]
+        for other_extent_name, f_name, other_oids in db._entity_link_oids(
+            *key):
+            link = (other_extent_name, f_name, extent_name)
+            on_delete = on_delete_by_link.get(link)
+            if on_delete is None:
+                field_class = db.extent(other_extent_name).field_spec[f_name]
+                on_delete = on_delete_by_link[link] = field_class.on_delete.get(
+                    extent_name, field_class.on_delete_default)
+            if on_delete is CASCADE:
+                for other_oid in other_oids:
+                    other_key = (other_extent_name, other_oid)
+                    if other_key not in deletes and other_key not in known:
+                        deletes.add(other_key)
+                        pending.append(other_key)
+            elif on_delete in references:
+                append = references[on_delete].append
+                for other_oid in other_oids:
+                    append(((other_extent_name, other_oid), f_name, key))
             else:
                 raise ValueError(
                     'Unrecognized on_delete value %r' % on_delete)
-            if on_delete is CASCADE:
-                find_references(db, referrer, traversed,
-                                restricters, cascaders, unassigners, removers)
+    # Only now that all deletes are known can references from them be
+    # left out.
+    entity = db._entity
+    def referrers(references):
+        result = {}
+        for referrer_key, f_name, referred_key in references:
+            if referrer_key not in deletes and referrer_key not in known:
+                field_referred_set = result.setdefault(
+                    entity(*referrer_key), set())
+                field_referred_set.add((f_name, entity(*referred_key)))
+        return result
+    return (
+        deletes,
+        referrers(references[RESTRICT]),
+        referrers(references[UNASSIGN]),
+        referrers(references[REMOVE]),
+        )
 
 
 def resolve(db, field_name, value, FieldClass, field_names=None):